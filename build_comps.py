@@ -0,0 +1,342 @@
+import sys
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+from vantage_pipeline import bump_generation
+
+# --- CONFIGURATION ---
+DB_PATH = "sqlite:///vantage.db"
+SQM_TO_SQFT = 10.764
+HALF_LIFE_DAYS = 365          # Recency weighting: a sale this old counts half as much as one made today
+MIN_PSF, MAX_PSF = 20, 5000   # £/sqft outside this range is a bad link or a non-market sale, not a comp
+MIN_COMPS = 5                 # Fewest sales for an area's statistics to be the headline figure
+LEVELS = ('postcode', 'sector', 'district')
+INDEX_SMOOTH_MONTHS = 5       # Centred window for the fallback price index (single months are too thin)
+
+def ensure_tables(conn):
+    # One row per PPD sale we could size from an EPC
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS comps_sales (
+            transaction_id VARCHAR(40) PRIMARY KEY,
+            postcode VARCHAR(10),
+            sector VARCHAR(10),
+            district VARCHAR(10),
+            transfer_date DATE,
+            price_paid INTEGER,
+            property_type CHAR(1),
+            uprn VARCHAR(20),
+            floor_area NUMERIC,
+            price_per_sqft REAL,
+            match_rule VARCHAR(10)
+        )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_comps_sales_postcode ON comps_sales(postcode)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_comps_sales_district ON comps_sales(district)"))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS comps_summary (
+            level VARCHAR(10),
+            area VARCHAR(10),
+            district VARCHAR(10),
+            sale_count INTEGER,
+            median_psf REAL,
+            q1_psf REAL,
+            q3_psf REAL,
+            iqr_psf REAL,
+            weighted_mean_psf REAL,
+            first_sale DATE,
+            last_sale DATE,
+            refreshed_at DATETIME,
+            PRIMARY KEY (level, area)
+        )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_comps_summary_district ON comps_summary(district)"))
+    # Local price level per district and month, used to time-adjust comps ('median_psf' is the fallback method)
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS price_index (
+            method VARCHAR(20),
+            district VARCHAR(10),
+            month CHAR(7),           -- 'YYYY-MM'
+            index_value REAL,        -- 100 at the district's first month
+            observations INTEGER,    -- Sales (or repeat pairs) behind the month
+            PRIMARY KEY (method, district, month)
+        )
+    """))
+    # Per-postcode fingerprints of the inputs: what changed since the last run
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS comps_postcode_state (
+            postcode VARCHAR(10) PRIMARY KEY,
+            sales_sig TEXT,
+            epc_sig TEXT
+        )
+    """))
+    conn.commit()
+
+def normalize_postcode(postcode):
+    return " ".join(str(postcode).upper().split())
+
+def postcode_levels(postcode):
+    """
+    'E1 1BY' -> {'postcode': 'E1 1BY', 'sector': 'E1 1', 'district': 'E1'}.
+    A partial postcode ('E1 1', 'E1') gives only the levels it pins down.
+    """
+    outward, _, inward = normalize_postcode(postcode).partition(" ")
+    levels = {}
+    if len(inward) == 3:
+        levels['postcode'] = f"{outward} {inward}"
+    if inward:
+        levels['sector'] = f"{outward} {inward[0]}"
+    if outward:
+        levels['district'] = outward
+    return levels
+
+def with_levels(df):
+    parts = df['postcode'].str.upper().str.split().str.join(" ").str.partition(" ")
+    df['postcode'] = parts[0] + " " + parts[2]
+    df['sector'] = parts[0] + " " + parts[2].str[:1]
+    df['district'] = parts[0]
+    return df
+
+def address_keys(addresses):
+    """
+    Vectorised match keys that survive token order ('12 FLAT 3 HIGH STREET' vs
+    'Flat 3, 12 High Street'): the sorted address tokens, and the sorted house/flat numbers.
+    """
+    tokens = addresses.fillna('').str.upper().str.replace(r"[^A-Z0-9 ]", " ", regex=True).str.split()
+    full_key = tokens.map(lambda t: " ".join(sorted(t)))
+    number_key = tokens.map(lambda t: " ".join(sorted(x for x in t if x[0].isdigit())))
+    return full_key, number_key
+
+def find_dirty_postcodes(conn, full=False):
+    """
+    Postcodes whose sales or EPC floor areas changed since the last run (all of them when `full`).
+    Returns (dirty postcodes, current fingerprints to save once they've been processed).
+    """
+    sales = pd.read_sql(text("""
+        SELECT postcode, COUNT(*) || ':' || SUM(price_paid) || ':' || MAX(transfer_date) AS sales_sig
+        FROM raw_ppd_staging
+        WHERE postcode IS NOT NULL
+        GROUP BY postcode
+    """), conn)
+    epcs = pd.read_sql(text("""
+        SELECT p.postcode, COUNT(*) || ':' || SUM(e.floor_area) || ':' || MAX(e.certificate_id) AS epc_sig
+        FROM epc_assessments e
+        JOIN master_properties p ON p.uprn = e.uprn
+        WHERE p.postcode IS NOT NULL
+        GROUP BY p.postcode
+    """), conn)
+    current = sales.merge(epcs, on='postcode', how='outer')
+    if full:
+        return set(current['postcode']), current
+
+    saved = pd.read_sql(text("SELECT postcode, sales_sig, epc_sig FROM comps_postcode_state"), conn)
+    merged = current.merge(saved, on='postcode', how='outer', suffixes=('', '_saved'))
+    changed = (
+        (merged['sales_sig'].fillna('') != merged['sales_sig_saved'].fillna('')) |
+        (merged['epc_sig'].fillna('') != merged['epc_sig_saved'].fillna(''))
+    )
+    return set(merged.loc[changed, 'postcode']), current
+
+def link_sales(conn, postcodes):
+    """
+    Sizes every sale in `postcodes` from the latest EPC of the same address: an exact
+    (token-sorted) address match first, then a unique house/flat number match in the postcode.
+    """
+    targets = pd.DataFrame({'postcode': sorted(postcodes)})
+    # comps_sales holds postcodes as with_levels() writes them, whatever spacing or case they arrived in
+    targets['stored_postcode'] = with_levels(targets.copy())['postcode']
+    targets.to_sql('temp_comps_postcodes', conn, if_exists='replace', index=False)
+    sales = pd.read_sql(text("""
+        SELECT s.transaction_id, s.postcode, s.transfer_date, s.price_paid, s.property_type, s.full_address
+        FROM raw_ppd_staging s
+        JOIN temp_comps_postcodes t ON t.postcode = s.postcode
+        WHERE s.price_paid > 0
+    """), conn)
+    epcs = pd.read_sql(text("""
+        SELECT uprn, postcode, address_line_1, floor_area FROM (
+            SELECT p.uprn, p.postcode, p.address_line_1, e.floor_area,
+                   ROW_NUMBER() OVER (PARTITION BY e.uprn ORDER BY e.inspection_date DESC, e.certificate_id DESC) AS rn
+            FROM epc_assessments e
+            JOIN master_properties p ON p.uprn = e.uprn
+            JOIN temp_comps_postcodes t ON t.postcode = p.postcode
+        )
+        WHERE rn = 1 AND floor_area > 0
+    """), conn)
+
+    linked = pd.DataFrame()
+    if not sales.empty and not epcs.empty:
+        sales['postcode'] = sales['postcode'].map(normalize_postcode)
+        epcs['postcode'] = epcs['postcode'].map(normalize_postcode)
+        sales['full_key'], sales['number_key'] = address_keys(sales['full_address'])
+        epcs['full_key'], epcs['number_key'] = address_keys(epcs['address_line_1'])
+
+        passes = []
+        remaining = sales
+        for rule, key in (('address', 'full_key'), ('numbers', 'number_key')):
+            # Keys shared by two EPC'd properties in one postcode are ambiguous: no link
+            candidates = epcs[epcs[key] != ''].drop_duplicates(['postcode', key], keep=False)
+            matched = remaining.merge(candidates[['postcode', key, 'uprn', 'floor_area']], on=['postcode', key])
+            matched['match_rule'] = rule
+            passes.append(matched)
+            remaining = remaining[~remaining['transaction_id'].isin(matched['transaction_id'])]
+        linked = pd.concat(passes, ignore_index=True)
+
+    if not linked.empty:
+        linked['price_per_sqft'] = linked['price_paid'] / (linked['floor_area'].astype(float) * SQM_TO_SQFT)
+        linked = with_levels(linked[linked['price_per_sqft'].between(MIN_PSF, MAX_PSF)].copy())
+
+    conn.execute(text("""
+        DELETE FROM comps_sales WHERE postcode IN (SELECT stored_postcode FROM temp_comps_postcodes)
+    """))
+    if not linked.empty:
+        columns = ['transaction_id', 'postcode', 'sector', 'district', 'transfer_date', 'price_paid',
+                   'property_type', 'uprn', 'floor_area', 'price_per_sqft', 'match_rule']
+        linked[columns].to_sql('temp_comps_sales', conn, if_exists='replace', index=False)
+        conn.execute(text(f"""
+            INSERT OR REPLACE INTO comps_sales ({', '.join(columns)})
+            SELECT {', '.join(columns)} FROM temp_comps_sales
+        """))
+        conn.execute(text("DROP TABLE temp_comps_sales"))
+    conn.execute(text("DROP TABLE temp_comps_postcodes"))
+    return len(sales), len(linked)
+
+def area_stats(sales, level):
+    """
+    Median, quartiles and a recency-weighted mean of £/sqft per area at one level.
+    The weighted mean drops sales outside the Tukey fences (1.5 x IQR) so one bad link can't drag it.
+    """
+    groups = sales.groupby(level)['price_per_sqft']
+    quartiles = groups.quantile([0.25, 0.5, 0.75]).unstack()
+    dates = sales.groupby(level)['transfer_date']
+    stats = pd.DataFrame({
+        'sale_count': groups.size(),
+        'q1_psf': quartiles[0.25],
+        'median_psf': quartiles[0.5],
+        'q3_psf': quartiles[0.75],
+        'first_sale': dates.min(),
+        'last_sale': dates.max(),
+    })
+    stats['iqr_psf'] = stats['q3_psf'] - stats['q1_psf']
+
+    fences = sales[[level, 'price_per_sqft', 'age_days']].join(stats[['q1_psf', 'q3_psf', 'iqr_psf']], on=level)
+    inside = fences['price_per_sqft'].between(
+        fences['q1_psf'] - 1.5 * fences['iqr_psf'], fences['q3_psf'] + 1.5 * fences['iqr_psf']
+    )
+    weights = np.power(0.5, fences['age_days'] / HALF_LIFE_DAYS) * inside
+    weighted = (weights * fences['price_per_sqft']).groupby(fences[level]).sum()
+    stats['weighted_mean_psf'] = weighted / weights.groupby(fences[level]).sum()
+
+    stats = stats.reset_index().rename(columns={level: 'area'})
+    stats['level'] = level
+    return stats
+
+def median_index(sales):
+    """
+    Fallback price index per district: the monthly median £/sqft, smoothed over a centred
+    INDEX_SMOOTH_MONTHS window, with empty months interpolated. Rebased to 100 at the first month.
+    """
+    sales = sales.assign(month=pd.to_datetime(sales['transfer_date'], errors='coerce').dt.to_period('M'))
+    sales = sales[sales['month'].notna()]
+    monthly = sales.groupby(['district', 'month'])['price_per_sqft'].agg(['median', 'size'])
+
+    frames = []
+    for district, group in monthly.groupby(level='district'):
+        group = group.droplevel('district')
+        group = group.reindex(pd.period_range(group.index.min(), group.index.max(), freq='M'))
+        level = group['median'].rolling(INDEX_SMOOTH_MONTHS, center=True, min_periods=1).median().interpolate()
+        frames.append(pd.DataFrame({
+            'method': 'median_psf',
+            'district': district,
+            'month': group.index.strftime('%Y-%m'),
+            'index_value': 100 * level.values / level.iloc[0],
+            'observations': group['size'].fillna(0).astype(int).values,
+        }))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+def summarize(conn, districts):
+    """
+    Recomputes comps_summary for whole districts (every postcode, sector and the district itself),
+    and their fallback price index.
+    """
+    pd.DataFrame({'district': sorted(districts)}).to_sql('temp_comps_districts', conn, if_exists='replace', index=False)
+    sales = pd.read_sql(text("""
+        SELECT s.postcode, s.sector, s.district, s.transfer_date, s.price_per_sqft
+        FROM comps_sales s
+        JOIN temp_comps_districts t ON t.district = s.district
+    """), conn)
+    conn.execute(text("DELETE FROM comps_summary WHERE district IN (SELECT district FROM temp_comps_districts)"))
+    conn.execute(text("""
+        DELETE FROM price_index
+        WHERE method = 'median_psf' AND district IN (SELECT district FROM temp_comps_districts)
+    """))
+    conn.execute(text("DROP TABLE temp_comps_districts"))
+    if sales.empty:
+        return 0
+
+    today = pd.Timestamp(datetime.now().date())
+    sales['age_days'] = (today - pd.to_datetime(sales['transfer_date'], errors='coerce')).dt.days.clip(lower=0).fillna(0)
+
+    summary = pd.concat([area_stats(sales, level) for level in LEVELS], ignore_index=True)
+    summary['district'] = summary['area'].str.split(" ").str[0]
+    summary['refreshed_at'] = datetime.now().isoformat(timespec='seconds')
+
+    columns = ['level', 'area', 'district', 'sale_count', 'median_psf', 'q1_psf', 'q3_psf', 'iqr_psf',
+               'weighted_mean_psf', 'first_sale', 'last_sale', 'refreshed_at']
+    summary[columns].to_sql('temp_comps_summary', conn, if_exists='replace', index=False)
+    conn.execute(text(f"""
+        INSERT OR REPLACE INTO comps_summary ({', '.join(columns)})
+        SELECT {', '.join(columns)} FROM temp_comps_summary
+    """))
+    conn.execute(text("DROP TABLE temp_comps_summary"))
+
+    median_index(sales).to_sql('price_index', conn, if_exists='append', index=False)
+    return len(summary)
+
+def refresh_comps(engine, full=False):
+    """
+    Incremental by default: only postcodes whose sales or EPCs changed are re-linked,
+    and only their districts re-summarised. Called by the PPD and EPC ingests.
+    """
+    with engine.connect() as conn:
+        ensure_tables(conn)
+        dirty, fingerprints = find_dirty_postcodes(conn, full)
+        if not dirty:
+            print("📐 Comps up to date: no sales or EPC changes.")
+            return 0
+
+        if full:
+            conn.execute(text("DELETE FROM comps_sales"))
+            conn.execute(text("DELETE FROM comps_summary"))
+            conn.execute(text("DELETE FROM price_index WHERE method = 'median_psf'"))
+        sales, linked = link_sales(conn, dirty)
+        districts = {levels['district'] for levels in map(postcode_levels, dirty) if 'district' in levels}
+        areas = summarize(conn, districts)
+
+        fingerprints.to_sql('temp_comps_state', conn, if_exists='replace', index=False)
+        conn.execute(text("DELETE FROM comps_postcode_state"))
+        conn.execute(text("""
+            INSERT INTO comps_postcode_state (postcode, sales_sig, epc_sig)
+            SELECT postcode, sales_sig, epc_sig FROM temp_comps_state
+        """))
+        conn.execute(text("DROP TABLE temp_comps_state"))
+        conn.commit()
+
+    print(f"📐 Comps refreshed for {len(dirty)} postcodes / {len(districts)} districts: "
+          f"{linked}/{sales} sales sized, {areas} area summaries.")
+    return areas
+
+def build_comps(full=False):
+    print("📐 BUILDING COMPS SURFACE (£/sqft by postcode, sector, district)")
+    print("============================================")
+
+    engine = create_engine(DB_PATH)
+    areas = refresh_comps(engine, full=full)
+    bump_generation(engine, 'comps')
+
+    print("============================================")
+    print("🎉 COMPS SURFACE COMPLETE.")
+    print(f"📊 Area Summaries Written: {areas}")
+    print("============================================")
+
+if __name__ == "__main__":
+    build_comps(full="--full" in sys.argv)
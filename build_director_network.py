@@ -0,0 +1,253 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+import pandas as pd
+from sqlalchemy import create_engine, text
+from vantage_companies import AsyncCompaniesHouseRegistry, normalize_company_number, normalized_number_sql
+from enrich_owners import ensure_tables as ensure_enrichment_tables
+from vantage_pipeline import bump_generation
+
+# --- CONFIGURATION ---
+DB_PATH = "sqlite:///vantage.db"
+CONCURRENCY = 25
+WRITE_BATCH = 200       # Officers per DB transaction (also the checkpoint granularity)
+REFRESH_DAYS = 30       # Re-walk an officer's appointments after this long
+
+def ensure_tables(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS officers (
+            officer_id VARCHAR(64) PRIMARY KEY,
+            name TEXT,
+            birth_month VARCHAR(7),
+            appointment_count INTEGER,
+            fetched_at DATETIME
+        )
+    """))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS officer_appointments (
+            officer_id VARCHAR(64),
+            company_number VARCHAR(20),
+            company_name TEXT,
+            officer_role VARCHAR(50),
+            appointed_on DATE,
+            resigned_on DATE,
+            PRIMARY KEY (officer_id, company_number, officer_role)
+        )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_appointments_company ON officer_appointments(company_number)"))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS officer_portfolio (
+            officer_id VARCHAR(64) PRIMARY KEY,
+            company_count INTEGER,
+            active_company_count INTEGER,
+            title_count INTEGER,
+            fg_asset_count INTEGER,
+            updated_at DATETIME
+        )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_portfolio_titles ON officer_portfolio(title_count)"))
+    # CH number -> CCOD local ID(s), so appointments at any company can reach its titles
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS company_keys (
+            ch_number VARCHAR(20),
+            local_company_number VARCHAR(20),
+            PRIMARY KEY (ch_number, local_company_number)
+        )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_company_keys_local ON company_keys(local_company_number)"))
+    conn.commit()
+
+def officer_id_from(item):
+    """
+    CH officer IDs only appear inside links: '/officers/<id>/appointments'.
+    """
+    link = ((item.get('links') or {}).get('officer') or {}).get('appointments', '')
+    parts = link.strip('/').split('/')
+    return parts[1] if len(parts) >= 2 and parts[0] == 'officers' else None
+
+def refresh_company_keys(conn):
+    rows = conn.execute(text("SELECT company_number FROM corporate_registry")).fetchall()
+    keys = pd.DataFrame(
+        [(normalize_company_number(r[0]), r[0]) for r in rows if normalize_company_number(r[0])],
+        columns=['ch_number', 'local_company_number']
+    )
+    keys.to_sql('temp_company_keys', conn, if_exists='replace', index=False)
+    conn.execute(text("""
+        INSERT OR IGNORE INTO company_keys (ch_number, local_company_number)
+        SELECT ch_number, local_company_number FROM temp_company_keys
+    """))
+    conn.commit()
+
+def load_targets(conn):
+    """
+    Officers of enriched owners whose appointments we haven't walked recently.
+    """
+    cutoff = (datetime.now() - timedelta(days=REFRESH_DAYS)).isoformat(timespec='seconds')
+    fresh = {r[0] for r in conn.execute(text("SELECT officer_id FROM officers WHERE fetched_at >= :c"), {"c": cutoff})}
+
+    targets = {}
+    for (officers_json,) in conn.execute(text("SELECT officers_json FROM company_enrichment WHERE officers_json IS NOT NULL")):
+        for item in json.loads(officers_json):
+            officer_id = officer_id_from(item)
+            if officer_id and officer_id not in fresh:
+                targets.setdefault(officer_id, item)
+    return targets
+
+def write_batch(engine, results):
+    now = datetime.now().isoformat(timespec='seconds')
+    officers, appointments = [], []
+    for officer_id, officer, items in results:
+        # Appointment items don't carry the DOB; the company officer listing does
+        dob = officer.get('date_of_birth') or {}
+        officers.append({
+            "id": officer_id,
+            "name": officer.get('name'),
+            "dob": f"{dob.get('year')}-{str(dob.get('month')).zfill(2)}" if dob else None,
+            "count": len(items),
+            "at": now
+        })
+        for a in items:
+            company = a.get('appointed_to') or {}
+            number = normalize_company_number(company.get('company_number'))
+            if not number:
+                continue
+            appointments.append({
+                "id": officer_id,
+                "number": number,
+                "name": company.get('company_name'),
+                "role": a.get('officer_role') or 'unknown',
+                "appointed": a.get('appointed_on'),
+                "resigned": a.get('resigned_on')
+            })
+
+    with engine.connect() as conn:
+        conn.execute(text("DELETE FROM officer_appointments WHERE officer_id = :id"), [{"id": o["id"]} for o in officers])
+        if appointments:
+            conn.execute(text("""
+                INSERT OR REPLACE INTO officer_appointments
+                (officer_id, company_number, company_name, officer_role, appointed_on, resigned_on)
+                VALUES (:id, :number, :name, :role, :appointed, :resigned)
+            """), appointments)
+        conn.execute(text("""
+            INSERT OR REPLACE INTO officers (officer_id, name, birth_month, appointment_count, fetched_at)
+            VALUES (:id, :name, :dob, :count, :at)
+        """), officers)
+        refresh_portfolios(conn, [o["id"] for o in officers])
+        conn.commit()
+
+def refresh_portfolios(conn, officer_ids):
+    """
+    Precomputes the director rollup: companies -> CCOD titles -> F/G assets
+    (a UPRN counts when its latest EPC is F/G, i.e. it is in distress_assets).
+    """
+    pd.DataFrame({'officer_id': officer_ids}).to_sql('temp_portfolio_officers', conn, if_exists='replace', index=False)
+    conn.execute(text("""
+        INSERT OR REPLACE INTO officer_portfolio
+        (officer_id, company_count, active_company_count, title_count, fg_asset_count, updated_at)
+        SELECT t.officer_id,
+               COUNT(DISTINCT a.company_number),
+               COUNT(DISTINCT CASE WHEN a.resigned_on IS NULL THEN a.company_number END),
+               COUNT(DISTINCT CASE WHEN a.resigned_on IS NULL THEN o.title_number END),
+               COUNT(DISTINCT CASE WHEN a.resigned_on IS NULL THEN d.uprn END),
+               :now
+        FROM temp_portfolio_officers t
+        LEFT JOIN officer_appointments a ON a.officer_id = t.officer_id
+        LEFT JOIN company_keys k ON k.ch_number = a.company_number
+        LEFT JOIN ownership_records o ON o.company_number = k.local_company_number
+        LEFT JOIN master_properties p ON p.title_number = o.title_number
+        LEFT JOIN distress_assets d ON d.uprn = p.uprn
+        GROUP BY t.officer_id
+    """), {"now": datetime.now().isoformat(timespec='seconds')})
+
+def refresh_affected_portfolios(conn, incremental=False):
+    """
+    Called by post_ingest, so title and F/G counts follow ownership and EPC loads between
+    appointment walks: re-rolls the officers of companies owning a UPRN staged in
+    temp_touched_uprns (every indexed officer when not `incremental`). Returns officers refreshed.
+    """
+    tables = {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+    if 'officer_portfolio' not in tables or not conn.execute(text("SELECT EXISTS (SELECT 1 FROM officer_portfolio)")).scalar():
+        return 0  # Director network not built yet
+    if not incremental:
+        officer_ids = [row[0] for row in conn.execute(text("SELECT officer_id FROM officer_portfolio"))]
+    else:
+        # Owners first seen in this load need their CH key before the rollup can reach them
+        conn.execute(text(f"""
+            INSERT OR IGNORE INTO company_keys (ch_number, local_company_number)
+            SELECT DISTINCT {normalized_number_sql('o.company_number')}, o.company_number
+            FROM master_properties p
+            JOIN ownership_records o ON o.title_number = p.title_number
+            WHERE p.uprn IN (SELECT uprn FROM temp_touched_uprns)
+              AND o.company_number IS NOT NULL
+        """))
+        officer_ids = [row[0] for row in conn.execute(text("""
+            SELECT DISTINCT a.officer_id
+            FROM master_properties p
+            JOIN ownership_records o ON o.title_number = p.title_number
+            JOIN company_keys k ON k.local_company_number = o.company_number
+            JOIN officer_appointments a ON a.company_number = k.ch_number
+            WHERE p.uprn IN (SELECT uprn FROM temp_touched_uprns)
+        """))]
+    if officer_ids:
+        refresh_portfolios(conn, officer_ids)
+    return len(officer_ids)
+
+async def fetch_appointments(ch, semaphore, officer_id, officer):
+    async with semaphore:
+        return officer_id, officer, await ch.get_officer_appointments(officer_id)
+
+async def run_network(engine, targets):
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    pending, done, failed = [], 0, 0
+
+    async with AsyncCompaniesHouseRegistry(pool_size=CONCURRENCY) as ch:
+        if not ch.api_key:
+            print("❌ STOP: No Companies House API Key found.")
+            return 0
+
+        tasks = [asyncio.create_task(fetch_appointments(ch, semaphore, oid, officer)) for oid, officer in targets.items()]
+        for task in asyncio.as_completed(tasks):
+            try:
+                pending.append(await task)
+            except Exception as e:
+                failed += 1
+                print(f"   ❌ API Error: {e}")
+
+            if len(pending) >= WRITE_BATCH:
+                await asyncio.to_thread(write_batch, engine, pending)
+                done += len(pending)
+                pending = []
+                print(f"   💾 Checkpoint: {done}/{len(targets)} officers indexed...")
+
+        if pending:
+            await asyncio.to_thread(write_batch, engine, pending)
+            done += len(pending)
+
+    if failed:
+        print(f"   ⚠️  {failed} officers failed and will be retried next run.")
+    return done
+
+def build_director_network():
+    print("👥 BUILDING DIRECTOR NETWORK INDEX")
+    print("============================================")
+
+    engine = create_engine(DB_PATH)
+    ensure_enrichment_tables(engine)
+
+    with engine.connect() as conn:
+        ensure_tables(conn)
+        refresh_company_keys(conn)
+        targets = load_targets(conn)
+
+    print(f"🎯 {len(targets)} officers need their appointments walked.")
+    done = asyncio.run(run_network(engine, targets))
+
+    bump_generation(engine, 'director_network')
+
+    print("============================================")
+    print("🎉 DIRECTOR NETWORK COMPLETE.")
+    print(f"👤 Officers Indexed: {done}")
+    print("============================================")
+
+if __name__ == "__main__":
+    build_director_network()
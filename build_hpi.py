@@ -0,0 +1,259 @@
+import sys
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+from vantage_pipeline import bump_generation
+
+try:
+    from scipy import sparse
+    from scipy.sparse.linalg import lsqr
+except ImportError:
+    sparse = lsqr = None  # Optional: pairs are still collected, the fit waits for scipy
+
+# --- CONFIGURATION ---
+DB_PATH = "sqlite:///vantage.db"
+POSTCODE_CHUNK = 5000          # Postcodes re-paired per pass (bounds memory on the first full build)
+MIN_HOLD_MONTHS = 6            # Quicker resales are mostly refurb flips or non-market transfers
+MAX_ANNUAL_LOG_RETURN = 0.4    # ~50%/year either way: a data error or a changed property, not the market
+MIN_DISTRICT_PAIRS = 100       # Thinner districts keep the median £/sqft fallback
+SMOOTHING = 1.0                # Random-walk penalty on month-to-month moves (carries thin months)
+
+def ensure_tables(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS price_index (
+            method VARCHAR(20),
+            district VARCHAR(10),
+            month CHAR(7),
+            index_value REAL,
+            observations INTEGER,
+            PRIMARY KEY (method, district, month)
+        )
+    """))
+    # Consecutive sales of the same property (PPD postcode + SAON + PAON + street)
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS hpi_pairs (
+            second_transaction_id VARCHAR(40) PRIMARY KEY,
+            first_transaction_id VARCHAR(40),
+            property_key TEXT,
+            district VARCHAR(10),
+            first_month CHAR(7),
+            second_month CHAR(7),
+            log_return REAL
+        )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_hpi_pairs_key ON hpi_pairs(property_key)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_hpi_pairs_district ON hpi_pairs(district)"))
+    # Highest raw_ppd_staging load_batch already paired (the PPD ingest only stamps new or changed sales)
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS hpi_state (
+            name VARCHAR(20) PRIMARY KEY,
+            value INTEGER
+        )
+    """))
+    # Districts whose pairs changed but whose index hasn't been refit yet (e.g. scipy missing)
+    conn.execute(text("CREATE TABLE IF NOT EXISTS hpi_pending (district VARCHAR(10) PRIMARY KEY)"))
+    conn.commit()
+
+def property_keys(sales):
+    parts = [sales[c].fillna('').astype(str).str.upper().str.split().str.join(" ")
+             for c in ('postcode', 'saon', 'paon', 'street')]
+    return parts[0] + "|" + parts[1] + "|" + parts[2] + "|" + parts[3]
+
+def repeat_pairs(sales):
+    """
+    Consecutive sales of each property -> pairs with their log price change.
+    Drops non-standard sales (type 'O'), quick resales and implausible annual moves.
+    """
+    sales = sales[(sales['property_type'] != 'O') & sales['paon'].notna() & (sales['price_paid'] > 0)].copy()
+    sales['property_key'] = property_keys(sales)
+    sales['date'] = pd.to_datetime(sales['transfer_date'], errors='coerce')
+    sales = sales[sales['date'].notna()].sort_values(['property_key', 'date'])
+
+    previous = sales.groupby('property_key').shift(1)
+    pairs = pd.DataFrame({
+        'second_transaction_id': sales['transaction_id'],
+        'first_transaction_id': previous['transaction_id'],
+        'property_key': sales['property_key'],
+        'district': sales['postcode'].str.upper().str.split().str[0],
+        'first_month': previous['date'].dt.strftime('%Y-%m'),
+        'second_month': sales['date'].dt.strftime('%Y-%m'),
+        'log_return': np.log(sales['price_paid'] / previous['price_paid']),
+        'hold_days': (sales['date'] - previous['date']).dt.days,
+    }).dropna(subset=['first_transaction_id'])
+
+    annual = pairs['log_return'].abs() / (pairs['hold_days'] / 365.25)
+    keep = (pairs['hold_days'] >= MIN_HOLD_MONTHS * 30) & (annual <= MAX_ANNUAL_LOG_RETURN)
+    return pairs[keep].drop(columns='hold_days'), set(sales['property_key'])
+
+def collect_pairs(conn, full=False):
+    """
+    Re-pairs every property in the postcodes with sales added or corrected since the last run
+    (everything when `full`, or when there's no watermark yet), plus the postcodes holding
+    existing pairs of a corrected sale (it may have moved address). The districts whose pairs
+    changed are queued in hpi_pending in the same transaction that advances the watermark,
+    so none is lost if the fit can't run.
+    """
+    mark = conn.execute(text("SELECT value FROM hpi_state WHERE name = 'ppd_batch'")).scalar()
+    full = full or mark is None
+    latest = conn.execute(text("SELECT MAX(load_batch) FROM raw_ppd_staging")).scalar() or 0
+    if full:
+        conn.execute(text("DELETE FROM hpi_pairs"))
+        postcodes = [row[0] for row in conn.execute(text(
+            "SELECT DISTINCT postcode FROM raw_ppd_staging WHERE postcode IS NOT NULL"))]
+    else:
+        conn.execute(text("DROP TABLE IF EXISTS temp_hpi_changed"))
+        conn.execute(text("""
+            CREATE TABLE temp_hpi_changed AS
+            SELECT transaction_id, postcode FROM raw_ppd_staging
+            WHERE load_batch > :mark AND load_batch <= :latest
+        """), {"mark": mark, "latest": latest})
+        postcodes = [row[0] for row in conn.execute(text("""
+            SELECT postcode FROM temp_hpi_changed WHERE postcode IS NOT NULL
+            UNION
+            SELECT substr(p.property_key, 1, instr(p.property_key, '|') - 1) FROM hpi_pairs p
+            WHERE p.second_transaction_id IN (SELECT transaction_id FROM temp_hpi_changed)
+               OR p.first_transaction_id IN (SELECT transaction_id FROM temp_hpi_changed)
+        """))]
+        conn.execute(text("DROP TABLE temp_hpi_changed"))
+
+    districts, added = set(), 0
+    for start in range(0, len(postcodes), POSTCODE_CHUNK):
+        chunk = pd.DataFrame({'postcode': postcodes[start:start + POSTCODE_CHUNK]})
+        chunk.to_sql('temp_hpi_postcodes', conn, if_exists='replace', index=False)
+        sales = pd.read_sql(text("""
+            SELECT s.transaction_id, s.price_paid, s.transfer_date, s.postcode, s.property_type, s.paon, s.saon, s.street
+            FROM raw_ppd_staging s
+            JOIN temp_hpi_postcodes t ON t.postcode = s.postcode
+        """), conn)
+        conn.execute(text("DROP TABLE temp_hpi_postcodes"))
+
+        pairs, keys = repeat_pairs(sales)
+        # Old pairs go by property and by sale: a corrected sale may have been paired under another address
+        pd.DataFrame({'property_key': sorted(keys)}).to_sql('temp_hpi_keys', conn, if_exists='replace', index=False)
+        pairs[['second_transaction_id']].to_sql('temp_hpi_sales', conn, if_exists='replace', index=False)
+        stale = """
+            WHERE property_key IN (SELECT property_key FROM temp_hpi_keys)
+               OR second_transaction_id IN (SELECT second_transaction_id FROM temp_hpi_sales)
+        """
+        changed = conn.execute(text(f"SELECT DISTINCT district FROM hpi_pairs {stale}")).fetchall()
+        conn.execute(text(f"DELETE FROM hpi_pairs {stale}"))
+        conn.execute(text("DROP TABLE temp_hpi_keys"))
+        conn.execute(text("DROP TABLE temp_hpi_sales"))
+        pairs.to_sql('hpi_pairs', conn, if_exists='append', index=False)
+
+        districts.update(row[0] for row in changed)
+        districts.update(pairs['district'])
+        added += len(pairs)
+
+    if districts:
+        pd.DataFrame({'district': sorted(districts)}).to_sql('temp_hpi_districts', conn, if_exists='replace', index=False)
+        conn.execute(text("INSERT OR IGNORE INTO hpi_pending (district) SELECT district FROM temp_hpi_districts"))
+        conn.execute(text("DROP TABLE temp_hpi_districts"))
+    conn.execute(text("INSERT OR REPLACE INTO hpi_state (name, value) VALUES ('ppd_batch', :latest)"), {"latest": latest})
+    conn.commit()
+    print(f"   🔗 {len(postcodes)} postcodes re-paired: {added} repeat-sale pairs, {len(districts)} districts affected.")
+
+def fit_index(pairs):
+    """
+    Case-Shiller style repeat-sales fit for one district. Each pair says
+    log(P2/P1) = b[month2] - b[month1]. b[first month] is 0, and a SMOOTHING x (b[t] - b[t-1]) = 0
+    row per month carries months with few pairs. Stage 1 is unweighted. Stage 2 models
+    the residual variance as linear in the holding period. Stage 3 refits with rows
+    weighted by 1/sd. Solved with sparse least squares (lsqr).
+    Returns a frame of month, index_value (100 at the first month) and observations.
+    """
+    months = pd.period_range(pairs['first_month'].min(), pairs['second_month'].max(), freq='M')
+    position = {str(m): i for i, m in enumerate(months)}
+    first = pairs['first_month'].map(position).to_numpy()
+    second = pairs['second_month'].map(position).to_numpy()
+    n, T = len(pairs), len(months)
+
+    rows = np.concatenate([np.arange(n), np.arange(n)])
+    cols = np.concatenate([first, second])
+    vals = np.concatenate([-np.ones(n), np.ones(n)])
+    design = sparse.csr_matrix((vals, (rows, cols)), shape=(n, T))[:, 1:]
+    steps = np.arange(1, T)
+    penalty = sparse.csr_matrix(
+        (np.concatenate([np.full(T - 1, SMOOTHING), np.full(T - 2, -SMOOTHING)]),
+         (np.concatenate([steps - 1, steps[1:] - 1]), np.concatenate([steps - 1, steps[1:] - 2]))),
+        shape=(T - 1, T - 1),
+    )
+    y = pairs['log_return'].to_numpy()
+
+    def solve(weights):
+        A = sparse.vstack([sparse.diags(weights) @ design, penalty]).tocsr()
+        return lsqr(A, np.concatenate([weights * y, np.zeros(T - 1)]), atol=1e-10, btol=1e-10)[0]
+
+    beta = solve(np.ones(n))
+    gap = second - first
+    slope, intercept = np.polyfit(gap, np.square(y - design @ beta), 1) if len(np.unique(gap)) > 1 else (0.0, 1.0)
+    variance = np.clip(intercept + slope * gap, 1e-4, None)
+    weights = 1 / np.sqrt(variance)
+    beta = solve(weights / weights.mean())
+
+    levels = np.concatenate([[0.0], beta])
+    return pd.DataFrame({
+        'month': months.strftime('%Y-%m'),
+        'index_value': 100 * np.exp(levels),
+        'observations': np.bincount(second, minlength=T),
+    })
+
+def fit_districts(conn, districts):
+    """
+    Refits the repeat-sales index for each district from its stored pairs and takes it
+    off hpi_pending.
+    """
+    written = 0
+    for district in sorted(districts):
+        conn.execute(text("DELETE FROM price_index WHERE method = 'repeat_sales' AND district = :d"), {"d": district})
+        conn.execute(text("DELETE FROM hpi_pending WHERE district = :d"), {"d": district})
+        pairs = pd.read_sql(text("""
+            SELECT first_month, second_month, log_return FROM hpi_pairs WHERE district = :d
+        """), conn, params={"d": district})
+        if len(pairs) < MIN_DISTRICT_PAIRS:
+            continue
+        index = fit_index(pairs).assign(method='repeat_sales', district=district)
+        index[['method', 'district', 'month', 'index_value', 'observations']].to_sql(
+            'price_index', conn, if_exists='append', index=False)
+        written += 1
+    conn.commit()
+    return written
+
+def refresh_hpi(engine, full=False):
+    """
+    Incremental by default: only sales added since the last run are paired, and only their
+    districts (plus any left pending by an earlier run) refit. Called by the PPD ingest.
+    """
+    with engine.connect() as conn:
+        ensure_tables(conn)
+        collect_pairs(conn, full)
+        districts = [row[0] for row in conn.execute(text("SELECT district FROM hpi_pending"))]
+        if not districts:
+            print("📈 Repeat-sales index up to date: no new sales.")
+            return 0
+        if lsqr is None:
+            print(f"⚠️  'scipy' not installed: pairs stored, {len(districts)} districts left pending a refit "
+                  "(valuations use the median £/sqft index until then).")
+            return 0
+        written = fit_districts(conn, districts)
+
+    print(f"📈 Repeat-sales index refit for {written}/{len(districts)} districts.")
+    return written
+
+def build_hpi(full=False):
+    print("📈 BUILDING REPEAT-SALES PRICE INDEX (district x month)")
+    print("============================================")
+
+    engine = create_engine(DB_PATH)
+    started = datetime.now()
+    written = refresh_hpi(engine, full=full)
+    bump_generation(engine, 'hpi')
+
+    print("============================================")
+    print("🎉 PRICE INDEX COMPLETE.")
+    print(f"📊 District Indices Written: {written} ({(datetime.now() - started).total_seconds():.1f}s)")
+    print("============================================")
+
+if __name__ == "__main__":
+    build_hpi(full="--full" in sys.argv)
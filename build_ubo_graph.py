@@ -0,0 +1,263 @@
+import os
+import json
+import pandas as pd
+from sqlalchemy import create_engine, text
+from vantage_companies import normalize_company_number, normalized_number_sql
+from enrich_owners import ensure_tables as ensure_enrichment_tables
+from vantage_pipeline import bump_generation
+
+# --- CONFIGURATION ---
+DB_PATH = "sqlite:///vantage.db"
+BATCH_SIZE = 50000
+MAX_DEPTH = 10  # Ownership chains deeper than this are almost always cycles
+
+# Optional: CH "PSC Data Product" snapshot (one JSON record per line)
+PSC_SNAPSHOT_PATH = "./epc_data/psc-snapshot.txt"
+
+UK_REGISTERS = ('england', 'wales', 'scotland', 'northern ireland', 'united kingdom', 'companies house')
+
+def ensure_tables(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS psc_edges (
+            company_number VARCHAR(20),
+            controller_key TEXT,
+            controller_kind VARCHAR(20),
+            controller_name TEXT,
+            natures_of_control TEXT,
+            PRIMARY KEY (company_number, controller_key)
+        )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_psc_controller ON psc_edges(controller_key)"))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS ubo_closure (
+            company_number VARCHAR(20),
+            controller_key TEXT,
+            controller_kind VARCHAR(20),
+            controller_name TEXT,
+            depth INTEGER,
+            is_ultimate BOOLEAN DEFAULT 0,
+            PRIMARY KEY (company_number, controller_key)
+        )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_ubo_controller ON ubo_closure(controller_key, is_ultimate)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_enrichment_official ON company_enrichment(official_number)"))
+    # Owners never enriched are reached from the closure by their CH-normalised number
+    conn.execute(text(f"""
+        CREATE INDEX IF NOT EXISTS idx_ownership_official
+        ON ownership_records({normalized_number_sql('company_number')})
+    """))
+    conn.commit()
+
+def controller_key(psc):
+    """
+    Stable node ID for a PSC.
+    UK corporate PSCs become 'C:<company number>' so the chain continues into that company's
+    own PSCs. People are 'P:<name>|<yyyy-mm of birth>'; anything else is a terminal 'E:<name>'.
+    """
+    kind = psc.get('kind', '')
+    name = " ".join(str(psc.get('name', '')).upper().split())
+
+    if kind.startswith('individual'):
+        elements = psc.get('name_elements') or {}
+        if elements.get('surname'):
+            name = " ".join(f"{elements.get('forename', '')} {elements['surname']}".upper().split())
+        dob = psc.get('date_of_birth') or {}
+        return f"P:{name}|{dob.get('year', '')}-{str(dob.get('month', '')).zfill(2)}", 'individual', name
+
+    if kind.startswith('corporate-entity'):
+        ident = psc.get('identification') or {}
+        register = f"{ident.get('country_registered', '')} {ident.get('place_registered', '')}".lower()
+        number = normalize_company_number(ident.get('registration_number'))
+        if number and any(r in register for r in UK_REGISTERS):
+            return f"C:{number}", 'corporate', name
+        return f"E:{name}", 'overseas', name
+
+    return f"E:{name}", 'other', name
+
+def edges_from_pscs(company_number, pscs):
+    rows = []
+    for psc in pscs or []:
+        if psc.get('ceased_on') or psc.get('ceased'):
+            continue
+        key, kind, name = controller_key(psc)
+        rows.append({
+            'company_number': company_number,
+            'controller_key': key,
+            'controller_kind': kind,
+            'controller_name': name,
+            'natures_of_control': ",".join(psc.get('natures_of_control') or [])
+        })
+    return rows
+
+def stage_api_edges(conn):
+    """
+    PSC lists already fetched by enrich_owners.py. Returns (companies seen, edge rows).
+    """
+    companies, rows = set(), []
+    enriched = conn.execute(text("""
+        SELECT official_number, psc_json FROM company_enrichment
+        WHERE official_number IS NOT NULL AND psc_json IS NOT NULL
+    """)).fetchall()
+    for number, psc_json in enriched:
+        companies.add(number)
+        rows.extend(edges_from_pscs(number, json.loads(psc_json)))
+    return companies, rows
+
+def stage_snapshot_edges(conn):
+    """
+    Streams the PSC bulk snapshot into the staging table in batches.
+    Returns the set of companies it covered.
+    """
+    companies = set()
+    if not os.path.exists(PSC_SNAPSHOT_PATH):
+        return companies
+
+    batch = []
+    with open(PSC_SNAPSHOT_PATH, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            number = normalize_company_number(record.get('company_number'))
+            if not number or 'data' not in record:
+                continue  # Trailing summary line
+            companies.add(number)
+            batch.extend(edges_from_pscs(number, [record['data']]))
+            if len(batch) >= BATCH_SIZE:
+                pd.DataFrame(batch).to_sql('staging_psc_edges', conn, if_exists='append', index=False)
+                batch = []
+    if batch:
+        pd.DataFrame(batch).to_sql('staging_psc_edges', conn, if_exists='append', index=False)
+    return companies
+
+def build_ubo_graph():
+    print("🕸️  BUILDING ULTIMATE BENEFICIAL OWNER GRAPH")
+    print("============================================")
+
+    engine = create_engine(DB_PATH)
+    ensure_enrichment_tables(engine)
+
+    with engine.connect() as conn:
+        ensure_tables(conn)
+        conn.execute(text("DROP TABLE IF EXISTS staging_psc_edges"))
+        conn.execute(text("""
+            CREATE TABLE staging_psc_edges (
+                company_number VARCHAR(20),
+                controller_key TEXT,
+                controller_kind VARCHAR(20),
+                controller_name TEXT,
+                natures_of_control TEXT
+            )
+        """))
+
+        # 1. Stage the latest PSC view from every source we have
+        print("📡 Staging PSC records...")
+        snapshot_companies = stage_snapshot_edges(conn)
+        api_companies, api_rows = stage_api_edges(conn)
+
+        # API data is fresher than the monthly snapshot, so it wins per company
+        pd.DataFrame({'company_number': sorted(api_companies)}).to_sql('temp_api_companies', conn, if_exists='replace', index=False)
+        conn.execute(text("DELETE FROM staging_psc_edges WHERE company_number IN (SELECT company_number FROM temp_api_companies)"))
+        if api_rows:
+            pd.DataFrame(api_rows).to_sql('staging_psc_edges', conn, if_exists='append', index=False)
+
+        # Every company we have a current register for (including ones whose PSCs have all ceased)
+        seen = pd.DataFrame({'company_number': sorted(snapshot_companies | api_companies)})
+        seen.to_sql('temp_psc_companies', conn, if_exists='replace', index=False)
+        conn.execute(text("CREATE INDEX idx_temp_psc_companies ON temp_psc_companies(company_number)"))
+        print(f"   Snapshot companies: {len(snapshot_companies)} | API companies: {len(api_companies)}")
+
+        # One row per edge (a controller notified twice), the same one psc_edges would keep, so the diff settles
+        conn.execute(text("""
+            DELETE FROM staging_psc_edges WHERE rowid NOT IN (
+                SELECT MIN(rowid) FROM staging_psc_edges GROUP BY company_number, controller_key
+            )
+        """))
+
+        # 2. Diff against the current graph: only companies whose PSC rows changed (who, or how they control) are touched
+        edge = "company_number, controller_key, controller_kind, controller_name, natures_of_control"
+        conn.execute(text("DROP TABLE IF EXISTS temp_ubo_changed"))
+        conn.execute(text(f"""
+            CREATE TABLE temp_ubo_changed AS
+            SELECT company_number FROM (
+                SELECT {edge} FROM staging_psc_edges
+                EXCEPT
+                SELECT {edge} FROM psc_edges
+            )
+            UNION
+            SELECT company_number FROM (
+                SELECT {edge} FROM psc_edges
+                WHERE company_number IN (SELECT company_number FROM temp_psc_companies)
+                EXCEPT
+                SELECT {edge} FROM staging_psc_edges
+            )
+        """))
+        changed = conn.execute(text("SELECT COUNT(*) FROM temp_ubo_changed")).scalar()
+        print(f"🔄 {changed} companies changed their PSC register.")
+
+        conn.execute(text("DELETE FROM psc_edges WHERE company_number IN (SELECT company_number FROM temp_ubo_changed)"))
+        conn.execute(text("""
+            INSERT OR IGNORE INTO psc_edges (company_number, controller_key, controller_kind, controller_name, natures_of_control)
+            SELECT company_number, controller_key, controller_kind, controller_name, natures_of_control
+            FROM staging_psc_edges
+            WHERE company_number IN (SELECT company_number FROM temp_ubo_changed)
+        """))
+
+        # 3. Affected closure = changed companies + everything they (indirectly) control
+        conn.execute(text("DROP TABLE IF EXISTS temp_ubo_affected"))
+        conn.execute(text("""
+            CREATE TABLE temp_ubo_affected AS
+            SELECT company_number FROM temp_ubo_changed
+            UNION
+            SELECT u.company_number FROM ubo_closure u
+            JOIN temp_ubo_changed c ON u.controller_key = 'C:' || c.company_number
+        """))
+
+        # 4. Recompute closure rows for the affected companies only
+        conn.execute(text("DELETE FROM ubo_closure WHERE company_number IN (SELECT company_number FROM temp_ubo_affected)"))
+        conn.execute(text("""
+            INSERT INTO ubo_closure (company_number, controller_key, controller_kind, controller_name, depth)
+            WITH RECURSIVE chain(company_number, controller_key, controller_kind, controller_name, depth) AS (
+                SELECT e.company_number, e.controller_key, e.controller_kind, e.controller_name, 1
+                FROM psc_edges e
+                WHERE e.company_number IN (SELECT company_number FROM temp_ubo_affected)
+                UNION
+                SELECT c.company_number, e.controller_key, e.controller_kind, e.controller_name, c.depth + 1
+                FROM chain c
+                JOIN psc_edges e ON e.company_number = substr(c.controller_key, 3)
+                WHERE c.controller_key LIKE 'C:%'
+                  AND c.depth < :max_depth
+            )
+            SELECT company_number, controller_key, controller_kind, controller_name, MIN(depth)
+            FROM chain
+            WHERE controller_key != 'C:' || company_number
+            GROUP BY company_number, controller_key
+        """), {"max_depth": MAX_DEPTH})
+
+        # Ultimate = end of the chain: a person, an overseas entity, or a UK company with no PSCs on file
+        conn.execute(text("""
+            UPDATE ubo_closure
+            SET is_ultimate = NOT EXISTS (
+                SELECT 1 FROM psc_edges e WHERE e.company_number = substr(ubo_closure.controller_key, 3)
+            ) OR controller_key NOT LIKE 'C:%'
+            WHERE company_number IN (SELECT company_number FROM temp_ubo_affected)
+        """))
+
+        affected = conn.execute(text("SELECT COUNT(*) FROM temp_ubo_affected")).scalar()
+        conn.execute(text("DROP TABLE staging_psc_edges"))
+        conn.execute(text("DROP TABLE temp_api_companies"))
+        conn.execute(text("DROP TABLE temp_psc_companies"))
+        conn.execute(text("DROP TABLE temp_ubo_changed"))
+        conn.execute(text("DROP TABLE temp_ubo_affected"))
+        conn.commit()
+
+    bump_generation(engine, 'ubo_graph')
+
+    print("============================================")
+    print("🎉 UBO GRAPH COMPLETE.")
+    print(f"🔗 Ownership chains recomputed for {affected} companies.")
+    print("============================================")
+
+if __name__ == "__main__":
+    build_ubo_graph()
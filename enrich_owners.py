@@ -1,106 +1,206 @@
+import asyncio
+import json
+from datetime import datetime
 from sqlalchemy import create_engine, text
-from vantage_companies import CompaniesHouseRegistry
-import time
+from vantage_companies import AsyncCompaniesHouseRegistry, normalize_company_number
+from vantage_pipeline import bump_generation
 
 # --- CONFIGURATION ---
 DB_PATH = "sqlite:///vantage.db"
+CONCURRENCY = 25   # Companies in flight at once (the token bucket still caps requests/sec)
+WRITE_BATCH = 100  # Companies per DB transaction (also the checkpoint granularity)
 
-def enrich_owners():
+UK_JURISDICTIONS = {'england-wales', 'wales', 'scotland', 'northern-ireland', 'united-kingdom'}
+
+def ensure_tables(engine):
+    with engine.connect() as conn:
+        # Raw CH payloads per company. A row here is the checkpoint: it won't be fetched again.
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS company_enrichment (
+                company_number VARCHAR(20) PRIMARY KEY,
+                official_number VARCHAR(20),
+                match_status VARCHAR(20),
+                profile_json TEXT,
+                officers_json TEXT,
+                psc_json TEXT,
+                charges_json TEXT,
+                enriched_at DATETIME,
+                charges_loaded_at DATETIME  -- When ingest_charges.py last flattened charges_json
+            )
+        """))
+        # Databases that pre-date per-company charge checkpoints
+        columns = [row[1] for row in conn.execute(text("PRAGMA table_info(company_enrichment)"))]
+        if 'charges_loaded_at' not in columns:
+            conn.execute(text("ALTER TABLE company_enrichment ADD COLUMN charges_loaded_at DATETIME"))
+        # Databases that pre-date the bulk snapshot ingest
+        columns = [row[1] for row in conn.execute(text("PRAGMA table_info(corporate_registry)"))]
+        if 'incorporation_date' not in columns:
+            conn.execute(text("ALTER TABLE corporate_registry ADD COLUMN incorporation_date DATE"))
+        conn.commit()
+
+def load_targets(engine, limit=None):
+    """
+    Corporate owners of F/G assets we haven't enriched yet.
+    in_snapshot marks owners already profiled by ingest_companies.py.
+    """
+    query = """
+        SELECT DISTINCT c.company_number, c.company_name, c.incorporation_date IS NOT NULL AS in_snapshot
+        FROM corporate_registry c
+        JOIN ownership_records o ON c.company_number = o.company_number
+        JOIN master_properties p ON o.title_number = p.title_number
+        JOIN epc_assessments e ON p.uprn = e.uprn
+        LEFT JOIN company_enrichment ce ON ce.company_number = c.company_number
+        WHERE e.asset_rating_band IN ('F', 'G')
+          AND ce.company_number IS NULL
+    """
+    if limit:
+        query += f" LIMIT {int(limit)}"
+    with engine.connect() as conn:
+        return conn.execute(text(query)).fetchall()
+
+async def enrich_company(ch, semaphore, local_id, name, in_snapshot=False):
+    """
+    Fetches everything we want for one company.
+    Owners matched in the bulk snapshot only need officers, PSCs and charges.
+    Otherwise we try the CCOD number's profile first; CCOD IDs are sometimes internal LR
+    refs, so if that misses we resolve by name. Officers, PSCs and charges are only
+    fetched (concurrently) once the profile has resolved to a real company.
+    """
+    async with semaphore:
+        official_number = normalize_company_number(local_id)
+
+        if in_snapshot:
+            bundle = await ch.get_company_bundle(official_number, include_profile=False)
+            return {"local_id": local_id, "official_number": official_number, "in_snapshot": True, **bundle}
+
+        profile = await ch.get_company_profile(official_number)
+
+        if not profile and name:
+            match = await ch.search_company(name)
+            if match:
+                official_number = match.get('company_number')
+                profile = await ch.get_company_profile(official_number)
+
+        if not profile:
+            return {"local_id": local_id, "official_number": official_number, "in_snapshot": False,
+                    "profile": None, "officers": [], "pscs": [], "charges": []}
+
+        bundle = await ch.get_company_bundle(official_number, include_profile=False)
+        return {"local_id": local_id, "official_number": official_number, "in_snapshot": False, **bundle, "profile": profile}
+
+def profile_fields(profile):
+    accounts = (profile.get('accounts') or {}).get('last_accounts') or {}
+    jurisdiction = profile.get('jurisdiction')
+    return {
+        "status": profile.get('company_status'),
+        "official_name": profile.get('company_name'),
+        "country": 'United Kingdom' if jurisdiction in UK_JURISDICTIONS else (jurisdiction or 'Unknown'),
+        "category": profile.get('type'),
+        "last_accounts": accounts.get('made_up_to'),
+        "sic": ",".join(profile.get('sic_codes') or [])
+    }
+
+def write_batch(engine, results):
+    """
+    One transaction per batch: registry updates and their checkpoints land together,
+    so an interrupted run resumes exactly where it stopped.
+    """
+    now = datetime.now().isoformat(timespec='seconds')
+    checkpoints = []
+    updates = []
+
+    for r in results:
+        profile = r['profile']
+        if r['in_snapshot']:
+            status = 'snapshot'
+        else:
+            status = 'matched' if profile else 'no_match'
+        checkpoints.append({
+            "id": r['local_id'],
+            "official": r['official_number'] if profile or r['in_snapshot'] else None,
+            "status": status,
+            "profile": json.dumps(profile) if profile else None,
+            "officers": json.dumps(r['officers']),
+            "psc": json.dumps(r['pscs']),
+            "charges": json.dumps(r['charges']),
+            "at": now
+        })
+        if profile:
+            updates.append({"old_id": r['local_id'], **profile_fields(profile)})
+
+    with engine.connect() as conn:
+        if updates:
+            conn.execute(text("""
+                UPDATE corporate_registry
+                SET company_status = :status,
+                    company_name = :official_name,
+                    incorporation_country = :country,
+                    company_category = :category,
+                    last_accounts_date = :last_accounts,
+                    sic_codes = :sic
+                WHERE company_number = :old_id
+            """), updates)
+        conn.execute(text("""
+            INSERT OR REPLACE INTO company_enrichment
+            (company_number, official_number, match_status, profile_json, officers_json, psc_json, charges_json, enriched_at)
+            VALUES (:id, :official, :status, :profile, :officers, :psc, :charges, :at)
+        """), checkpoints)
+        conn.commit()
+
+async def run_enrichment(engine, targets, concurrency=CONCURRENCY):
+    semaphore = asyncio.Semaphore(concurrency)
+    pending = []
+    done = 0
+    failed = 0
+
+    async with AsyncCompaniesHouseRegistry(pool_size=concurrency) as ch:
+        if not ch.api_key:
+            print("❌ STOP: No Companies House API Key found.")
+            print("   Please add COMPANIES_HOUSE_KEY=your_key to .env")
+            return 0
+
+        tasks = [asyncio.create_task(enrich_company(ch, semaphore, row[0], row[1], bool(row[2]))) for row in targets]
+
+        for task in asyncio.as_completed(tasks):
+            try:
+                pending.append(await task)
+            except Exception as e:
+                # Not checkpointed, so it is picked up again on the next run
+                failed += 1
+                print(f"   ❌ API Error: {e}")
+
+            if len(pending) >= WRITE_BATCH:
+                await asyncio.to_thread(write_batch, engine, pending)
+                done += len(pending)
+                pending = []
+                print(f"   💾 Checkpoint: {done}/{len(targets)} companies enriched...")
+
+        if pending:
+            await asyncio.to_thread(write_batch, engine, pending)
+            done += len(pending)
+
+    if failed:
+        print(f"   ⚠️  {failed} companies failed and will be retried next run.")
+    return done
+
+def enrich_owners(limit=None):
     print("🕵️  STARTING CORPORATE INTELLIGENCE ENRICHMENT")
     print("============================================")
-    
+
     engine = create_engine(DB_PATH)
-    ch = CompaniesHouseRegistry()
-    
-    if not ch.api_key:
-        print("❌ STOP: No Companies House API Key found.")
-        print("   Please add COMPANIES_HOUSE_KEY=your_key to .env")
-        return
-
-    # 1. Identify Target Companies
-    # Companies linked to F/G properties that haven't been enriched yet (or have 'Unknown' country)
-    with engine.connect() as conn:
-        query = text("""
-            SELECT DISTINCT c.company_number, c.company_name
-            FROM corporate_registry c
-            JOIN ownership_records o ON c.company_number = o.company_number
-            JOIN master_properties p ON o.title_number = p.title_number
-            JOIN epc_assessments e ON p.uprn = e.uprn
-            WHERE e.asset_rating_band IN ('F', 'G')
-              AND (c.company_status IS NULL OR c.incorporation_country = 'Unknown')
-            LIMIT 10
-        """)
-        targets = conn.execute(query).fetchall()
-    
+    ensure_tables(engine)
+
+    # 1. Identify Target Companies (resumes from the last checkpoint)
+    targets = load_targets(engine, limit)
     print(f"🎯 Targeted {len(targets)} companies for deep dive analysis.\n")
-    
-    for row in targets:
-        local_id = row[0]     # The ID we have locally (might be from CCOD)
-        name = row[1]         # Company Name
-        
-        print(f"🔍 Investigating: {name} (Ref: {local_id})...")
-        
-        # A. SEARCH (Resolve to official Company Number)
-        # CCOD IDs are sometimes internal LR refs, so we search by name to be sure
-        match = ch.search_company(name)
-        
-        if match:
-            official_number = match.get('company_number')
-            title = match.get('title')
-            status = match.get('company_status', 'active')
-            addr = match.get('address_snippet', '')
-            
-            print(f"   ✅ MATCHED: {title} (#{official_number})")
-            print(f"      Status: {status.upper()}")
-            print(f"      HQ: {addr}")
-            
-            # B. GET OFFICERS (Directors)
-            officers = ch.get_company_officers(official_number)
-            director_names = [o.get('name', 'Unknown') for o in officers if 'resigned_on' not in o][:3] # Top 3 active
-            
-            print(f"      Directors: {', '.join(director_names)}")
-            
-            # C. UPDATE DATABASE
-            # We update our local registry with this gold-dust info
-            with engine.connect() as conn:
-                update_sql = text("""
-                    UPDATE corporate_registry 
-                    SET company_number = :new_id, -- Correct the ID if needed
-                        company_status = :status,
-                        incorporation_country = 'United Kingdom',
-                        sic_codes = :directors -- Abusing SIC column for now to store directors for MVP
-                    WHERE company_number = :old_id
-                """)
-                # Note: Changing PK (company_number) is risky if cascade isn't set. 
-                # For MVP, we'll just update attributes and keep old ID if it matches, 
-                # or we might have to handle the ID swap carefully.
-                # Let's just update the status for now to be safe.
-                
-                update_safe = text("""
-                    UPDATE corporate_registry 
-                    SET company_status = :status,
-                        incorporation_country = 'United Kingdom',
-                        company_name = :official_name
-                    WHERE company_number = :old_id
-                """)
-                
-                conn.execute(update_safe, {
-                    "status": status,
-                    "official_name": title,
-                    "old_id": local_id
-                })
-                conn.commit()
-                
-            print("   💾 Database Updated.")
-            
-        else:
-            print("   ⚠️  No match found in Companies House (Foreign Entity?)")
-        
-        # Respect API Rate Limits
-        time.sleep(0.6) 
+
+    # 2. Fetch officers / PSC / charges (+ profile if the snapshot missed it) under the CH rate limit
+    done = asyncio.run(run_enrichment(engine, targets))
+
+    bump_generation(engine, 'enrich_owners')
 
     print("\n============================================")
-    print("🎉 ENRICHMENT COMPLETE")
+    print(f"🎉 ENRICHMENT COMPLETE ({done} companies)")
 
 if __name__ == "__main__":
     enrich_owners()
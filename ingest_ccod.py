@@ -2,6 +2,7 @@ import os
 import pandas as pd
 from sqlalchemy import create_engine, text
 from vantage_s3 import VantageDataLake
+from vantage_pipeline import post_ingest, uprns_for
 from dotenv import load_dotenv
 
 # --- CONFIGURATION ---
@@ -51,6 +52,7 @@ def ingest_ccod():
     )
     
     total_records = 0
+    touched_titles = set()
     
     for i, df in enumerate(chunk_iter):
         
@@ -75,7 +77,8 @@ def ingest_ccod():
         
         ownership = df[['Title Number', 'Company Registration No. (1)', 'Proprietor Name (1)', 'proprietor_address_full', 'Price Paid', 'Date Proprietor Added']].copy()
         ownership.columns = ['title_number', 'company_number', 'proprietor_name', 'proprietor_address', 'price_paid', 'date_registered']
-        ownership = ownership.dropna(subset=['title_number', 'company_number'])
+        # Keep owners with no UK registration number (individuals, overseas entities) for resolve_owners.py
+        ownership = ownership.dropna(subset=['title_number', 'proprietor_name'])
         
         # Prepare Master Properties Stubs (To satisfy foreign keys)
         # In a full run, we'd have these from OS MasterMap, but we create stubs here
@@ -117,10 +120,15 @@ def ingest_ccod():
             
             conn.commit()
 
+        touched_titles.update(properties['title_number'].dropna())
+        touched_titles.update(ownership['title_number'])
         count = len(ownership)
         total_records += count
         print(f"   ✅ Batch {i+1}: Ingested {count} ownership links...")
 
+    # Ownership changes reach UPRNs via title numbers
+    post_ingest(engine, 'ccod', uprns_for(engine, 'title_number', touched_titles))
+
     print("=========================================")
     print(f"🎉 INGESTION COMPLETE.")
     print(f"📊 Total Ownership Records: {total_records}")
@@ -0,0 +1,174 @@
+import json
+from datetime import datetime, timedelta
+import pandas as pd
+from sqlalchemy import create_engine, text
+from enrich_owners import ensure_tables as ensure_enrichment_tables
+from vantage_pipeline import bump_generation, ensure_tables as ensure_pipeline_tables
+from score_distress import rescore_matching
+
+# --- CONFIGURATION ---
+DB_PATH = "sqlite:///vantage.db"
+BATCH_SIZE = 1000  # Companies flattened per transaction
+NEW_CHARGE_DAYS = 90  # Unseen charges created this recently go on the change feed (older ones are history, not news)
+
+CHARGE_COLUMNS = ['charge_id', 'company_number', 'charge_code', 'status', 'created_on', 'delivered_on',
+                  'satisfied_on', 'lender', 'lenders', 'classification', 'particulars', 'loaded_at']
+
+def ensure_tables(conn):
+    # Charges used to be stored per local owner ID: rebuild those as one row per CH charge
+    legacy = 'local_company_number' in {row[1] for row in conn.execute(text("PRAGMA table_info(company_charges)"))}
+    if legacy:
+        conn.execute(text("ALTER TABLE company_charges RENAME TO company_charges_old"))
+        for index in ('idx_charges_created', 'idx_charges_status_created', 'idx_charges_lender', 'idx_charges_company'):
+            conn.execute(text(f"DROP INDEX IF EXISTS {index}"))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS company_charges (
+            charge_id VARCHAR(64) PRIMARY KEY,      -- '<CH number>/<charge code>'
+            company_number VARCHAR(20),             -- CH number (local owners via company_enrichment.official_number)
+            charge_code VARCHAR(30),
+            status VARCHAR(20),
+            created_on DATE,
+            delivered_on DATE,
+            satisfied_on DATE,
+            lender TEXT,
+            lenders TEXT,
+            classification TEXT,
+            particulars TEXT,
+            loaded_at DATETIME
+        )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_charges_created ON company_charges(created_on)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_charges_status_created ON company_charges(status, created_on)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_charges_lender ON company_charges(lender)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_charges_ch_company ON company_charges(company_number)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_enrichment_official ON company_enrichment(official_number)"))
+    if legacy:
+        # Kept (freshest copy per charge) so the change feed doesn't re-announce them
+        conn.execute(text(f"""
+            INSERT OR IGNORE INTO company_charges ({', '.join(CHARGE_COLUMNS)})
+            SELECT company_number || '/' || COALESCE(charge_code, substr(charge_id, instr(charge_id, '/') + 1)),
+                   {', '.join(CHARGE_COLUMNS[1:])}
+            FROM company_charges_old
+            ORDER BY loaded_at DESC
+        """))
+        conn.execute(text("DROP TABLE company_charges_old"))
+    conn.commit()
+
+def flatten_charges(official_number, charges, loaded_at):
+    rows = []
+    for c in charges or []:
+        # CH number + charge code; charges registered before codes existed (2013) fall back to the
+        # '/company/01234567/charges/<id>' self-link ID
+        self_link = (c.get('links') or {}).get('self', '')
+        charge_ref = c.get('charge_code') or self_link.rstrip('/').split('/')[-1] or str(c.get('charge_number'))
+        lenders = [p.get('name', '') for p in c.get('persons_entitled') or [] if p.get('name')]
+        rows.append({
+            'charge_id': f"{official_number}/{charge_ref}",
+            'company_number': official_number,
+            'charge_code': c.get('charge_code'),
+            'status': c.get('status'),
+            'created_on': c.get('created_on'),
+            'delivered_on': c.get('delivered_on'),
+            'satisfied_on': c.get('satisfied_on'),
+            'lender': lenders[0].upper() if lenders else None,
+            'lenders': "; ".join(lenders),
+            'classification': (c.get('classification') or {}).get('description'),
+            'particulars': (c.get('particulars') or {}).get('description'),
+            'loaded_at': loaded_at
+        })
+    return rows
+
+def ingest_charges():
+    print("🏦 STARTING CHARGES (DEBT) INGESTION")
+    print("============================================")
+
+    engine = create_engine(DB_PATH)
+    ensure_enrichment_tables(engine)
+
+    with engine.connect() as conn:
+        ensure_tables(conn)
+        ensure_pipeline_tables(conn)
+
+        # Companies whose charges were (re)fetched since we last flattened them
+        # (checkpointed per company, so an empty charge book isn't picked up again)
+        targets = conn.execute(text("""
+            SELECT ce.company_number, ce.official_number, ce.charges_json, ce.enriched_at
+            FROM company_enrichment ce
+            WHERE ce.official_number IS NOT NULL
+              AND ce.charges_json IS NOT NULL
+              AND (ce.charges_loaded_at IS NULL OR ce.charges_loaded_at < ce.enriched_at)
+        """)).fetchall()
+
+    # Several local owner IDs can resolve to one CH company: its book is loaded once, from the freshest fetch
+    books = {}
+    for _, official_number, charges_json, _ in sorted(targets, key=lambda t: t[3] or ''):
+        books[official_number] = charges_json
+    books = list(books.items())
+    print(f"🎯 {len(targets)} companies ({len(books)} CH registers) with new charge data.")
+
+    total_charges = 0
+    touched_companies = set()
+    loaded_at = datetime.now().isoformat(timespec='seconds')
+    news_cutoff = (datetime.now() - timedelta(days=NEW_CHARGE_DAYS)).date().isoformat()
+
+    for start in range(0, len(books), BATCH_SIZE):
+        batch = books[start:start + BATCH_SIZE]
+        rows = []
+        for official_number, charges_json in batch:
+            rows.extend(flatten_charges(official_number, json.loads(charges_json), loaded_at))
+
+        with engine.connect() as conn:
+            # Replace each company's charge book wholesale (satisfactions update old rows)
+            pd.DataFrame({'company_number': [b[0] for b in batch]}).to_sql('temp_charge_companies', conn, if_exists='replace', index=False)
+            if rows:
+                pd.DataFrame(rows)[CHARGE_COLUMNS].to_sql('temp_charges', conn, if_exists='replace', index=False)
+                # Change feed: recent outstanding charges we've never seen (diffed before the book is replaced),
+                # announced to every local owner of the company
+                conn.execute(text("""
+                    INSERT INTO change_events (event_type, stage, company_number, payload, created_at)
+                    SELECT 'charge_new', 'charges', ce.company_number,
+                           json_object('charge_id', t.charge_id, 'company_number', t.company_number,
+                                       'local_company_number', ce.company_number, 'created_on', t.created_on,
+                                       'lender', t.lender, 'classification', t.classification), :now
+                    FROM temp_charges t
+                    JOIN company_enrichment ce ON ce.official_number = t.company_number
+                    WHERE t.status = 'outstanding'
+                      AND t.created_on >= :cutoff
+                      AND NOT EXISTS (SELECT 1 FROM company_charges ch WHERE ch.charge_id = t.charge_id)
+                """), {"now": loaded_at, "cutoff": news_cutoff})
+            conn.execute(text("""
+                DELETE FROM company_charges
+                WHERE company_number IN (SELECT company_number FROM temp_charge_companies)
+            """))
+            if rows:
+                conn.execute(text(f"""
+                    INSERT OR REPLACE INTO company_charges ({', '.join(CHARGE_COLUMNS)})
+                    SELECT {', '.join(CHARGE_COLUMNS)} FROM temp_charges
+                """))
+                conn.execute(text("DROP TABLE temp_charges"))
+            # Checkpoint and rescore every local owner of these companies, not just the ones refetched
+            conn.execute(text("""
+                UPDATE company_enrichment SET charges_loaded_at = :loaded_at
+                WHERE official_number IN (SELECT company_number FROM temp_charge_companies)
+            """), {"loaded_at": loaded_at})
+            touched_companies.update(row[0] for row in conn.execute(text("""
+                SELECT company_number FROM company_enrichment
+                WHERE official_number IN (SELECT company_number FROM temp_charge_companies)
+            """)))
+            conn.execute(text("DROP TABLE temp_charge_companies"))
+            conn.commit()
+
+        total_charges += len(rows)
+        print(f"   ✅ Batch {start // BATCH_SIZE + 1}: Loaded {len(rows)} charges...")
+
+    # Outstanding charges feed the distress score of every UPRN the company owns
+    rescore_matching(engine, 'company_number', touched_companies)
+    bump_generation(engine, 'charges')
+
+    print("============================================")
+    print("🎉 CHARGES INGESTION COMPLETE.")
+    print(f"📊 Total Charges Loaded: {total_charges}")
+    print("============================================")
+
+if __name__ == "__main__":
+    ingest_charges()
@@ -0,0 +1,141 @@
+import os
+import pandas as pd
+from sqlalchemy import create_engine, text
+from vantage_s3 import VantageDataLake
+from vantage_companies import normalize_company_number
+from vantage_pipeline import post_ingest, uprns_for
+from dotenv import load_dotenv
+
+# --- CONFIGURATION ---
+BATCH_SIZE = 100000  # The snapshot is ~5M rows; we only keep the ones CCOD knows about
+DB_PATH = "sqlite:///vantage.db"
+
+# Companies House "Free Company Data Product" (BasicCompanyDataAsOneFile), refreshed monthly
+SNAPSHOT_COLUMNS = [
+    'CompanyNumber', 'CompanyName', 'CompanyCategory', 'CompanyStatus', 'CountryOfOrigin',
+    'IncorporationDate', 'Accounts.LastMadeUpDate',
+    'SICCode.SicText_1', 'SICCode.SicText_2', 'SICCode.SicText_3', 'SICCode.SicText_4'
+]
+
+def ensure_columns(conn):
+    columns = [row[1] for row in conn.execute(text("PRAGMA table_info(corporate_registry)"))]
+    if 'incorporation_date' not in columns:
+        conn.execute(text("ALTER TABLE corporate_registry ADD COLUMN incorporation_date DATE"))
+        conn.commit()
+
+def ingest_companies():
+    print("🚀 Starting Companies House Bulk Snapshot Ingestion...")
+
+    # 1. Setup
+    load_dotenv(override=True)
+    engine = create_engine(DB_PATH)
+
+    with engine.connect() as conn:
+        ensure_columns(conn)
+        # Owners CCOD gave us, keyed by CH-normalised number
+        local_ids = conn.execute(text("SELECT company_number FROM corporate_registry")).fetchall()
+
+    owner_map = {}
+    for (local_id,) in local_ids:
+        owner_map.setdefault(normalize_company_number(local_id), []).append(local_id)
+    print(f"🎯 {len(owner_map)} CCOD owners to match against the snapshot.")
+
+    # 2. Locate Data
+    remote_key = "raw/companies/BasicCompanyDataAsOneFile.csv"
+    local_path = "./epc_data/BasicCompanyDataAsOneFile.csv"
+
+    if not os.path.exists(local_path):
+        if os.getenv('AWS_ACCESS_KEY_ID'):
+            print(f"⬇️  Downloading Company Snapshot ({remote_key})...")
+            VantageDataLake().download_file(remote_key, local_path)
+        else:
+            print("⚠️  File not found locally and no AWS keys. Aborting.")
+            return
+    else:
+        print("✅ Company Snapshot found locally.")
+
+    # 3. Stream & Process
+    print("🔄 Streaming Snapshot...")
+
+    # Some snapshot headers carry a leading space (' CompanyNumber'), so match on stripped names
+    chunk_iter = pd.read_csv(
+        local_path,
+        chunksize=BATCH_SIZE,
+        dtype=str,
+        usecols=lambda c: c.strip() in SNAPSHOT_COLUMNS
+    )
+
+    total_matched = 0
+    changed_companies = set()
+
+    for i, df in enumerate(chunk_iter):
+        df.columns = [c.strip() for c in df.columns]
+
+        df['norm_number'] = df['CompanyNumber'].map(normalize_company_number)
+        df = df[df['norm_number'].isin(owner_map.keys())]
+        if df.empty:
+            continue
+
+        # SIC columns look like '68100 - Other letting and operating of own or leased real estate'
+        sic_cols = [c for c in df.columns if c.startswith('SICCode')]
+        df['sic_codes'] = df[sic_cols].apply(
+            lambda row: ",".join(str(v).split(' - ')[0].strip() for v in row if isinstance(v, str) and v.strip() and v.strip() != 'None Supplied'),
+            axis=1
+        )
+
+        # Companies are fanned back out to every local ID CCOD used for them
+        df['company_number'] = df['norm_number'].map(owner_map)
+        df = df.explode('company_number')
+
+        updates = pd.DataFrame({
+            'company_number': df['company_number'],
+            'company_name': df['CompanyName'],
+            'company_category': df['CompanyCategory'],
+            'company_status': df['CompanyStatus'].str.upper(),
+            'incorporation_country': df['CountryOfOrigin'],
+            'incorporation_date': pd.to_datetime(df['IncorporationDate'], dayfirst=True, errors='coerce').dt.date,
+            'last_accounts_date': pd.to_datetime(df['Accounts.LastMadeUpDate'], dayfirst=True, errors='coerce').dt.date,
+            'sic_codes': df['sic_codes']
+        })
+
+        # WRITE TO DB (set-based update from a temp table)
+        with engine.connect() as conn:
+            updates.to_sql('temp_company_snapshot', conn, if_exists='replace', index=False)
+            changed_companies.update(row[0] for row in conn.execute(text("""
+                SELECT s.company_number FROM temp_company_snapshot s
+                JOIN corporate_registry c ON c.company_number = s.company_number
+                WHERE c.company_name IS NOT s.company_name
+                   OR c.company_category IS NOT s.company_category
+                   OR c.company_status IS NOT s.company_status
+                   OR c.incorporation_country IS NOT s.incorporation_country
+                   OR c.incorporation_date IS NOT s.incorporation_date
+                   OR c.last_accounts_date IS NOT s.last_accounts_date
+                   OR c.sic_codes IS NOT s.sic_codes
+            """)))
+            conn.execute(text("""
+                UPDATE corporate_registry
+                SET company_name = s.company_name,
+                    company_category = s.company_category,
+                    company_status = s.company_status,
+                    incorporation_country = s.incorporation_country,
+                    incorporation_date = s.incorporation_date,
+                    last_accounts_date = s.last_accounts_date,
+                    sic_codes = s.sic_codes
+                FROM temp_company_snapshot s
+                WHERE corporate_registry.company_number = s.company_number
+            """))
+            conn.commit()
+
+        total_matched += len(updates)
+        print(f"   ✅ Batch {i+1}: Matched {len(updates)} owners...")
+
+    # Only the properties of companies whose record changed; addresses are untouched
+    post_ingest(engine, 'companies', uprns_for(engine, 'company_number', changed_companies), reindex_addresses=False)
+
+    print("=========================================")
+    print(f"🎉 COMPANY SNAPSHOT COMPLETE.")
+    print(f"📊 Total Owners Profiled: {total_matched} ({len(changed_companies)} changed)")
+    print("=========================================")
+
+if __name__ == "__main__":
+    ingest_companies()
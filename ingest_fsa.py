@@ -3,6 +3,8 @@ import time
 from datetime import datetime
 from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
+from vantage_pipeline import bump_generation
+from score_distress import rescore_matching
 
 # --- CONFIGURATION ---
 DB_PATH = "sqlite:///vantage.db"
@@ -40,6 +42,7 @@ def ingest_fsa():
     target_authorities = [530, 517, 527]
     
     total_ingested = 0
+    touched_postcodes = set()
     
     for auth_id in target_authorities:
         print(f"📡 Querying FSA Authority ID: {auth_id}...")
@@ -105,6 +108,8 @@ def ingest_fsa():
                             "auth": str(auth_id)
                         })
                         count_in_batch += 1
+                        if postcode:
+                            touched_postcodes.add(postcode)
                     conn.commit()
                 
                 total_ingested += count_in_batch
@@ -116,6 +121,10 @@ def ingest_fsa():
         except Exception as e:
             print(f"   ❌ Exception: {e}")
             
+    # Inspection freshness feeds the distress score of every UPRN on the postcode
+    rescore_matching(engine, 'postcode', touched_postcodes)
+    bump_generation(engine, 'fsa')
+
     print("=========================================")
     print(f"🎉 FSA SCAN COMPLETE.")
     print(f"📊 Total Retail Units Mapped: {total_ingested}")
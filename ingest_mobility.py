@@ -2,6 +2,7 @@ import requests
 import time
 from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
+from vantage_pipeline import bump_generation
 
 # --- CONFIGURATION ---
 DB_PATH = "sqlite:///vantage.db"
@@ -94,6 +95,8 @@ def ingest_mobility():
         except Exception as e:
             print(f"   ❌ API Exception: {e}")
             
+    bump_generation(engine, 'mobility')
+
     print("=========================================")
     print(f"🎉 MOBILITY INDEX COMPLETE.")
     print(f"📊 Total Transport Nodes Mapped: {total_nodes}")
@@ -4,6 +4,7 @@ import time
 from datetime import datetime, timedelta
 from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
+from vantage_pipeline import post_ingest
 
 # --- CONFIGURATION ---
 DB_PATH = "sqlite:///vantage.db"
@@ -58,6 +59,7 @@ def ingest_planning():
         targets = conn.execute(query_targets).fetchall()
 
     print(f"📡 Scanning planning history for {len(targets)} distressed assets...")
+    touched_uprns = set()
 
     for target in targets:
         uprn, postcode, lat, lng = target
@@ -122,12 +124,15 @@ def ingest_planning():
                             "url": record.get('url')
                         })
                         conn.commit()
+                    touched_uprns.add(uprn)
 
         except Exception as e:
             print(f"   ❌ API Error: {e}")
             
         time.sleep(0.2) # Respect rate limits
 
+    post_ingest(engine, 'planning', touched_uprns)
+
     print("=========================================")
     print(f"🎉 PLANNING SCAN COMPLETE.")
     print("=========================================")
@@ -3,6 +3,9 @@ import pandas as pd
 from sqlalchemy import create_engine, text
 from vantage_s3 import VantageDataLake
 from dotenv import load_dotenv
+from vantage_pipeline import bump_generation
+from build_comps import refresh_comps
+from build_hpi import refresh_hpi
 
 # --- CONFIGURATION ---
 BATCH_SIZE = 50000
@@ -35,10 +38,17 @@ def ingest_ppd():
                 postcode VARCHAR(10),
                 property_type CHAR(1),
                 full_address TEXT,
-                paon TEXT, saon TEXT, street TEXT
+                paon TEXT, saon TEXT, street TEXT,
+                load_batch INTEGER      -- Ingest run that last added or changed the row
             )
         """))
+        columns = {row[1] for row in conn.execute(text("PRAGMA table_info(raw_ppd_staging)"))}
+        if 'load_batch' not in columns:
+            conn.execute(text("ALTER TABLE raw_ppd_staging ADD COLUMN load_batch INTEGER"))
         conn.execute(text("CREATE INDEX IF NOT EXISTS idx_ppd_postcode ON raw_ppd_staging(postcode)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_ppd_batch ON raw_ppd_staging(load_batch)"))
+        batch = (conn.execute(text("SELECT MAX(load_batch) FROM raw_ppd_staging")).scalar() or 0) + 1
+        conn.commit()
 
     # --- PART A: BASELINE (The History) ---
     remote_key_baseline = "raw/ppd/baseline/pp-complete.csv"
@@ -50,7 +60,7 @@ def ingest_ppd():
     else:
         print("✅ PPD Baseline found locally.")
 
-    process_ppd_file(local_path_baseline, engine, "Baseline", filter_year=START_YEAR)
+    process_ppd_file(local_path_baseline, engine, "Baseline", batch, filter_year=START_YEAR)
 
     # --- PART B: MONTHLY UPDATE (The Freshness) ---
     remote_key_monthly = "raw/ppd/monthly/pp-monthly-update-new-version.csv"
@@ -61,18 +71,26 @@ def ingest_ppd():
         print(f"⬇️  Downloading PPD Monthly Update...")
         try:
             lake.download_file(remote_key_monthly, local_path_monthly)
-            process_ppd_file(local_path_monthly, engine, "Monthly Update", filter_year=None)
+            process_ppd_file(local_path_monthly, engine, "Monthly Update", batch, filter_year=None)
         except Exception as e:
             print(f"⚠️  Could not download monthly update (Check AWS Keys): {e}")
     else:
         print("⚠️  Skipping Monthly Update (AWS Keys missing). Using Baseline data only.")
 
+    refresh_comps(engine)
+    refresh_hpi(engine)
+    bump_generation(engine, 'ppd')
+
     print("=========================================")
     print(f"🎉 PPD PIPELINE COMPLETE.")
     print("=========================================")
 
 
-def process_ppd_file(filepath, engine, label, filter_year=None):
+def process_ppd_file(filepath, engine, label, batch, filter_year=None):
+    """
+    Loads a PPD CSV into raw_ppd_staging. Only new or changed sales are written (stamped
+    with `batch`), so re-loading the baseline doesn't mark the whole history as changed.
+    """
     print(f"\n🔄 Processing {label} ({filepath})...")
     
     chunk_iter = pd.read_csv(
@@ -86,7 +104,7 @@ def process_ppd_file(filepath, engine, label, filter_year=None):
         parse_dates=['date']
     )
     
-    total_ingested = 0
+    total_ingested = total_changed = 0
     
     for i, df in enumerate(chunk_iter):
         
@@ -112,22 +130,31 @@ def process_ppd_file(filepath, engine, label, filter_year=None):
             
             upload_df.to_sql('temp_ppd', conn, if_exists='replace', index=False)
             
-            # Upsert (Replace if transaction ID exists, usually implies an update/correction)
-            conn.execute(text("""
+            # Upsert only new sales and corrections (an existing transaction ID whose content differs)
+            changed = conn.execute(text("""
                 INSERT OR REPLACE INTO raw_ppd_staging 
-                (transaction_id, price_paid, transfer_date, postcode, property_type, full_address, paon, saon, street)
-                SELECT transaction_id, price_paid, transfer_date, postcode, property_type, full_address, paon, saon, street 
-                FROM temp_ppd
-            """))
+                (transaction_id, price_paid, transfer_date, postcode, property_type, full_address, paon, saon, street, load_batch)
+                SELECT t.transaction_id, t.price_paid, t.transfer_date, t.postcode, t.property_type, t.full_address,
+                       t.paon, t.saon, t.street, :batch
+                FROM temp_ppd t
+                LEFT JOIN raw_ppd_staging s ON s.transaction_id = t.transaction_id
+                WHERE s.transaction_id IS NULL
+                   OR s.price_paid IS NOT t.price_paid OR s.transfer_date IS NOT t.transfer_date
+                   OR s.postcode IS NOT t.postcode OR s.property_type IS NOT t.property_type
+                   OR s.full_address IS NOT t.full_address OR s.paon IS NOT t.paon
+                   OR s.saon IS NOT t.saon OR s.street IS NOT t.street
+            """), {"batch": batch}).rowcount
+            conn.execute(text("DROP TABLE temp_ppd"))
             conn.commit()
             
         count = len(df_recent)
         total_ingested += count
+        total_changed += changed
         
         if i % 10 == 0:
-            print(f"   ✅ Batch {i}: Added {count} sales...")
+            print(f"   ✅ Batch {i}: Read {count} sales, {changed} new or changed...")
 
-    print(f"   📊 {label} Loaded: {total_ingested} records.")
+    print(f"   📊 {label} Loaded: {total_ingested} records ({total_changed} new or changed).")
 
 if __name__ == "__main__":
     ingest_ppd()
\ No newline at end of file
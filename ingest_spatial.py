@@ -4,6 +4,7 @@ import math
 from sqlalchemy import create_engine, text
 from vantage_s3 import VantageDataLake
 from dotenv import load_dotenv
+from vantage_pipeline import post_ingest, uprns_for
 
 # --- CONFIGURATION ---
 DB_PATH = "sqlite:///vantage.db"
@@ -71,6 +72,7 @@ def ingest_spatial():
                 district_code VARCHAR(10)
             )
         """))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_postcode_grid ON postcode_index(eastings, northings)"))
     
     # 2. Scan S3 for Code-Point Files
     print("📡 Scanning S3 for Code-Point Open files...")
@@ -91,6 +93,7 @@ def ingest_spatial():
     
     # 3. Process Files
     total_ingested = 0
+    changed_postcodes = set()  # New or moved centroids: their UPRNs' map position falls back to them
     
     if not os.path.exists("./epc_data/spatial"):
         os.makedirs("./epc_data/spatial")
@@ -133,15 +136,33 @@ def ingest_spatial():
                     data['latitude'] = 0
                     data['longitude'] = 0
                 
-                data.to_sql('postcode_index', engine, if_exists='append', index=False)
+                with engine.connect() as conn:
+                    data.to_sql('temp_postcode_index', conn, if_exists='replace', index=False)
+                    changed = [row[0] for row in conn.execute(text("""
+                        SELECT t.postcode FROM temp_postcode_index t
+                        LEFT JOIN postcode_index pc ON pc.postcode = t.postcode
+                        WHERE pc.postcode IS NULL OR pc.latitude IS NOT t.latitude OR pc.longitude IS NOT t.longitude
+                           OR pc.eastings IS NOT t.eastings OR pc.northings IS NOT t.northings
+                           OR pc.district_code IS NOT t.district_code
+                    """))]
+                    conn.execute(text("""
+                        INSERT OR REPLACE INTO postcode_index (postcode, latitude, longitude, eastings, northings, district_code)
+                        SELECT postcode, latitude, longitude, eastings, northings, district_code FROM temp_postcode_index
+                    """))
+                    conn.execute(text("DROP TABLE temp_postcode_index"))
+                    conn.commit()
+                changed_postcodes.update(changed)
                 total_ingested += len(data)
                 
         except Exception as e:
             print(f"❌ Error processing {filename}: {e}")
             
+    # Centroids are the lat/lng fallback for the distress view, tiles and dossier
+    post_ingest(engine, 'spatial', uprns_for(engine, 'postcode', changed_postcodes), reindex_addresses=False)
+
     print("=========================================")
     print(f"🎉 SPATIAL INDEX COMPLETE.")
-    print(f"📊 Total Postcodes Mapped: {total_ingested}")
+    print(f"📊 Total Postcodes Mapped: {total_ingested} ({len(changed_postcodes)} new or moved)")
     print("=========================================")
 
 if __name__ == "__main__":
@@ -3,6 +3,7 @@ import pandas as pd
 from sqlalchemy import create_engine, text
 from vantage_s3 import VantageDataLake
 from dotenv import load_dotenv
+from vantage_pipeline import bump_generation
 
 # --- CONFIGURATION ---
 BATCH_SIZE = 50000
@@ -47,6 +48,8 @@ def ingest_voa():
     # S3 Path: raw/voa/2026/draft_list_entries.csv
     process_voa_file(lake, engine, "2026", "raw/voa/2026/draft_list_entries.csv", "./epc_data/voa_2026.csv")
 
+    bump_generation(engine, 'voa')
+
     print("=========================================")
     print(f"🎉 VOA PIPELINE COMPLETE.")
     print("=========================================")
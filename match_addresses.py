@@ -1,5 +1,6 @@
 import difflib
 from sqlalchemy import create_engine, text
+from vantage_pipeline import post_ingest
 
 # --- CONFIGURATION ---
 DB_PATH = "sqlite:///vantage.db"
@@ -37,6 +38,7 @@ def match_addresses():
         print(f"   found {len(targets)} distressed assets needing ownership data.")
         
         matches_found = 0
+        linked_uprns = []
         
         # 2. Loop through each target
         for target in targets:
@@ -89,7 +91,10 @@ def match_addresses():
                 conn.commit()
                 
                 matches_found += 1
+                linked_uprns.append(uprn)
             
+    post_ingest(engine, 'match_addresses', linked_uprns)
+
     print("==================================================")
     print(f"🎉 LINKING COMPLETE.")
     print(f"🔗 Successfully connected {matches_found} properties to their owners.")
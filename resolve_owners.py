@@ -0,0 +1,246 @@
+import re
+from collections import defaultdict
+import pandas as pd
+from sqlalchemy import create_engine, text
+from vantage_companies import normalize_company_number
+from vantage_pipeline import bump_generation
+
+# --- CONFIGURATION ---
+DB_PATH = "sqlite:///vantage.db"
+SIMILARITY_THRESHOLD = 0.8   # Trigram Jaccard needed to merge two name keys
+MAX_BLOCK_SIZE = 200         # Trigrams shared by more names than this are too common to block on
+MIN_SHARED_GRAMS = 3
+
+# Legal-form variants -> one canonical token (longest first: the alternation tries them in order)
+SUFFIXES = {
+    'PUBLIC LIMITED COMPANY': 'PLC',
+    'LIMITED LIABILITY PARTNERSHIP': 'LLP',
+    'LIMITED': 'LTD',
+    'L T D': 'LTD',
+    'COMPANY': 'CO',
+    'INCORPORATED': 'INC',
+    'CORPORATION': 'CORP',
+    'S A R L': 'SARL',
+}
+SUFFIX_PATTERN = re.compile(r'\b(' + '|'.join(SUFFIXES) + r')\b')
+PUNCTUATION = re.compile(r"[^A-Z0-9 ]")
+LEGAL_FORMS = {'LTD', 'PLC', 'LLP', 'LP', 'INC', 'CORP', 'SARL', 'SA', 'BV', 'NV', 'GMBH', 'AG', 'CO'}
+
+def normalize_name(name):
+    """
+    'The XYZ Properties Limited.' -> 'XYZ PROPERTIES LTD'
+    """
+    if not name or pd.isna(name): return ""
+    name = str(name).upper().replace('&', ' AND ')
+    name = " ".join(PUNCTUATION.sub(" ", name).split())
+    name = SUFFIX_PATTERN.sub(lambda m: SUFFIXES[m.group(1)], name)
+    if name.startswith("THE "):
+        name = name[4:]
+    return name
+
+def name_key(normalized):
+    """
+    Blocking/matching key: the name without its legal form ('XYZ PROPERTIES').
+    """
+    tokens = [t for t in normalized.split() if t not in LEGAL_FORMS]
+    return " ".join(tokens)
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class UnionFind:
+    """
+    Clusters with at most one company-number anchor each: names never merge two
+    different registered companies together, however similar they look.
+    """
+    def __init__(self):
+        self.parent = {}
+        self.anchor = {}
+
+    def add(self, node, anchor=None):
+        if node not in self.parent:
+            self.parent[node] = node
+            self.anchor[node] = anchor
+
+    def find(self, node):
+        root = node
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[node] != root:
+            self.parent[node], node = root, self.parent[node]
+        return root
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra == rb:
+            return True
+        anchor_a, anchor_b = self.anchor[ra], self.anchor[rb]
+        if anchor_a and anchor_b and anchor_a != anchor_b:
+            return False
+        self.parent[rb] = ra
+        self.anchor[ra] = anchor_a or anchor_b
+        return True
+
+def ensure_tables(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS owner_clusters (
+            proprietor_name TEXT,
+            company_number VARCHAR(20),
+            name_key TEXT,
+            cluster_id TEXT,
+            match_rule VARCHAR(20)
+        )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_clusters_name ON owner_clusters(proprietor_name, company_number)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_clusters_cluster ON owner_clusters(cluster_id)"))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS owner_portfolio (
+            cluster_id TEXT PRIMARY KEY,
+            display_name TEXT,
+            company_count INTEGER,
+            name_variant_count INTEGER,
+            title_count INTEGER,
+            fg_asset_count INTEGER
+        )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_owner_portfolio_titles ON owner_portfolio(title_count)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_ownership_proprietor ON ownership_records(proprietor_name)"))
+    conn.commit()
+
+def resolve_owners():
+    print("🧩 STARTING PROPRIETOR ENTITY RESOLUTION")
+    print("============================================")
+
+    engine = create_engine(DB_PATH)
+
+    with engine.connect() as conn:
+        owners = pd.read_sql(text("""
+            SELECT DISTINCT proprietor_name, company_number
+            FROM ownership_records
+            WHERE proprietor_name IS NOT NULL
+        """), conn)
+
+    print(f"📡 {len(owners)} distinct proprietor name/number pairs.")
+
+    owners['normalized'] = owners['proprietor_name'].map(normalize_name)
+    owners['name_key'] = owners['normalized'].map(name_key)
+    owners = owners[owners['name_key'] != ''].copy()
+
+    # Each (name_key, anchor) pair is a node; unregistered owners are anchored to nothing
+    owner_nodes = [
+        (key, normalize_company_number(number) if pd.notna(number) else None)
+        for key, number in zip(owners['name_key'], owners['company_number'])
+    ]
+    uf = UnionFind()
+    for node in owner_nodes:
+        uf.add(node, node[1])
+    rules = {}
+
+    # 1. Anchor: every name variant filed under one company number is the same owner
+    by_anchor = defaultdict(list)
+    for node in uf.parent:
+        if node[1]:
+            by_anchor[node[1]].append(node)
+    for nodes in by_anchor.values():
+        for other in nodes[1:]:
+            uf.union(nodes[0], other)
+            rules[other] = 'company_number'
+
+    # 2. Exact name key ('XYZ LIMITED' == 'XYZ LTD.'), within the anchor constraint
+    by_key = defaultdict(list)
+    for node in uf.parent:
+        by_key[node[0]].append(node)
+    for nodes in by_key.values():
+        # Anchored nodes first so unregistered variants attach to a registered company
+        nodes.sort(key=lambda n: n[1] is None)
+        for other in nodes[1:]:
+            if uf.union(nodes[0], other):
+                rules.setdefault(other, 'exact_name')
+
+    # 3. Fuzzy: trigram blocking over distinct keys, Jaccard similarity on candidates
+    keys = list(by_key.keys())
+    grams = {k: trigrams(k) for k in keys}
+    blocks = defaultdict(list)
+    for k in keys:
+        for g in grams[k]:
+            blocks[g].append(k)
+
+    fuzzy_merges = 0
+    for k in keys:
+        shared = defaultdict(int)
+        for g in grams[k]:
+            block = blocks[g]
+            if len(block) > MAX_BLOCK_SIZE:
+                continue
+            for other in block:
+                if other > k:
+                    shared[other] += 1
+        for other, count in shared.items():
+            if count < MIN_SHARED_GRAMS:
+                continue
+            # Numbered SPVs ('XYZ PROPERTIES 2') must agree on their numbers
+            if re.findall(r'\d+', k) != re.findall(r'\d+', other):
+                continue
+            jaccard = count / len(grams[k] | grams[other])
+            if jaccard >= SIMILARITY_THRESHOLD:
+                if uf.union(by_key[k][0], by_key[other][0]):
+                    rules.setdefault(by_key[other][0], 'fuzzy_name')
+                    fuzzy_merges += 1
+
+    # 4. Stable cluster IDs: the anchor company number, else the alphabetically first key
+    members = defaultdict(list)
+    for node in uf.parent:
+        members[uf.find(node)].append(node)
+    cluster_of = {}
+    for root, nodes in members.items():
+        anchor = uf.anchor[root]
+        cluster_id = f"CN:{anchor}" if anchor else f"NM:{min(n[0] for n in nodes)}"
+        for node in nodes:
+            cluster_of[node] = cluster_id
+
+    owners['cluster_id'] = [cluster_of[node] for node in owner_nodes]
+    owners['match_rule'] = [rules.get(node, 'self') for node in owner_nodes]
+
+    mapping = owners[['proprietor_name', 'company_number', 'name_key', 'cluster_id', 'match_rule']]
+
+    # WRITE TO DB (full rebuild: the mapping is derived entirely from CCOD)
+    with engine.connect() as conn:
+        ensure_tables(conn)
+        conn.execute(text("DELETE FROM owner_clusters"))
+        mapping.to_sql('temp_owner_clusters', conn, if_exists='replace', index=False)
+        conn.execute(text("""
+            INSERT INTO owner_clusters (proprietor_name, company_number, name_key, cluster_id, match_rule)
+            SELECT proprietor_name, company_number, name_key, cluster_id, match_rule FROM temp_owner_clusters
+        """))
+
+        # Portfolio per resolved owner, including unregistered / overseas proprietors
+        conn.execute(text("DELETE FROM owner_portfolio"))
+        conn.execute(text("""
+            INSERT INTO owner_portfolio (cluster_id, display_name, company_count, name_variant_count, title_count, fg_asset_count)
+            SELECT oc.cluster_id,
+                   MIN(oc.proprietor_name),
+                   COUNT(DISTINCT oc.company_number),
+                   COUNT(DISTINCT oc.proprietor_name),
+                   COUNT(DISTINCT o.title_number),
+                   COUNT(DISTINCT CASE WHEN e.asset_rating_band IN ('F', 'G') THEN p.uprn END)
+            FROM owner_clusters oc
+            JOIN ownership_records o
+              ON o.proprietor_name = oc.proprietor_name
+             AND o.company_number IS oc.company_number
+            LEFT JOIN master_properties p ON p.title_number = o.title_number
+            LEFT JOIN epc_assessments e ON e.uprn = p.uprn
+            GROUP BY oc.cluster_id
+        """))
+        conn.execute(text("DROP TABLE temp_owner_clusters"))
+        conn.commit()
+
+    bump_generation(engine, 'resolve_owners')
+
+    print("============================================")
+    print("🎉 ENTITY RESOLUTION COMPLETE.")
+    print(f"👥 {len(members)} owner clusters from {len(owners)} name variants ({fuzzy_merges} fuzzy merges).")
+    print("============================================")
+
+if __name__ == "__main__":
+    resolve_owners()
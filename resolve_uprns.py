@@ -0,0 +1,117 @@
+import pandas as pd
+from sqlalchemy import create_engine, text
+from vantage_os import OrdnanceSurvey
+from vantage_pipeline import post_ingest
+
+# --- CONFIGURATION ---
+DB_PATH = "sqlite:///vantage.db"
+BATCH_SIZE = 5000  # Addresses resolved (and written back) per round
+
+def ensure_columns(conn):
+    """
+    Older databases pre-date the classification column.
+    """
+    columns = [row[1] for row in conn.execute(text("PRAGMA table_info(master_properties)"))]
+    if 'classification_code' not in columns:
+        conn.execute(text("ALTER TABLE master_properties ADD COLUMN classification_code VARCHAR(10)"))
+        conn.commit()
+
+def resolve_uprns():
+    print("🧭 STARTING BATCH UPRN RESOLUTION (OS Places)")
+    print("============================================")
+
+    engine = create_engine(DB_PATH)
+    os_api = OrdnanceSurvey()
+
+    if not os_api.api_key:
+        print("❌ STOP: No OS API Key found.")
+        print("   Please add OS_API_KEY=your_key to .env")
+        return
+
+    with engine.connect() as conn:
+        ensure_columns(conn)
+
+        # Properties we can't place on a map yet (includes CCOD stubs with no UPRN at all)
+        targets = pd.read_sql(text("""
+            SELECT rowid AS row_id, uprn, address_line_1, postcode
+            FROM master_properties
+            WHERE latitude IS NULL
+              AND address_line_1 IS NOT NULL
+        """), conn)
+
+    print(f"🎯 {len(targets)} properties missing coordinates.")
+
+    total_resolved = 0
+    touched_uprns = set()
+
+    for start in range(0, len(targets), BATCH_SIZE):
+        batch = targets.iloc[start:start + BATCH_SIZE].copy()
+        batch['query'] = (batch['address_line_1'].fillna('') + ', ' + batch['postcode'].fillna('')).str.strip(', ')
+
+        matches = os_api.resolve_batch(batch['query'].tolist())
+
+        batch['os_uprn'] = batch['query'].map(lambda q: (matches.get(q) or {}).get('uprn'))
+        batch['latitude'] = batch['query'].map(lambda q: (matches.get(q) or {}).get('lat'))
+        batch['longitude'] = batch['query'].map(lambda q: (matches.get(q) or {}).get('lng'))
+        batch['classification_code'] = batch['query'].map(lambda q: (matches.get(q) or {}).get('classification_code'))
+
+        found = batch.dropna(subset=['os_uprn'])
+        touched_uprns.update(found['os_uprn'])
+        touched_uprns.update(found['uprn'].dropna())
+        found = found[['row_id', 'os_uprn', 'latitude', 'longitude', 'classification_code']]
+
+        # WRITE TO DB (one set-based update per batch instead of one per row)
+        with engine.connect() as conn:
+            found.to_sql('temp_os_matches', conn, if_exists='replace', index=False)
+
+            # A. Rows that already have a UPRN (from EPC): fill location + classification only
+            conn.execute(text("""
+                UPDATE master_properties
+                SET latitude = m.latitude,
+                    longitude = m.longitude,
+                    classification_code = m.classification_code
+                FROM temp_os_matches m
+                WHERE master_properties.rowid = m.row_id
+                  AND master_properties.uprn IS NOT NULL
+            """))
+
+            # B. Title stubs (from CCOD): adopt the official UPRN.
+            # OR IGNORE skips stubs whose UPRN already exists on another row...
+            conn.execute(text("""
+                UPDATE OR IGNORE master_properties
+                SET uprn = m.os_uprn,
+                    latitude = m.latitude,
+                    longitude = m.longitude,
+                    classification_code = m.classification_code
+                FROM temp_os_matches m
+                WHERE master_properties.rowid = m.row_id
+                  AND master_properties.uprn IS NULL
+            """))
+
+            # ...in which case we hand the stub's title to that row, linking EPC <-> Land Registry
+            conn.execute(text("""
+                UPDATE master_properties
+                SET title_number = s.title_number
+                FROM (
+                    SELECT m.os_uprn, p.title_number
+                    FROM temp_os_matches m
+                    JOIN master_properties p ON p.rowid = m.row_id
+                    WHERE p.uprn IS NULL AND p.title_number IS NOT NULL
+                ) s
+                WHERE master_properties.uprn = s.os_uprn
+                  AND (master_properties.title_number IS NULL OR master_properties.title_number = '')
+            """))
+            conn.commit()
+
+        total_resolved += len(found)
+        print(f"   ✅ Batch {start // BATCH_SIZE + 1}: Resolved {len(found)}/{len(batch)} addresses...")
+
+    post_ingest(engine, 'resolve_uprns', touched_uprns)
+
+    print("============================================")
+    print("🎉 UPRN RESOLUTION COMPLETE.")
+    print(f"📍 Total Properties Located: {total_resolved}")
+    print("============================================")
+
+if __name__ == "__main__":
+    resolve_uprns()
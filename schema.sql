@@ -12,6 +12,7 @@ CREATE TABLE IF NOT EXISTS master_properties (
     latitude DECIMAL(10, 6),
     longitude DECIMAL(10, 6),
     local_authority_code VARCHAR(10),
+    classification_code VARCHAR(10), -- OS AddressBase class (e.g. 'CR' Retail), from OS Places
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -27,7 +28,8 @@ CREATE TABLE IF NOT EXISTS corporate_registry (
     company_category TEXT, -- 'LTD', 'PLC', 'OVERSEAS'
     company_status TEXT,   -- 'ACTIVE', 'DISSOLVED', 'LIQUIDATION'
     last_accounts_date DATE,
-    sic_codes TEXT
+    sic_codes TEXT,
+    incorporation_date DATE -- From the CH bulk snapshot (ingest_companies.py)
 );
 
 -- 3. LAND OWNERSHIP (The Link)
@@ -114,6 +116,8 @@ CREATE TABLE IF NOT EXISTS postcode_index (
     district_code VARCHAR(10)
 );
 
+CREATE INDEX IF NOT EXISTS idx_postcode_grid ON postcode_index(eastings, northings); -- Radius searches
+
 -- 9. VOA BUSINESS RATES (The "Vacancy & Tax Signal")
 -- Derived from VOA Rating Lists (2023 & 2026 Draft)
 CREATE TABLE IF NOT EXISTS voa_ratings (
@@ -198,6 +202,389 @@ CREATE TABLE IF NOT EXISTS connectivity_metrics (
 
 CREATE INDEX IF NOT EXISTS idx_connectivity_speed ON connectivity_metrics(max_download_speed);
 
+-- 14. COMPANY ENRICHMENT (The "Deep Dive")
+-- Source: Companies House API (enrich_owners.py).
+-- Raw profile/officers/PSC/charges payloads per owner. Doubles as the enrichment checkpoint.
+CREATE TABLE IF NOT EXISTS company_enrichment (
+    company_number VARCHAR(20) PRIMARY KEY, -- Local ID (as in corporate_registry)
+    official_number VARCHAR(20),            -- CH number it resolved to
+    match_status VARCHAR(20),               -- 'matched', 'no_match', 'snapshot'
+    profile_json TEXT,
+    officers_json TEXT,
+    psc_json TEXT,
+    charges_json TEXT,
+    enriched_at DATETIME,
+    charges_loaded_at DATETIME,             -- When ingest_charges.py last flattened charges_json
+    FOREIGN KEY(company_number) REFERENCES corporate_registry(company_number)
+);
+
+-- 15. UBO GRAPH (The "Puppet Masters")
+-- Source: PSC records (API via company_enrichment, or the PSC bulk snapshot). Built by build_ubo_graph.py.
+-- Edges: company -> direct controller. Controller keys: 'C:<company no>', 'P:<name>|<yyyy-mm>', 'E:<name>'.
+CREATE TABLE IF NOT EXISTS psc_edges (
+    company_number VARCHAR(20),
+    controller_key TEXT,
+    controller_kind VARCHAR(20),   -- 'individual', 'corporate', 'overseas', 'other'
+    controller_name TEXT,
+    natures_of_control TEXT,
+    PRIMARY KEY (company_number, controller_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_psc_controller ON psc_edges(controller_key);
+
+-- Transitive closure: every controller of a company at any depth, maintained incrementally.
+CREATE TABLE IF NOT EXISTS ubo_closure (
+    company_number VARCHAR(20),
+    controller_key TEXT,
+    controller_kind VARCHAR(20),
+    controller_name TEXT,
+    depth INTEGER,                 -- 1 = direct PSC
+    is_ultimate BOOLEAN DEFAULT 0, -- End of the chain (person, overseas entity, or no PSCs on file)
+    PRIMARY KEY (company_number, controller_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_ubo_controller ON ubo_closure(controller_key, is_ultimate);
+CREATE INDEX IF NOT EXISTS idx_enrichment_official ON company_enrichment(official_number);
+-- Owners never enriched reach the closure by their CH-normalised number (vantage_companies.normalized_number_sql)
+CREATE INDEX IF NOT EXISTS idx_ownership_official ON ownership_records(CASE WHEN upper(trim(company_number)) NOT GLOB '*[^0-9]*' AND length(upper(trim(company_number))) BETWEEN 1 AND 7 THEN substr('00000000' || upper(trim(company_number)), -8) ELSE upper(trim(company_number)) END);
+
+-- 16. COMPANY CHARGES (The "Debt Clock")
+-- Source: Companies House charges (every page), flattened by ingest_charges.py.
+CREATE TABLE IF NOT EXISTS company_charges (
+    charge_id VARCHAR(64) PRIMARY KEY,     -- '<CH number>/<charge code>' (pre-2013 charges: the CH charge id)
+    company_number VARCHAR(20),            -- CH number (local owners via company_enrichment.official_number)
+    charge_code VARCHAR(30),
+    status VARCHAR(20),                    -- 'outstanding', 'fully-satisfied', 'part-satisfied'
+    created_on DATE,                       -- Debt vintage
+    delivered_on DATE,
+    satisfied_on DATE,
+    lender TEXT,                           -- First person entitled (upper-cased)
+    lenders TEXT,
+    classification TEXT,
+    particulars TEXT,
+    loaded_at DATETIME
+);
+
+CREATE INDEX IF NOT EXISTS idx_charges_created ON company_charges(created_on);
+CREATE INDEX IF NOT EXISTS idx_charges_status_created ON company_charges(status, created_on);
+CREATE INDEX IF NOT EXISTS idx_charges_lender ON company_charges(lender);
+CREATE INDEX IF NOT EXISTS idx_charges_ch_company ON company_charges(company_number);
+
+-- 17. DIRECTOR NETWORK (The "Who Else")
+-- Source: CH officer listings + appointments, de-duplicated by CH officer ID. Built by build_director_network.py.
+CREATE TABLE IF NOT EXISTS officers (
+    officer_id VARCHAR(64) PRIMARY KEY,
+    name TEXT,
+    birth_month VARCHAR(7),      -- 'YYYY-MM'
+    appointment_count INTEGER,
+    fetched_at DATETIME
+);
+
+-- Inverted index: officer -> companies
+CREATE TABLE IF NOT EXISTS officer_appointments (
+    officer_id VARCHAR(64),
+    company_number VARCHAR(20),  -- CH number
+    company_name TEXT,
+    officer_role VARCHAR(50),
+    appointed_on DATE,
+    resigned_on DATE,
+    PRIMARY KEY (officer_id, company_number, officer_role)
+);
+
+CREATE INDEX IF NOT EXISTS idx_appointments_company ON officer_appointments(company_number);
+
+-- CH number -> CCOD local ID(s): companies -> titles
+CREATE TABLE IF NOT EXISTS company_keys (
+    ch_number VARCHAR(20),
+    local_company_number VARCHAR(20),
+    PRIMARY KEY (ch_number, local_company_number)
+);
+CREATE INDEX IF NOT EXISTS idx_company_keys_local ON company_keys(local_company_number);
+
+-- Precomputed rollup per officer (active appointments only for titles / F-G assets)
+CREATE TABLE IF NOT EXISTS officer_portfolio (
+    officer_id VARCHAR(64) PRIMARY KEY,
+    company_count INTEGER,
+    active_company_count INTEGER,
+    title_count INTEGER,
+    fg_asset_count INTEGER,
+    updated_at DATETIME
+);
+
+CREATE INDEX IF NOT EXISTS idx_portfolio_titles ON officer_portfolio(title_count);
+
+-- 18. OWNER CLUSTERS (The "Who, Really")
+-- Offline entity resolution over CCOD proprietor names. Built by resolve_owners.py.
+CREATE TABLE IF NOT EXISTS owner_clusters (
+    proprietor_name TEXT,        -- As it appears on the deed
+    company_number VARCHAR(20),  -- NULL for unregistered / overseas owners
+    name_key TEXT,               -- Normalised name without legal form
+    cluster_id TEXT,             -- 'CN:<company number>' or 'NM:<name key>'
+    match_rule VARCHAR(20)       -- 'self', 'company_number', 'exact_name', 'fuzzy_name'
+);
+
+CREATE INDEX IF NOT EXISTS idx_clusters_name ON owner_clusters(proprietor_name, company_number);
+CREATE INDEX IF NOT EXISTS idx_clusters_cluster ON owner_clusters(cluster_id);
+CREATE INDEX IF NOT EXISTS idx_ownership_proprietor ON ownership_records(proprietor_name);
+
+CREATE TABLE IF NOT EXISTS owner_portfolio (
+    cluster_id TEXT PRIMARY KEY,
+    display_name TEXT,
+    company_count INTEGER,
+    name_variant_count INTEGER,
+    title_count INTEGER,
+    fg_asset_count INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS idx_owner_portfolio_titles ON owner_portfolio(title_count);
+
+-- 19. DISTRESS VIEW (The "Hit List")
+-- Materialised F/G scan: one row per UPRN (latest EPC + first-listed owner).
+-- Refreshed at the end of every ingest by vantage_pipeline.post_ingest().
+CREATE TABLE IF NOT EXISTS distress_assets (
+    uprn VARCHAR(20) PRIMARY KEY,
+    address TEXT,
+    postcode VARCHAR(10),
+    local_authority VARCHAR(10),
+    latitude DECIMAL(10, 6),
+    longitude DECIMAL(10, 6),
+    asset_rating_band CHAR(2),
+    asset_rating INTEGER,
+    floor_area NUMERIC,          -- 0 when unknown, so the keyset never meets a NULL
+    property_type TEXT,
+    inspection_date DATE,
+    title_number VARCHAR(20),
+    proprietor_name TEXT,
+    owner_count INTEGER,         -- Ownership records on the title
+    company_name TEXT,
+    company_number VARCHAR(20),
+    company_status TEXT,
+    refreshed_at DATETIME,
+    tile_x INTEGER,              -- Web Mercator tile at zoom 16
+    tile_y INTEGER
+);
+
+-- The ranking key, alone and behind each filter: /api/distress-scan pages are index range seeks
+CREATE INDEX IF NOT EXISTS idx_distress_rank ON distress_assets(asset_rating_band, floor_area, uprn);
+CREATE INDEX IF NOT EXISTS idx_distress_la_rank ON distress_assets(local_authority, asset_rating_band, floor_area, uprn);
+CREATE INDEX IF NOT EXISTS idx_distress_type_rank ON distress_assets(property_type, asset_rating_band, floor_area, uprn);
+CREATE INDEX IF NOT EXISTS idx_distress_location ON distress_assets(latitude, longitude);
+
+CREATE INDEX IF NOT EXISTS idx_distress_tile ON distress_assets(tile_x, tile_y);
+
+-- Map pyramid: aggregates per non-empty tile for zooms 0-16 (serves /api/tiles/{z}/{x}/{y})
+CREATE TABLE IF NOT EXISTS distress_tiles (
+    z INTEGER,
+    x INTEGER,
+    y INTEGER,
+    asset_count INTEGER,
+    f_count INTEGER,
+    g_count INTEGER,
+    floor_area_total NUMERIC,
+    lat_sum REAL,                -- Sums, so incremental refreshes can add/subtract
+    lng_sum REAL,
+    PRIMARY KEY (z, x, y)
+);
+
+-- Property dossier: one wide row per UPRN with the latest value of every signal (serves /api/property/{uprn})
+CREATE TABLE IF NOT EXISTS property_dossier (
+    uprn VARCHAR(20) PRIMARY KEY,
+    address TEXT,
+    postcode VARCHAR(10),
+    local_authority VARCHAR(10),
+    latitude DECIMAL(10, 6),
+    longitude DECIMAL(10, 6),
+    classification_code VARCHAR(10),
+    title_number VARCHAR(20),
+    epc_certificate_id VARCHAR(24),  -- Latest EPC
+    asset_rating_band CHAR(2),
+    asset_rating INTEGER,
+    floor_area NUMERIC,
+    property_type TEXT,
+    inspection_date DATE,
+    epc_count INTEGER,
+    proprietor_name TEXT,            -- First-listed owner on the title
+    owner_count INTEGER,
+    company_number VARCHAR(20),
+    company_name TEXT,
+    company_status TEXT,
+    company_category TEXT,
+    incorporation_country TEXT,
+    voa_ref VARCHAR(50),             -- Latest rating list entry
+    voa_description TEXT,
+    rateable_value_2023 INTEGER,
+    rateable_value_2026 INTEGER,
+    planning_count INTEGER,
+    planning_application_id VARCHAR(50),  -- Latest decision
+    planning_status VARCHAR(50),
+    planning_decision_date DATE,
+    planning_expiry_date DATE,
+    planning_lapsing_soon BOOLEAN,   -- Any application on the UPRN
+    lease_count INTEGER,
+    lessee_name TEXT,                -- Latest lease on the title
+    lease_expiry_date DATE,
+    has_covenant BOOLEAN,
+    max_download_speed INTEGER,
+    fiber_availability BOOLEAN,
+    five_g_availability BOOLEAN,
+    refreshed_at DATETIME
+);
+
+CREATE INDEX IF NOT EXISTS idx_ownership_title ON ownership_records(title_number);
+CREATE INDEX IF NOT EXISTS idx_voa_uprn ON voa_ratings(uprn);
+CREATE INDEX IF NOT EXISTS idx_planning_uprn ON planning_history(uprn);
+
+-- Address type-ahead: one FTS5 document per master_properties row (same rowid), BM25-ranked by /api/search
+CREATE VIRTUAL TABLE IF NOT EXISTS address_fts USING fts5(
+    address, postcode, uprn UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+
+-- Audit log of ingest runs (also the data "generation" for caches)
+CREATE TABLE IF NOT EXISTS ingest_runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    stage VARCHAR(50),
+    touched_count INTEGER,       -- NULL = full refresh
+    distress_rows INTEGER,
+    finished_at DATETIME
+);
+
+-- Change feed: what each ingest run changed (served as Server-Sent Events by /api/events)
+CREATE TABLE IF NOT EXISTS change_events (
+    event_id INTEGER PRIMARY KEY AUTOINCREMENT,  -- Also the SSE event ID clients resume from
+    event_type VARCHAR(30),      -- 'distress_new', 'band_changed', 'distress_cleared', 'consent_lapsing', 'charge_new', 'run_finished'
+    stage VARCHAR(50),
+    uprn VARCHAR(20),
+    company_number VARCHAR(20),  -- Local ID (as in corporate_registry)
+    local_authority VARCHAR(10),
+    asset_rating_band CHAR(2),
+    payload TEXT,                -- JSON
+    created_at DATETIME
+);
+
+CREATE INDEX IF NOT EXISTS idx_events_created ON change_events(created_at);
+
+-- 20. COMPS SURFACE (The "Price Map")
+-- PPD sales sized from EPC floor areas, and robust £/sqft statistics per area. Built by build_comps.py.
+CREATE TABLE IF NOT EXISTS comps_sales (
+    transaction_id VARCHAR(40) PRIMARY KEY,
+    postcode VARCHAR(10),
+    sector VARCHAR(10),          -- 'E1 1'
+    district VARCHAR(10),        -- 'E1'
+    transfer_date DATE,
+    price_paid INTEGER,
+    property_type CHAR(1),
+    uprn VARCHAR(20),            -- EPC'd property the sale was linked to
+    floor_area NUMERIC,          -- sqm, from its latest EPC
+    price_per_sqft REAL,
+    match_rule VARCHAR(10)       -- 'address' or 'numbers'
+);
+
+CREATE INDEX IF NOT EXISTS idx_comps_sales_postcode ON comps_sales(postcode);
+CREATE INDEX IF NOT EXISTS idx_comps_sales_district ON comps_sales(district);
+
+CREATE TABLE IF NOT EXISTS comps_summary (
+    level VARCHAR(10),           -- 'postcode', 'sector', 'district'
+    area VARCHAR(10),
+    district VARCHAR(10),        -- Refresh unit
+    sale_count INTEGER,
+    median_psf REAL,
+    q1_psf REAL,
+    q3_psf REAL,
+    iqr_psf REAL,
+    weighted_mean_psf REAL,      -- Recency-weighted (1-year half-life), outliers beyond 1.5 x IQR excluded
+    first_sale DATE,
+    last_sale DATE,
+    refreshed_at DATETIME,
+    PRIMARY KEY (level, area)
+);
+
+CREATE INDEX IF NOT EXISTS idx_comps_summary_district ON comps_summary(district);
+
+-- Input fingerprints per postcode: incremental refreshes only redo postcodes whose sales or EPCs changed
+CREATE TABLE IF NOT EXISTS comps_postcode_state (
+    postcode VARCHAR(10) PRIMARY KEY,
+    sales_sig TEXT,
+    epc_sig TEXT
+);
+
+-- Local price level per district and month, for time-adjusting comps.
+-- 'repeat_sales' (build_hpi.py) is preferred, and 'median_psf' (smoothed monthly median £/sqft,
+-- build_comps.py) is the fallback for districts with too few repeat sales.
+CREATE TABLE IF NOT EXISTS price_index (
+    method VARCHAR(20),
+    district VARCHAR(10),
+    month CHAR(7),               -- 'YYYY-MM'
+    index_value REAL,            -- 100 at the district's first month
+    observations INTEGER,        -- Sales (or repeat pairs) behind the month
+    PRIMARY KEY (method, district, month)
+);
+
+-- Repeat-sale pairs behind the 'repeat_sales' price_index method (build_hpi.py).
+-- Consecutive sales of one property (postcode + SAON + PAON + street), kept between runs so
+-- each PPD update only re-pairs the postcodes it touched.
+CREATE TABLE IF NOT EXISTS hpi_pairs (
+    second_transaction_id VARCHAR(40) PRIMARY KEY,
+    first_transaction_id VARCHAR(40),
+    property_key TEXT,
+    district VARCHAR(10),
+    first_month CHAR(7),
+    second_month CHAR(7),
+    log_return REAL              -- ln(second price / first price)
+);
+
+CREATE INDEX IF NOT EXISTS idx_hpi_pairs_key ON hpi_pairs(property_key);
+CREATE INDEX IF NOT EXISTS idx_hpi_pairs_district ON hpi_pairs(district);
+
+-- Watermarks: 'ppd_batch' = highest raw_ppd_staging load_batch already paired
+CREATE TABLE IF NOT EXISTS hpi_state (
+    name VARCHAR(20) PRIMARY KEY,
+    value INTEGER
+);
+
+-- Districts whose pairs changed since their last refit (kept until the fit runs)
+CREATE TABLE IF NOT EXISTS hpi_pending (
+    district VARCHAR(10) PRIMARY KEY
+);
+
+-- 21. RADIUS VALUATIONS (The "Price Tag")
+-- Time-adjusted, distance/similarity-weighted radius comps per distressed asset. Written by value_assets.py.
+CREATE TABLE IF NOT EXISTS asset_valuations (
+    uprn VARCHAR(20) PRIMARY KEY,
+    postcode VARCHAR(10),
+    floor_area NUMERIC,
+    property_type TEXT,
+    estimate_psf REAL,
+    estimated_value INTEGER,     -- NULL when the floor area is unknown
+    comp_count INTEGER,
+    effective_comps REAL,        -- (sum w)^2 / sum w^2
+    radius_m INTEGER,            -- Search radius that yielded enough comps
+    valuation_month CHAR(7),     -- Index month the comps were adjusted to
+    valued_at DATETIME
+);
+
+-- 22. DISTRESS SCORES (The "Heat")
+-- Weighted composite of every distress signal per UPRN (score_distress.py). Refreshed with the
+-- dossier after each ingest, and by the charges / FSA loads. Only changed rows are rewritten.
+CREATE TABLE IF NOT EXISTS distress_scores (
+    uprn VARCHAR(20) PRIMARY KEY,
+    local_authority VARCHAR(10),
+    score REAL,                  -- 0-100: weighted sum of the components
+    epc_component REAL,          -- Each component is 0-1: F/G band
+    voa_component REAL,          -- 2023 -> 2026 rateable value rise
+    charges_component REAL,      -- Outstanding charges on the owning company
+    lease_component REAL,        -- Lease expiry cliff
+    planning_component REAL,     -- Consent lapsing soon
+    fsa_component REAL,          -- Share of stale FSA inspections on the postcode
+    broadband_component REAL,    -- Slow broadband
+    signal_count INTEGER,        -- Components above zero
+    scored_at DATETIME
+);
+
+CREATE INDEX IF NOT EXISTS idx_scores_rank ON distress_scores(score, uprn);
+CREATE INDEX IF NOT EXISTS idx_scores_la_rank ON distress_scores(local_authority, score, uprn);
+
 -- =========================================================================================
 -- ANALYTICAL VIEWS (The "Intelligence")
 -- =========================================================================================
@@ -0,0 +1,219 @@
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+# --- CONFIGURATION ---
+DB_PATH = "sqlite:///vantage.db"
+
+# Component -> weight in the composite (weights sum to 1, so scores run 0-100)
+WEIGHTS = {
+    'epc': 0.25,         # MEES: F/G can't be let
+    'voa': 0.15,         # 2023 -> 2026 rateable value rise (the rates bill shock)
+    'charges': 0.15,     # Outstanding secured debt on the owning company
+    'lease': 0.15,       # Lease expiry cliff
+    'planning': 0.10,    # Consent about to lapse unbuilt
+    'fsa': 0.10,         # Stale hygiene inspections on the postcode (ghost-town signal)
+    'broadband': 0.10,   # Slow connection (tech desperation)
+}
+EPC_BAND_SCORES = {'G': 1.0, 'F': 0.8, 'E': 0.4, 'D': 0.1}
+VOA_FULL_RISE = 0.5          # A 50%+ rateable value rise scores the full component
+CHARGES_FULL = 3             # Outstanding charges for the full component
+LEASE_CLIFF_YEARS = 5        # Expiry within this many years starts to count; expired scores in full
+FSA_STALE_YEARS = 3          # An inspection older than this is stale
+SLOW_BROADBAND_MBPS = 30     # Below this the component rises linearly to 1 at 0 Mbps
+
+COMPONENTS = [f"{name}_component" for name in WEIGHTS]
+
+def ensure_tables(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS distress_scores (
+            uprn VARCHAR(20) PRIMARY KEY,
+            local_authority VARCHAR(10),
+            score REAL,                  -- 0-100: weighted sum of the components
+            epc_component REAL,          -- Each component is 0-1
+            voa_component REAL,
+            charges_component REAL,
+            lease_component REAL,
+            planning_component REAL,
+            fsa_component REAL,
+            broadband_component REAL,
+            signal_count INTEGER,        -- Components above zero
+            scored_at DATETIME
+        )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_scores_rank ON distress_scores(score, uprn)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_scores_la_rank ON distress_scores(local_authority, score, uprn)"))
+
+def load_features(conn, scoped=False):
+    """
+    One row per UPRN of raw inputs: the dossier's latest values, plus outstanding charges
+    on the owning company and FSA inspection freshness on the postcode.
+    When `scoped`, only the UPRNs staged in temp_score_uprns.
+    """
+    scope = "AND d.uprn IN (SELECT uprn FROM temp_score_uprns)" if scoped else ""
+    # Charges and FSA are optional stages: score without them until they've been loaded
+    tables = {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+    charges = """
+        SELECT ce.company_number AS local_company_number, COUNT(*) AS outstanding
+        FROM company_charges ch
+        JOIN company_enrichment ce ON ce.official_number = ch.company_number
+        WHERE ch.status = 'outstanding'
+        GROUP BY ce.company_number
+    """ if 'company_charges' in tables else "SELECT NULL AS local_company_number, 0 AS outstanding"
+    fsa = """
+        SELECT postcode, COUNT(*) AS premises, SUM(rating_date IS NULL OR rating_date < :stale_before) AS stale
+        FROM fsa_ratings
+        GROUP BY postcode
+    """ if 'fsa_ratings' in tables else "SELECT NULL AS postcode, 0 AS premises, 0 AS stale"
+    stale_before = (pd.Timestamp(datetime.now().date()) - pd.DateOffset(years=FSA_STALE_YEARS)).strftime('%Y-%m-%d')
+    return pd.read_sql(text(f"""
+        SELECT d.uprn, d.local_authority, d.asset_rating_band, d.rateable_value_2023, d.rateable_value_2026,
+               d.planning_lapsing_soon, d.lease_expiry_date, d.max_download_speed,
+               COALESCE(ch.outstanding, 0) AS outstanding_charges,
+               COALESCE(f.premises, 0) AS fsa_premises, COALESCE(f.stale, 0) AS fsa_stale
+        FROM property_dossier d
+        LEFT JOIN ({charges}) ch ON ch.local_company_number = d.company_number
+        LEFT JOIN ({fsa}) f ON f.postcode = d.postcode
+        WHERE d.uprn IS NOT NULL {scope}
+    """), conn, params={"stale_before": stale_before})
+
+def score_features(features):
+    """
+    Feature matrix -> components (0-1 each), composite score and signal count, all vectorised.
+    """
+    today = pd.Timestamp(datetime.now().date())
+    rv_2023 = pd.to_numeric(features['rateable_value_2023'], errors='coerce')
+    rv_2026 = pd.to_numeric(features['rateable_value_2026'], errors='coerce')
+    years_left = (pd.to_datetime(features['lease_expiry_date'], errors='coerce') - today).dt.days / 365.25
+    speed = pd.to_numeric(features['max_download_speed'], errors='coerce')
+
+    components = pd.DataFrame({
+        'epc_component': features['asset_rating_band'].map(EPC_BAND_SCORES),
+        'voa_component': ((rv_2026 - rv_2023) / rv_2023.where(rv_2023 > 0)) / VOA_FULL_RISE,
+        'charges_component': features['outstanding_charges'] / CHARGES_FULL,
+        'lease_component': 1 - years_left / LEASE_CLIFF_YEARS,
+        'planning_component': pd.to_numeric(features['planning_lapsing_soon'], errors='coerce'),
+        'fsa_component': features['fsa_stale'] / features['fsa_premises'].where(features['fsa_premises'] > 0),
+        'broadband_component': (SLOW_BROADBAND_MBPS - speed) / SLOW_BROADBAND_MBPS,
+    }, index=features.index)[COMPONENTS].astype(float).fillna(0).clip(0, 1).round(4)
+
+    matrix = components.to_numpy()
+    scored = features[['uprn', 'local_authority']].join(components)
+    scored['score'] = (100 * matrix @ np.array(list(WEIGHTS.values()))).round(2)
+    scored['signal_count'] = (matrix > 0).sum(axis=1)
+    return scored
+
+def refresh_scores(conn, uprns=None):
+    """
+    Rescores the given UPRNs (every dossier UPRN when None) and writes only rows whose
+    component breakdown changed. Run after the dossier is refreshed. Returns rows written.
+    """
+    ensure_tables(conn)
+    scoped = uprns is not None
+    if scoped:
+        pd.DataFrame({'uprn': sorted(set(uprns))}).to_sql('temp_score_uprns', conn, if_exists='replace', index=False)
+
+    scored = score_features(load_features(conn, scoped))
+    existing = pd.read_sql(text(f"""
+        SELECT uprn, local_authority, {', '.join(COMPONENTS)} FROM distress_scores
+        {"WHERE uprn IN (SELECT uprn FROM temp_score_uprns)" if scoped else ""}
+    """), conn)
+
+    gone = set(existing['uprn']) - set(scored['uprn'])  # Dropped out of the dossier
+    if gone:
+        pd.DataFrame({'uprn': sorted(gone)}).to_sql('temp_scores_gone', conn, if_exists='replace', index=False)
+        conn.execute(text("DELETE FROM distress_scores WHERE uprn IN (SELECT uprn FROM temp_scores_gone)"))
+        conn.execute(text("DROP TABLE temp_scores_gone"))
+
+    merged = scored.merge(existing, on='uprn', how='left', suffixes=('', '_old'))
+    unchanged = (merged['local_authority'].fillna('') == merged['local_authority_old'].fillna('')).to_numpy()
+    for column in COMPONENTS:
+        unchanged = unchanged & np.isclose(merged[column], merged[f"{column}_old"].astype(float), atol=1e-4)
+    changed = scored[~unchanged]
+
+    if not changed.empty:
+        columns = ['uprn', 'local_authority', 'score', *COMPONENTS, 'signal_count', 'scored_at']
+        changed.assign(scored_at=datetime.now().isoformat(timespec='seconds'))[columns].to_sql(
+            'temp_scores', conn, if_exists='replace', index=False)
+        conn.execute(text(f"""
+            INSERT OR REPLACE INTO distress_scores ({', '.join(columns)})
+            SELECT {', '.join(columns)} FROM temp_scores
+        """))
+        conn.execute(text("DROP TABLE temp_scores"))
+    if scoped:
+        conn.execute(text("DROP TABLE temp_score_uprns"))
+    return len(changed)
+
+def refresh_aging_scores(conn):
+    """
+    The lease and FSA components move with the calendar, not just with new data: rescores
+    UPRNs whose lease was inside the expiry cliff when last scored (its component has
+    grown since), or whose postcode has an inspection that went stale after scored_at.
+    Run by post_ingest; the daily score_distress run covers quiet days. Returns rows written.
+    """
+    ensure_tables(conn)
+    today = pd.Timestamp(datetime.now().date())
+    tables = {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+    went_stale = """
+        OR EXISTS (
+            SELECT 1 FROM fsa_ratings f
+            WHERE f.postcode = d.postcode
+              AND f.rating_date >= date(s.scored_at, :fsa_window)
+              AND f.rating_date < :stale_before
+        )
+    """ if 'fsa_ratings' in tables else ""
+    uprns = [row[0] for row in conn.execute(text(f"""
+        SELECT s.uprn FROM distress_scores s
+        JOIN property_dossier d ON d.uprn = s.uprn
+        WHERE date(s.scored_at) < :today
+          AND ((d.lease_expiry_date > date(s.scored_at) AND d.lease_expiry_date < :cliff_end) {went_stale})
+    """), {
+        "today": today.strftime('%Y-%m-%d'),
+        "cliff_end": (today + pd.DateOffset(years=LEASE_CLIFF_YEARS)).strftime('%Y-%m-%d'),
+        "fsa_window": f"-{FSA_STALE_YEARS} years",
+        "stale_before": (today - pd.DateOffset(years=FSA_STALE_YEARS)).strftime('%Y-%m-%d'),
+    })]
+    return refresh_scores(conn, uprns) if uprns else 0
+
+def rescore_matching(engine, column, values):
+    """
+    For stages that change a score input without touching the dossier (charges, FSA):
+    rescores the UPRNs whose dossier `column` ('company_number' or 'postcode') is in `values`.
+    """
+    if not values:
+        return 0
+    with engine.connect() as conn:
+        pd.DataFrame({'value': sorted(set(values))}).to_sql('temp_rescore_values', conn, if_exists='replace', index=False)
+        uprns = [row[0] for row in conn.execute(text(f"""
+            SELECT d.uprn FROM property_dossier d
+            JOIN temp_rescore_values t ON t.value = d.{column}
+        """))]
+        conn.execute(text("DROP TABLE temp_rescore_values"))
+        written = refresh_scores(conn, uprns)
+        conn.commit()
+    print(f"🎯 Distress scores: {written}/{len(uprns)} UPRNs changed.")
+    return written
+
+def score_distress():
+    # Imported here: vantage_pipeline imports this module to rescore after every ingest
+    from vantage_pipeline import bump_generation
+
+    print("🎯 SCORING DISTRESS (composite of EPC, rates, debt, leases, planning, FSA, broadband)")
+    print("============================================")
+
+    # A full pass: run daily so calendar-driven components (leases, FSA staleness) stay current
+    engine = create_engine(DB_PATH)
+    with engine.connect() as conn:
+        written = refresh_scores(conn)
+        conn.commit()
+        total, flagged = conn.execute(text("SELECT COUNT(*), SUM(score > 0) FROM distress_scores")).fetchone()
+    bump_generation(engine, 'scores')
+
+    print("============================================")
+    print("🎉 DISTRESS SCORING COMPLETE.")
+    print(f"📊 UPRNs Scored: {total} ({flagged or 0} with a signal, {written} changed)")
+    print("============================================")
+
+if __name__ == "__main__":
+    score_distress()
@@ -0,0 +1,295 @@
+import sys
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+from build_comps import SQM_TO_SQFT
+from vantage_pipeline import bump_generation
+
+# --- CONFIGURATION ---
+DB_PATH = "sqlite:///vantage.db"
+RADII_M = (250, 500, 1000, 2000, 5000)   # Search widens through these until MIN_RADIUS_COMPS are found
+MIN_RADIUS_COMPS = 8
+MAX_COMP_AGE_YEARS = 10                  # Older sales aren't pulled at all, adjusted or not
+ADJUSTED_HALF_LIFE_DAYS = 3 * 365        # A time-adjusted sale still loses weight with age (the adjustment gets noisier)
+AREA_SIGMA = 0.35                        # Size similarity: weight exp(-(ln(area ratio) / AREA_SIGMA)^2)
+TYPE_MISMATCH_WEIGHT = 0.3               # A flat comp for a house (or vice versa) counts this much
+INDEX_METHODS = ('repeat_sales', 'median_psf')  # price_index methods, preferred first
+VALUATION_MONTH = None                   # 'YYYY-MM' every comp is adjusted to; None = the latest indexed month
+MAX_RETURNED_COMPS = 25
+
+# EPC property_type -> the PPD property types that are like-for-like
+TYPE_FAMILIES = {
+    'flat': {'F'}, 'maisonette': {'F'},
+    'house': {'D', 'S', 'T'}, 'bungalow': {'D', 'S', 'T'},
+}
+
+def ensure_tables(conn):
+    # Radius searches are a bounding box on the national grid
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_postcode_grid ON postcode_index(eastings, northings)"))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS asset_valuations (
+            uprn VARCHAR(20) PRIMARY KEY,
+            postcode VARCHAR(10),
+            floor_area NUMERIC,
+            property_type TEXT,
+            estimate_psf REAL,
+            estimated_value INTEGER,     -- NULL when the floor area is unknown
+            comp_count INTEGER,
+            effective_comps REAL,        -- (sum w)^2 / sum w^2: how many comps the estimate really rests on
+            radius_m INTEGER,
+            valuation_month CHAR(7),     -- Index month the comps were adjusted to
+            valued_at DATETIME
+        )
+    """))
+    conn.commit()
+
+def type_family(property_type):
+    """
+    PPD types that are like-for-like for an EPC property type; None when the type says nothing (e.g. non-domestic).
+    """
+    lowered = str(property_type or '').lower()
+    for word, family in TYPE_FAMILIES.items():
+        if word in lowered:
+            return family
+    return None
+
+class PriceIndex:
+    """
+    District price levels from price_index, loaded on first use and kept for the batch.
+    Each district uses the first of INDEX_METHODS it has. Every comp is adjusted to one
+    `valuation_month`, fixed up front (VALUATION_MONTH, else the latest indexed month), so
+    results don't depend on which districts a batch happened to load first. A district whose
+    index stops short of that month is carried flat from its last month.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.loaded = set()
+        self.levels = pd.DataFrame(columns=['district', 'month', 'level'])
+        self.bounds = pd.DataFrame(columns=['district', 'first_month', 'last_month', 'target_level', 'index_method'])
+        placeholders = ", ".join(f":m{i}" for i in range(len(INDEX_METHODS)))
+        self.valuation_month = VALUATION_MONTH or conn.execute(
+            text(f"SELECT MAX(month) FROM price_index WHERE method IN ({placeholders})"),
+            {f"m{i}": m for i, m in enumerate(INDEX_METHODS)}
+        ).scalar()
+
+    def load(self, districts):
+        missing = sorted(set(districts) - self.loaded)
+        if not missing:
+            return
+        self.loaded.update(missing)
+        placeholders = ", ".join(f":d{i}" for i in range(len(missing)))
+        rows = pd.read_sql(text(f"""
+            SELECT method, district, month, index_value AS level
+            FROM price_index
+            WHERE district IN ({placeholders})
+        """), self.conn, params={f"d{i}": d for i, d in enumerate(missing)})
+        rows = rows[rows['method'].isin(INDEX_METHODS)]
+        if rows.empty:
+            return
+
+        rank = rows['method'].map({m: i for i, m in enumerate(INDEX_METHODS)})
+        best = rank.groupby(rows['district']).transform('min')
+        rows = rows[rank == best].sort_values(['district', 'month'])
+        bounds = rows.groupby('district').agg(
+            first_month=('month', 'first'), last_month=('month', 'last'), index_method=('method', 'first'),
+        ).reset_index()
+        # Each district's level at its last indexed month on or before the valuation month
+        at_target = rows[rows['month'] <= self.valuation_month].groupby('district')['level'].last()
+        first_level = rows.groupby('district')['level'].first()
+        bounds['target_level'] = bounds['district'].map(at_target).fillna(bounds['district'].map(first_level))
+
+        self.levels = pd.concat([self.levels, rows[['district', 'month', 'level']]], ignore_index=True)
+        self.bounds = pd.concat([self.bounds, bounds], ignore_index=True)
+
+    def adjust(self, comps):
+        """
+        Adds `time_factor` (index at the valuation month / index at sale) and `index_method` to a comps frame.
+        Sales outside a district's index range use its nearest month; districts without an index aren't adjusted.
+        """
+        comps = comps.merge(self.bounds, on='district', how='left')
+        month = comps['transfer_date'].astype(str).str[:7]
+        month = month.where(month >= comps['first_month'].fillna(''), comps['first_month'])
+        comps['month'] = month.where(month <= comps['last_month'].fillna('9999'), comps['last_month'])
+        comps = comps.merge(self.levels, on=['district', 'month'], how='left')
+        comps['time_factor'] = (comps['target_level'].astype(float) / comps['level'].astype(float)).fillna(1.0)
+        comps['index_method'] = comps['index_method'].fillna('none')
+        return comps.drop(columns=['first_month', 'last_month', 'target_level', 'month', 'level'])
+
+def locate(conn, postcode):
+    """
+    (eastings, northings) of a postcode centroid, or None.
+    """
+    row = conn.execute(text("""
+        SELECT eastings, northings FROM postcode_index
+        WHERE postcode = :postcode AND eastings IS NOT NULL
+    """), {"postcode": postcode}).fetchone()
+    return tuple(row) if row else None
+
+def sales_near(conn, eastings, northings, radius):
+    """
+    Sized sales (comps_sales) in postcodes within `radius` metres of a point, newer than MAX_COMP_AGE_YEARS.
+    """
+    since = (pd.Timestamp(datetime.now().date()) - pd.DateOffset(years=MAX_COMP_AGE_YEARS)).strftime('%Y-%m-%d')
+    sales = pd.read_sql(text("""
+        SELECT s.transaction_id, s.postcode, s.district, s.transfer_date, s.price_paid,
+               s.property_type, s.uprn, s.floor_area, s.price_per_sqft, pc.eastings, pc.northings
+        FROM postcode_index pc
+        JOIN comps_sales s ON s.postcode = pc.postcode
+        WHERE pc.eastings BETWEEN :e0 AND :e1
+          AND pc.northings BETWEEN :n0 AND :n1
+          AND s.transfer_date >= :since
+    """), conn, params={"e0": eastings - radius, "e1": eastings + radius,
+                        "n0": northings - radius, "n1": northings + radius, "since": since})
+    sales['distance_m'] = np.hypot(sales['eastings'] - eastings, sales['northings'] - northings)
+    return sales[sales['distance_m'] <= radius]
+
+def weigh(comps, radius, floor_area=None, property_type=None):
+    """
+    Comp weights (array): distance x recency x size similarity x type similarity.
+    Distance uses a biweight kernel that falls to zero at the search radius.
+    """
+    distance = np.square(np.clip(1 - np.square(comps['distance_m'].to_numpy() / radius), 0, None))
+    recency = np.power(0.5, comps['age_days'].to_numpy() / ADJUSTED_HALF_LIFE_DAYS)
+    size = 1.0
+    if floor_area and floor_area > 0:
+        size = np.exp(-np.square(np.log(comps['floor_area'].to_numpy(dtype=float) / float(floor_area)) / AREA_SIGMA))
+    family = type_family(property_type)
+    kind = 1.0 if family is None else np.where(comps['property_type'].isin(family).to_numpy(), 1.0, TYPE_MISMATCH_WEIGHT)
+    return np.nan_to_num(distance * recency * size * kind)
+
+def estimate(psf, weights):
+    """
+    Weighted mean of time-adjusted £/sqft, after dropping comps outside the Tukey fences (1.5 x IQR).
+    Returns (estimate, effective comps) where effective comps = (sum w)^2 / sum w^2.
+    """
+    q1, q3 = np.percentile(psf, [25, 75])
+    weights = weights * ((psf >= q1 - 1.5 * (q3 - q1)) & (psf <= q3 + 1.5 * (q3 - q1)))
+    if weights.sum() <= 0:
+        return None, 0.0
+    return float((weights * psf).sum() / weights.sum()), float(weights.sum() ** 2 / np.square(weights).sum())
+
+def candidates(conn, point, radius, index):
+    """
+    Sales within `radius` of a point, time-adjusted to the index's valuation month.
+    """
+    sales = sales_near(conn, *point, radius)
+    index.load(sales['district'].unique())
+    sales = index.adjust(sales)
+    today = pd.Timestamp(datetime.now().date())
+    sales['age_days'] = (today - pd.to_datetime(sales['transfer_date'], errors='coerce')).dt.days.clip(lower=0).fillna(0)
+    sales['adjusted_psf'] = sales['price_per_sqft'] * sales['time_factor']
+    sales['adjusted_price'] = (sales['price_paid'] * sales['time_factor']).round()
+    return sales
+
+def radius_comps(conn, target, index, cache=None):
+    """
+    Values one target ({postcode, floor_area, property_type}) from time-adjusted sales around it.
+    The radius widens through RADII_M until MIN_RADIUS_COMPS usable comps are found.
+    `cache` ({(postcode, radius): candidates}) lets a batch share the search and adjustment
+    between targets in one postcode.
+    Returns (summary dict, weighted comps frame), or (None, None) if the postcode can't be located.
+    """
+    point = locate(conn, target['postcode'])
+    if point is None:
+        return None, None
+
+    for radius in RADII_M:
+        key = (target['postcode'], radius)
+        if cache is not None and key in cache:
+            sales = cache[key]
+        else:
+            sales = candidates(conn, point, radius, index)
+            if cache is not None:
+                cache[key] = sales
+        weights = weigh(sales, radius, target.get('floor_area'), target.get('property_type'))
+        used = weights > 0
+        if used.sum() >= MIN_RADIUS_COMPS:
+            break
+    estimate_psf, effective = estimate(sales['adjusted_psf'].to_numpy()[used], weights[used]) if used.any() else (None, 0.0)
+
+    floor_area = target.get('floor_area')
+    summary = {
+        "postcode": target['postcode'],
+        "floor_area": floor_area,
+        "property_type": target.get('property_type'),
+        "estimate_psf": estimate_psf,
+        "estimated_value": round(estimate_psf * float(floor_area) * SQM_TO_SQFT)
+                           if estimate_psf and floor_area and float(floor_area) > 0 else None,
+        "comp_count": int(used.sum()),
+        "effective_comps": round(effective, 1),
+        "radius_m": radius,
+        "valuation_month": index.valuation_month,
+    }
+    comps = sales[used].assign(weight=weights[used])
+    return summary, comps.sort_values('weight', ascending=False)
+
+def value_property(conn, uprn, index=None):
+    """
+    Live radius valuation of one UPRN from its dossier row, with its heaviest comps. None if unknown.
+    """
+    target = conn.execute(text("""
+        SELECT uprn, postcode, floor_area, property_type FROM property_dossier WHERE uprn = :uprn
+    """), {"uprn": uprn}).fetchone()
+    if target is None:
+        return None
+    summary, comps = radius_comps(conn, dict(target._mapping), index or PriceIndex(conn))
+    if summary is None:
+        return {"uprn": uprn, "postcode": target.postcode, "estimate_psf": None, "comps": []}
+
+    columns = ['transaction_id', 'postcode', 'transfer_date', 'price_paid', 'property_type', 'floor_area',
+               'price_per_sqft', 'distance_m', 'time_factor', 'index_method', 'adjusted_psf', 'adjusted_price', 'weight']
+    top = comps[columns].head(MAX_RETURNED_COMPS).round({'distance_m': 0, 'time_factor': 4, 'adjusted_psf': 2, 'weight': 4})
+    return {"uprn": uprn, **summary, "comps": top.to_dict(orient='records')}
+
+def value_distress(limit=None):
+    print("🏷️  VALUING DISTRESS LIST (time-adjusted radius comps)")
+    print("============================================")
+
+    engine = create_engine(DB_PATH)
+    with engine.connect() as conn:
+        ensure_tables(conn)
+        targets = pd.read_sql(text("""
+            SELECT uprn, postcode, floor_area, property_type FROM distress_assets
+            WHERE postcode IS NOT NULL
+            ORDER BY postcode
+        """), conn)
+        if limit:
+            targets = targets.head(limit)
+        print(f"   {len(targets)} distressed assets to value...")
+
+        index, cache, results = PriceIndex(conn), {}, []
+        started = time.perf_counter()
+        for postcode, group in targets.groupby('postcode', sort=False):
+            for target in group.to_dict(orient='records'):
+                summary, _ = radius_comps(conn, target, index, cache)
+                if summary is not None:
+                    results.append({"uprn": target['uprn'], **summary})
+            cache.clear()  # Targets are sorted by postcode: its searches won't be reused
+        elapsed = time.perf_counter() - started
+
+        valued = pd.DataFrame(results)
+        if not valued.empty:
+            valued['valued_at'] = datetime.now().isoformat(timespec='seconds')
+            columns = ['uprn', 'postcode', 'floor_area', 'property_type', 'estimate_psf', 'estimated_value',
+                       'comp_count', 'effective_comps', 'radius_m', 'valuation_month', 'valued_at']
+            valued[columns].to_sql('temp_valuations', conn, if_exists='replace', index=False)
+            conn.execute(text(f"""
+                INSERT OR REPLACE INTO asset_valuations ({', '.join(columns)})
+                SELECT {', '.join(columns)} FROM temp_valuations
+            """))
+            conn.execute(text("DROP TABLE temp_valuations"))
+        conn.commit()
+
+    bump_generation(engine, 'valuations')
+    per_target = elapsed / len(targets) * 1000 if len(targets) else 0
+
+    print("============================================")
+    print("🎉 VALUATIONS COMPLETE.")
+    print(f"📊 Assets Valued: {valued['estimate_psf'].notna().sum() if not valued.empty else 0} / {len(targets)}")
+    print(f"⏱️  {elapsed:.1f}s ({per_target:.0f} ms per asset)")
+    print("============================================")
+
+if __name__ == "__main__":
+    value_distress(limit=int(sys.argv[1]) if len(sys.argv) > 1 else None)
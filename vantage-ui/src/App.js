@@ -120,6 +120,23 @@ const TerminalView = () => {
     fetchDistress();
   }, []);
 
+  // Live Updates: apply change events from each ingest run instead of re-fetching the scan
+  // (EventSource reconnects by itself and resumes from the last event ID it saw)
+  useEffect(() => {
+    const events = new EventSource(`${API_URL}/api/events?types=distress_new,band_changed,distress_cleared`);
+    const upsert = (e) => {
+      const asset = JSON.parse(e.data).data;
+      setDistressData(prev => [asset, ...prev.filter(a => a.uprn !== asset.uprn)]);
+    };
+    events.addEventListener('distress_new', upsert);
+    events.addEventListener('band_changed', upsert);
+    events.addEventListener('distress_cleared', (e) => {
+      const { uprn } = JSON.parse(e.data).data;
+      setDistressData(prev => prev.filter(a => a.uprn !== uprn));
+    });
+    return () => events.close();
+  }, []);
+
   // Fetch Corporate Intelligence when asset changes
   useEffect(() => {
     if (selectedAsset && selectedAsset.company_number) {
@@ -133,18 +150,12 @@ const TerminalView = () => {
   const fetchCorporateIntel = async (companyNumber) => {
     setLoadingCorp(true);
     try {
-      // 1. Structure
+      // Structure + Charges (Debt) in one round trip
       const structRes = await fetch(`${API_URL}/api/company/${companyNumber}/structure`);
       if (structRes.ok) {
         const structJson = await structRes.json();
         setCorporateData(structJson);
-      }
-      
-      // 2. Charges (Debt)
-      const chargeRes = await fetch(`${API_URL}/api/company/${companyNumber}/charges`);
-      if (chargeRes.ok) {
-        const chargeJson = await chargeRes.json();
-        setChargesData(chargeJson.data || []);
+        setChargesData(structJson.charges || []);
       }
     } catch (e) {
       console.error("Intel Error", e);
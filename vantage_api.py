@@ -1,13 +1,118 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response, Body
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import create_engine, text
+from fastapi.responses import StreamingResponse
+from sqlalchemy import text
+from datetime import datetime, timedelta
+import io
 import os
-from vantage_companies import CompaniesHouseRegistry
+import re
+import csv
+import json
+import time
+import base64
+import hashlib
+import asyncio
+from collections import OrderedDict
+from vantage_companies import CompaniesHouseRegistry, AsyncCompaniesHouseRegistry, normalize_company_number, normalized_number_sql
+from vantage_jobs import JobManager, QueueFull
+from analyze_comps import find_comps
+from build_comps import postcode_levels, MIN_COMPS
+from value_assets import value_property
+from score_distress import COMPONENTS as SCORE_COMPONENTS
+from vantage_names import NameIndex
+from vantage_pipeline import current_generation
+from vantage_db import SnapshotEngine
+
+try:
+    import pyarrow as pa  # Optional: only needed for ?format=arrow exports
+except ImportError:
+    pa = None
 
 # Initialize the App
 app = FastAPI(title="Vantage Intelligence Engine")
 
+# Database Connection (read-only; follows the published snapshot, else the live WAL database)
+engine = SnapshotEngine()
+
+# --- RESPONSE CACHE (keyed on the ingest generation) ---
+# Local-data routes change only when an ingest runs; routes that mix in live CH data also expire by age
+CACHED_ROUTES = {
+    "/api/distress-scan": None,
+    "/api/distress-scores": None,
+    "/api/search": None,
+    "/api/property/": None,
+    "/api/comps/": None,
+    "/api/tiles/": None,
+    "/api/charges/maturing": 3600,  # Window is relative to today
+    "/api/title/": None,
+    "/api/ubo/": None,
+    "/api/officer/": None,
+    "/api/owner/": None,
+    "/api/company/": 300,
+}
+RESPONSE_CACHE_SIZE = 2000
+GENERATION_CHECK_SECONDS = 1.0
+response_cache = OrderedDict()  # (path, query, generation) -> (expires_at, etag, body, media_type)
+_generation = {"value": None, "checked_at": 0.0}
+
+def _read_generation():
+    with engine.connect() as conn:
+        return current_generation(conn)
+
+async def data_generation():
+    """
+    The latest ingest_runs ID, re-read at most once per GENERATION_CHECK_SECONDS in a
+    worker thread (requests arriving meanwhile keep the previous value).
+    """
+    now = time.monotonic()
+    if now - _generation["checked_at"] >= GENERATION_CHECK_SECONDS:
+        _generation["checked_at"] = now
+        _generation["value"] = await asyncio.to_thread(_read_generation)
+    return _generation["value"]
+
+def _cache_ttl(path):
+    for prefix, ttl in CACHED_ROUTES.items():
+        if path.startswith(prefix):
+            return True, ttl
+    return False, None
+
+def _cached_reply(request, etag, body, media_type):
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+@app.middleware("http")
+async def generation_cache(request: Request, call_next):
+    """
+    Serves repeat GETs from an in-process LRU keyed by route, parameters and data
+    generation, and answers matching If-None-Match with 304 Not Modified. Only 200s are
+    stored; an endpoint opts a degraded reply out with Cache-Control: no-store.
+    """
+    cacheable, ttl = _cache_ttl(request.url.path)
+    if request.method != "GET" or not cacheable:
+        return await call_next(request)
+
+    key = (request.url.path, str(sorted(request.query_params.multi_items())), await data_generation())
+    cached = response_cache.get(key)
+    if cached and (cached[0] is None or cached[0] > time.monotonic()):
+        response_cache.move_to_end(key)
+        return _cached_reply(request, *cached[1:])
+
+    response = await call_next(request)
+    if response.status_code != 200 or "no-store" in response.headers.get("cache-control", ""):
+        return response
+
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+    media_type = response.headers.get("content-type")
+    response_cache[key] = (time.monotonic() + ttl if ttl else None, etag, body, media_type)
+    while len(response_cache) > RESPONSE_CACHE_SIZE:
+        response_cache.popitem(last=False)
+    return _cached_reply(request, etag, body, media_type)
+
 # Allow the React App to talk to this API (CORS)
+# Added after the cache middleware so it wraps it: cached replies get CORS headers too
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], # In production, we would lock this down
@@ -16,114 +121,907 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Database Connection
-DB_PATH = "sqlite:///vantage.db"
-engine = create_engine(DB_PATH)
-
 # Initialize Companies House Registry
 ch_registry = CompaniesHouseRegistry()
 
+# Async client for the structure endpoint (concurrent fan-out, coalesced per company)
+STRUCTURE_TTL = 60          # Seconds a warm company view is served from memory
+STRUCTURE_CACHE_SIZE = 1000
+ch_async = AsyncCompaniesHouseRegistry()
+structure_cache = OrderedDict()  # company_number -> (expires_at, bundle)
+structure_inflight = {}          # company_number -> asyncio.Task
+
+@app.on_event("shutdown")
+async def close_ch_async():
+    await ch_async.aclose()
+
+# Local name typeahead (loaded in the background; reloaded after each ingest)
+name_index = NameIndex(engine)
+
+@app.on_event("startup")
+def load_name_index():
+    name_index.start()
+
 @app.get("/")
 def read_root():
     return {"status": "Vantage System Online", "version": "0.6 (Intel Layer)"}
 
+# --- DISTRESS SCAN (keyset pagination over distress_assets) ---
+
+MAX_PAGE_SIZE = 200
+
+def _encode_cursor(row):
+    """
+    Opaque cursor = the ranking key of the last row served.
+    """
+    key = [row["asset_rating_band"], row["floor_area"], row["uprn"]]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def _decode_cursor(cursor):
+    try:
+        band, floor_area, uprn = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return {"c_band": band, "c_area": floor_area, "c_uprn": uprn}
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _distress_filters(local_authority=None, band=None, property_type=None,
+                      min_floor_area=None, max_floor_area=None, bbox=None):
+    """
+    WHERE clauses + params shared by the scan and the bulk export.
+    """
+    filters, params = [], {}
+
+    if local_authority:
+        filters.append("local_authority = :local_authority")
+        params["local_authority"] = local_authority
+    if band:
+        filters.append("asset_rating_band = :band")
+        params["band"] = band.upper()
+    if property_type:
+        filters.append("property_type = :property_type")
+        params["property_type"] = property_type
+    if min_floor_area is not None:
+        filters.append("floor_area >= :min_floor_area")
+        params["min_floor_area"] = min_floor_area
+    if max_floor_area is not None:
+        filters.append("floor_area <= :max_floor_area")
+        params["max_floor_area"] = max_floor_area
+    if bbox:
+        try:
+            min_lng, min_lat, max_lng, max_lat = [float(v) for v in bbox.split(",")]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="bbox must be 'min_lng,min_lat,max_lng,max_lat'")
+        filters.append("latitude BETWEEN :min_lat AND :max_lat AND longitude BETWEEN :min_lng AND :max_lng")
+        params.update({"min_lat": min_lat, "max_lat": max_lat, "min_lng": min_lng, "max_lng": max_lng})
+    return filters, params
+
 @app.get("/api/distress-scan")
-def scan_distress():
+def scan_distress(cursor: str = None, limit: int = 50, local_authority: str = None, band: str = None,
+                  property_type: str = None, min_floor_area: float = None, max_floor_area: float = None,
+                  bbox: str = None, response: Response = None):
     """
-    Returns the top 50 distressed assets (Rated F or G) with Ownership Data
+    Distressed assets (Rated F or G) with Ownership Data, worst first.
+    Keyset-paginated: pass back `next_cursor` to get the following page. Every page
+    is an index range seek on (filter, band, floor_area, uprn), so deep pages cost the
+    same as the first one. `bbox` is 'min_lng,min_lat,max_lng,max_lat'.
     """
-    # Updated query to use the NEW schema
-    query = text("""
-        SELECT 
-            e.uprn, 
-            p.address_line_1 as address, 
-            e.asset_rating_band, 
-            e.floor_area, 
-            e.property_type,
-            p.local_authority_code as local_authority,
-            c.company_name,
-            c.company_number,
-            c.company_status
-        FROM epc_assessments e
-        JOIN master_properties p ON e.uprn = p.uprn
-        LEFT JOIN ownership_records o ON p.title_number = o.title_number
-        LEFT JOIN corporate_registry c ON o.company_number = c.company_number
-        WHERE e.asset_rating_band IN ('F', 'G') 
-        ORDER BY e.asset_rating_band DESC, e.floor_area DESC
-        LIMIT 50
+    filters, params = _distress_filters(local_authority, band, property_type, min_floor_area, max_floor_area, bbox)
+    params["limit"] = max(1, min(limit, MAX_PAGE_SIZE))
+    if cursor:
+        # Row-value comparison in the same direction as the ORDER BY = a single index seek
+        filters.append("(asset_rating_band, floor_area, uprn) < (:c_band, :c_area, :c_uprn)")
+        params.update(_decode_cursor(cursor))
+
+    where = ("WHERE " + " AND ".join(filters)) if filters else ""
+    query = text(f"""
+        SELECT uprn, address, postcode, asset_rating_band, floor_area, property_type, local_authority,
+               latitude, longitude, company_name, company_number, company_status
+        FROM distress_assets
+        {where}
+        ORDER BY asset_rating_band DESC, floor_area DESC, uprn DESC
+        LIMIT :limit
     """)
     
     try:
         with engine.connect() as conn:
-            result = conn.execute(query)
+            result = conn.execute(query, params)
             rows = [dict(row._mapping) for row in result]
-        return {"count": len(rows), "data": rows}
     except Exception as e:
-        # Fallback if new schema is empty (for demo safety)
+        # Fallback if the view hasn't been built yet (for demo safety); no-store keeps it out of the cache
         print(f"Schema Error: {e}")
-        return {"count": 0, "data": []}
+        response.headers["Cache-Control"] = "no-store"
+        return {"count": 0, "data": [], "next_cursor": None}
+
+    next_cursor = _encode_cursor(rows[-1]) if len(rows) == params["limit"] else None
+    return {"count": len(rows), "data": rows, "next_cursor": next_cursor}
+
+@app.get("/api/distress-scores")
+def rank_distress(cursor: str = None, limit: int = 50, local_authority: str = None, min_score: float = None):
+    """
+    Assets ranked by composite distress score (score_distress.py), highest first, with the
+    per-signal breakdown. Keyset-paginated on (score, uprn) like /api/distress-scan.
+    """
+    filters = ["s.score >= :min_score" if min_score is not None else "s.score > 0"]
+    params = {"limit": max(1, min(limit, MAX_PAGE_SIZE)), "min_score": min_score}
+    if local_authority:
+        filters.append("s.local_authority = :local_authority")
+        params["local_authority"] = local_authority
+    if cursor:
+        try:
+            params["c_score"], params["c_uprn"] = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        filters.append("(s.score, s.uprn) < (:c_score, :c_uprn)")
+
+    query = text(f"""
+        SELECT s.uprn, d.address, d.postcode, s.local_authority, d.asset_rating_band, d.floor_area,
+               d.property_type, d.latitude, d.longitude, d.company_name, d.company_number,
+               s.score, s.signal_count, {', '.join(f's.{c}' for c in SCORE_COMPONENTS)}, s.scored_at
+        FROM distress_scores s
+        JOIN property_dossier d ON d.uprn = s.uprn
+        WHERE {" AND ".join(filters)}
+        ORDER BY s.score DESC, s.uprn DESC
+        LIMIT :limit
+    """)
+    with engine.connect() as conn:
+        rows = [dict(row._mapping) for row in conn.execute(query, params)]
+
+    next_cursor = None
+    if len(rows) == params["limit"]:
+        next_cursor = base64.urlsafe_b64encode(json.dumps([rows[-1]["score"], rows[-1]["uprn"]]).encode()).decode()
+    return {"count": len(rows), "data": rows, "next_cursor": next_cursor}
+
+# --- BULK EXPORT (streamed straight off a cursor) ---
+
+EXPORT_CHUNK = 5000
+EXPORT_COLUMNS = [
+    "uprn", "address", "postcode", "local_authority", "latitude", "longitude", "asset_rating_band",
+    "asset_rating", "floor_area", "property_type", "inspection_date", "title_number", "proprietor_name",
+    "owner_count", "company_name", "company_number", "company_status"
+]
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+def _stream_rows(query, params):
+    """
+    Yields lists of rows, EXPORT_CHUNK at a time, holding one connection open for the
+    whole export. Memory stays at one chunk however many rows match.
+    """
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=EXPORT_CHUNK).execute(query, params)
+        while True:
+            rows = result.fetchmany(EXPORT_CHUNK)
+            if not rows:
+                break
+            yield rows
+
+def _export_csv(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+def _export_ndjson(chunks):
+    for rows in chunks:
+        yield "".join(json.dumps(dict(zip(EXPORT_COLUMNS, row)), default=str) + "\n" for row in rows)
+
+def _export_arrow(chunks):
+    # Everything as strings/floats so a batch never disagrees with the schema
+    numeric = {"latitude", "longitude", "asset_rating", "floor_area", "owner_count"}
+    schema = pa.schema([(c, pa.float64() if c in numeric else pa.string()) for c in EXPORT_COLUMNS])
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for rows in chunks:
+            columns = list(zip(*rows))
+            arrays = [
+                pa.array([None if v is None else (float(v) if name in numeric else str(v)) for v in values], type=field.type)
+                for name, values, field in zip(EXPORT_COLUMNS, columns, schema)
+            ]
+            writer.write_batch(pa.record_batch(arrays, schema=schema))
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+    yield sink.getvalue()
+
+@app.get("/api/export")
+def export_distress(format: str = "csv", local_authority: str = None, band: str = None,
+                    property_type: str = None, min_floor_area: float = None, max_floor_area: float = None,
+                    bbox: str = None):
+    """
+    Streams the full filtered distress scan (same filters as /api/distress-scan, no row cap)
+    as chunked CSV, NDJSON or Arrow IPC. Rows start flowing as soon as the first chunk is read.
+    """
+    format = format.lower()
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="format must be csv, ndjson or arrow")
+    if format == "arrow" and pa is None:
+        raise HTTPException(status_code=501, detail="Arrow export needs pyarrow (pip install pyarrow)")
+
+    filters, params = _distress_filters(local_authority, band, property_type, min_floor_area, max_floor_area, bbox)
+    where = ("WHERE " + " AND ".join(filters)) if filters else ""
+    query = text(f"""
+        SELECT {", ".join(EXPORT_COLUMNS)}
+        FROM distress_assets
+        {where}
+        ORDER BY asset_rating_band DESC, floor_area DESC, uprn DESC
+    """)
+
+    writers = {"csv": _export_csv, "ndjson": _export_ndjson, "arrow": _export_arrow}
+    filename = f"vantage-distress.{format}"
+    return StreamingResponse(
+        writers[format](_stream_rows(query, params)),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# --- MAP TILES (pre-aggregated pyramid in distress_tiles) ---
+
+TILE_MAX_ZOOM = 16      # Must match vantage_pipeline.TILE_MAX_ZOOM
+CLUSTER_DEPTH = 3       # A tile is split into 2^3 x 2^3 cluster cells
+MAX_TILE_POINTS = 1000
+
+@app.get("/api/tiles/{z}/{x}/{y}")
+def get_tile(z: int, x: int, y: int):
+    """
+    Clustered distressed assets for one slippy-map tile: counts, F/G mix and centroid
+    per cell, read from the precomputed pyramid (a PK range scan, whatever the data size).
+    Past the pyramid's resolution the individual assets are returned instead.
+    """
+    if z < 0 or z > 22 or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=400, detail="Invalid tile")
+
+    level = z + CLUSTER_DEPTH
+    with engine.connect() as conn:
+        if level <= TILE_MAX_ZOOM:
+            span = 2 ** CLUSTER_DEPTH
+            rows = conn.execute(text("""
+                SELECT x, y, asset_count, f_count, g_count,
+                       floor_area_total, lat_sum / asset_count AS latitude, lng_sum / asset_count AS longitude
+                FROM distress_tiles
+                WHERE z = :level
+                  AND x BETWEEN :x0 AND :x1
+                  AND y BETWEEN :y0 AND :y1
+            """), {"level": level, "x0": x * span, "x1": (x + 1) * span - 1,
+                   "y0": y * span, "y1": (y + 1) * span - 1}).fetchall()
+            return {"z": z, "x": x, "y": y, "level": level, "clusters": [dict(row._mapping) for row in rows]}
+
+        # Zoomed in far enough: the tile covers few enough max-zoom cells to list assets
+        if z <= TILE_MAX_ZOOM:
+            span = 2 ** (TILE_MAX_ZOOM - z)
+            bounds = {"x0": x * span, "x1": (x + 1) * span - 1, "y0": y * span, "y1": (y + 1) * span - 1}
+        else:
+            shift = z - TILE_MAX_ZOOM
+            bounds = {"x0": x >> shift, "x1": x >> shift, "y0": y >> shift, "y1": y >> shift}
+        rows = conn.execute(text("""
+            SELECT uprn, address, asset_rating_band, floor_area, latitude, longitude, company_name
+            FROM distress_assets
+            WHERE tile_x BETWEEN :x0 AND :x1
+              AND tile_y BETWEEN :y0 AND :y1
+            LIMIT :limit
+        """), {**bounds, "limit": MAX_TILE_POINTS}).fetchall()
+    return {"z": z, "x": x, "y": y, "level": TILE_MAX_ZOOM, "points": [dict(row._mapping) for row in rows]}
+
+MIN_SEARCH_LENGTH = 3  # A 3-character prefix keeps the BM25 sort over its matches cheap
+SEARCH_CANDIDATES = 500
+
+def _fts_query(q):
+    """
+    'Flat 2, 10 High St' -> '"FLAT" "2" "10" "HIGH" "ST"*'
+    Completed words must match exactly; only the word being typed is a prefix.
+    """
+    terms = [f'"{t}"' for t in re.findall(r"[A-Za-z0-9]+", q.upper())]
+    if terms and not q[-1].isspace():
+        terms[-1] += "*"
+    return " ".join(terms)
 
 @app.get("/api/search")
-def search_property(q: str):
+def search_property(q: str, limit: int = 10):
     """
-    Search for a property by address
+    Type-ahead property search by address or postcode (FTS5, BM25-ranked, one row per UPRN)
     """
+    match = _fts_query(q)
+    if len(q.strip()) < MIN_SEARCH_LENGTH or not match:
+        return []
+
+    # FTS5 keeps only the best SEARCH_CANDIDATES by BM25 (ORDER BY rank), which are then
+    # collapsed to one row per UPRN
     query = text("""
-        SELECT p.uprn, p.address_line_1 as address, e.asset_rating_band 
-        FROM master_properties p
-        LEFT JOIN epc_assessments e ON p.uprn = e.uprn
-        WHERE p.address_line_1 LIKE :search 
-        LIMIT 10
+        SELECT COALESCE(p.uprn, 'TITLE:' || p.title_number) AS uprn, p.title_number,
+               p.address_line_1 as address, p.postcode,
+               (SELECT e.asset_rating_band FROM epc_assessments e
+                WHERE e.uprn = p.uprn
+                ORDER BY e.inspection_date DESC LIMIT 1) AS asset_rating_band,
+               MIN(hits.score) AS score
+        FROM (
+            SELECT rowid, rank AS score FROM address_fts
+            WHERE address_fts MATCH :match
+            ORDER BY rank
+            LIMIT :candidates
+        ) hits
+        JOIN master_properties p ON p.rowid = hits.rowid
+        GROUP BY COALESCE(p.uprn, 'TITLE:' || p.title_number, p.rowid)
+        ORDER BY score
+        LIMIT :limit
     """)
     
+    limit = max(1, min(limit, 50))
     with engine.connect() as conn:
-        result = conn.execute(query, {"search": f"%{q}%"})
+        result = conn.execute(query, {"match": match, "candidates": SEARCH_CANDIDATES, "limit": limit})
         rows = [dict(row._mapping) for row in result]
         
     return rows
 
+@app.get("/api/property/{uprn}")
+def get_property(uprn: str):
+    """
+    Everything known about one asset (EPC, owner, company, rates, planning, leases,
+    covenants, broadband) from the precomputed property_dossier row.
+    """
+    with engine.connect() as conn:
+        row = conn.execute(text("SELECT * FROM property_dossier WHERE uprn = :uprn"), {"uprn": uprn}).fetchone()
+
+    if not row:
+        raise HTTPException(status_code=404, detail="Property not found")
+    return dict(row._mapping)
+
+@app.get("/api/property/{uprn}/valuation")
+def get_valuation(uprn: str):
+    """
+    Live radius valuation: sales around the property's postcode, time-adjusted with the
+    local price index and weighted by distance, recency, size and type (value_assets.py).
+    """
+    with engine.connect() as conn:
+        valuation = value_property(conn, uprn)
+
+    if valuation is None:
+        raise HTTPException(status_code=404, detail="Property not found")
+    return valuation
+
+@app.get("/api/comps/{postcode}")
+def get_comps(postcode: str):
+    """
+    £/sqft comparables for a postcode, its sector and its district (precomputed by build_comps.py).
+    `best` is the most local level with at least MIN_COMPS sales behind it.
+    """
+    levels = postcode_levels(postcode)
+    with engine.connect() as conn:
+        rows = []
+        for level, area in levels.items():
+            row = conn.execute(text("SELECT * FROM comps_summary WHERE level = :level AND area = :area"),
+                               {"level": level, "area": area}).fetchone()
+            if row:
+                rows.append(dict(row._mapping))
+
+    if not rows:
+        raise HTTPException(status_code=404, detail="No comparable sales for this area")
+    best = next((r for r in rows if r["sale_count"] >= MIN_COMPS), rows[-1])
+    return {"query": postcode, "best": best, "levels": rows}
+
 # --- NEW CORPORATE INTELLIGENCE ENDPOINTS ---
 
 @app.get("/api/company/search")
-def search_company(q: str):
+def search_company(q: str, limit: int = 10):
     """
-    Live search against Companies House API
+    Type-ahead over local company and CCOD proprietor names, ranked by match quality
+    (exact name, then whole words, then a partial word), then portfolio size.
+    Falls back to a live Companies House search only when nothing local matches.
     """
     if not q: return []
+    name_index.refresh_if_stale()
+
+    matches = name_index.search(q, limit=max(1, min(limit, 50))) if name_index.loaded else []
+    if matches:
+        return {"source": "local", "count": len(matches), "data": matches}
+
     result = ch_registry.search_company(q)
-    return result if result else {"message": "No match found"}
+    return {"source": "live", "count": 1, "data": [result]} if result else {"message": "No match found"}
+
+async def _company_bundle(company_number):
+    """
+    Profile, officers, PSCs and charges for one company, fetched concurrently.
+    Concurrent callers for the same company share one in-flight fetch, and the
+    result is kept in memory for STRUCTURE_TTL seconds.
+    """
+    cached = structure_cache.get(company_number)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
+    task = structure_inflight.get(company_number)
+    if task is None:
+        task = asyncio.ensure_future(ch_async.get_company_bundle(company_number))
+        structure_inflight[company_number] = task
+        task.add_done_callback(lambda _: structure_inflight.pop(company_number, None))
+
+    # Shielded: one client disconnecting must not cancel the fetch the others are waiting on
+    bundle = await asyncio.shield(task)
+
+    structure_cache[company_number] = (time.monotonic() + STRUCTURE_TTL, bundle)
+    structure_cache.move_to_end(company_number)
+    while len(structure_cache) > STRUCTURE_CACHE_SIZE:
+        structure_cache.popitem(last=False)
+    return bundle
 
 @app.get("/api/company/{company_number}/structure")
-def get_company_structure(company_number: str):
+async def get_company_structure(company_number: str):
     """
-    Builds the 'Corporate Veil' tree: Company -> Officers -> PSCs
+    Builds the 'Corporate Veil' tree: Company -> Officers -> PSCs, plus outstanding charges
     """
+    try:
+        bundle = await _company_bundle(company_number)
+    except Exception as e:
+        print(f"   ❌ API Error: {e}")
+        raise HTTPException(status_code=502, detail="Companies House unavailable")
+
     # 1. Profile
-    profile = ch_registry.get_company_profile(company_number)
-    if not profile:
+    if not bundle["profile"]:
         raise HTTPException(status_code=404, detail="Company not found")
-        
-    # 2. Officers (Directors)
-    officers = ch_registry.get_company_officers(company_number)
-    
-    # 3. PSCs (Owners)
-    pscs = ch_registry.get_psc(company_number)
-    
+
+    # Ingested charges win over the live listing (same rows as /api/company/{n}/charges)
+    try:
+        charges = await asyncio.to_thread(_local_charges, company_number)
+    except Exception as e:
+        print(f"Schema Error: {e}")
+        charges = None
+
     return {
-        "profile": profile,
-        "officers": officers[:5], # Top 5
-        "beneficial_owners": pscs[:5] # Top 5
+        "profile": bundle["profile"],
+        "officers": bundle["officers"][:5], # Top 5
+        "beneficial_owners": bundle["pscs"][:5], # Top 5
+        "charges": charges if charges is not None else [c for c in bundle["charges"] if c.get('status') == 'outstanding'],
+        "charges_source": "local" if charges is not None else "live"
     }
 
+def _local_charges(company_number):
+    """
+    Outstanding charges from the company_charges table, or None when this company's
+    charges haven't been ingested (an empty list means loaded, nothing outstanding).
+    """
+    with engine.connect() as conn:
+        loaded = conn.execute(text("""
+            SELECT 1 FROM company_enrichment
+            WHERE (company_number = :n OR official_number = :n) AND charges_loaded_at IS NOT NULL
+            LIMIT 1
+        """), {"n": company_number}).fetchone()
+        if not loaded:
+            return None
+        return [dict(row._mapping) for row in conn.execute(text("""
+            SELECT charge_id, charge_code, status, created_on, delivered_on, satisfied_on,
+                   lender, lenders, classification, particulars
+            FROM company_charges
+            WHERE (company_number = :n
+                   OR company_number IN (SELECT official_number FROM company_enrichment WHERE company_number = :n))
+              AND status = 'outstanding'
+            ORDER BY created_on
+        """), {"n": company_number})]
+
 @app.get("/api/company/{company_number}/charges")
 def get_company_charges(company_number: str):
     """
     Returns outstanding debts/charges to visualize 'Timeline of Squeeze'
+    Served from the company_charges table when we've ingested this company (even when it
+    has nothing outstanding); live otherwise.
     """
+    try:
+        rows = _local_charges(company_number)
+        if rows is not None:
+            return {"count": len(rows), "data": rows, "source": "local"}
+    except Exception as e:
+        print(f"Schema Error: {e}")
+
     charges = ch_registry.get_charges(company_number)
-    return {"count": len(charges), "data": charges}
+    return {"count": len(charges), "data": charges, "source": "live"}
+
+@app.get("/api/charges/maturing")
+def scan_maturing_charges(min_age_years: float = 4.0, max_age_years: float = 6.0,
+                          lender: str = None, limit: int = 100):
+    """
+    Portfolio-wide debt maturity scan: outstanding charges whose vintage puts them
+    in a refinancing window (default 4-6 years old, i.e. a typical 5-year CRE loan).
+    """
+    today = datetime.now().date()
+    created_from = (today - timedelta(days=int(365.25 * max_age_years))).isoformat()
+    created_to = (today - timedelta(days=int(365.25 * min_age_years))).isoformat()
+
+    lender_filter = "AND ch.lender LIKE :lender" if lender else ""
+    query = text(f"""
+        SELECT ch.charge_id, ch.company_number, MIN(ce.company_number) AS local_company_number,
+               MIN(c.company_name) AS company_name, ch.created_on, ch.lender, ch.classification,
+               COUNT(DISTINCT o.title_number) AS title_count
+        FROM company_charges ch
+        LEFT JOIN company_enrichment ce ON ce.official_number = ch.company_number
+        LEFT JOIN corporate_registry c ON c.company_number = ce.company_number
+        LEFT JOIN ownership_records o ON o.company_number = ce.company_number
+        WHERE ch.status = 'outstanding'
+          AND ch.created_on BETWEEN :created_from AND :created_to
+          {lender_filter}
+        GROUP BY ch.charge_id
+        ORDER BY ch.created_on
+        LIMIT :limit
+    """)
+
+    params = {"created_from": created_from, "created_to": created_to, "limit": min(limit, 1000)}
+    if lender:
+        params["lender"] = f"{lender.upper()}%"
+
+    with engine.connect() as conn:
+        rows = [dict(row._mapping) for row in conn.execute(query, params)]
+    return {"window": [created_from, created_to], "count": len(rows), "data": rows}
+
+# --- OWNERSHIP GRAPH ENDPOINTS (precomputed by build_ubo_graph.py) ---
+
+@app.get("/api/title/{title_number}/ubo")
+def get_title_controllers(title_number: str):
+    """
+    Who ultimately controls this title: one indexed lookup into the UBO closure table.
+    Owners not yet enriched are looked up by their CH-normalised number.
+    """
+    query = text(f"""
+        SELECT o.proprietor_name, u.company_number,
+               u.controller_key, u.controller_kind, u.controller_name, u.depth
+        FROM ownership_records o
+        LEFT JOIN company_enrichment ce ON ce.company_number = o.company_number
+        JOIN ubo_closure u ON u.company_number = COALESCE(ce.official_number, {normalized_number_sql('o.company_number')})
+        WHERE o.title_number = :title
+          AND u.is_ultimate = 1
+        ORDER BY u.depth
+    """)
+
+    with engine.connect() as conn:
+        rows = [dict(row._mapping) for row in conn.execute(query, {"title": title_number})]
+    return {"title_number": title_number, "count": len(rows), "controllers": rows}
+
+@app.get("/api/ubo/titles")
+def get_controller_titles(controller: str):
+    """
+    Every title a person/entity controls, directly or through any chain of companies.
+    `controller` is a UBO key as returned by /api/title/{title_number}/ubo
+    """
+    query = text(f"""
+        SELECT o.title_number, o.proprietor_name, u.company_number, u.depth
+        FROM ubo_closure u
+        JOIN company_enrichment ce ON ce.official_number = u.company_number
+        JOIN ownership_records o ON o.company_number = ce.company_number
+        WHERE u.controller_key = :key
+        UNION
+        -- Owners without an enrichment match, via the expression index idx_ownership_official
+        SELECT o.title_number, o.proprietor_name, u.company_number, u.depth
+        FROM ubo_closure u
+        JOIN ownership_records o ON {normalized_number_sql('o.company_number')} = u.company_number
+        WHERE u.controller_key = :key
+          AND NOT EXISTS (
+              SELECT 1 FROM company_enrichment ce
+              WHERE ce.company_number = o.company_number AND ce.official_number IS NOT NULL
+          )
+        ORDER BY 4, 1
+    """)
+
+    with engine.connect() as conn:
+        rows = [dict(row._mapping) for row in conn.execute(query, {"key": controller})]
+    return {"controller": controller, "count": len(rows), "titles": rows}
+
+# --- DIRECTOR NETWORK (precomputed by build_director_network.py) ---
+
+@app.get("/api/officer/{officer_id}/portfolio")
+def get_officer_portfolio(officer_id: str):
+    """
+    "What else does this director control": precomputed rollup + the companies behind it.
+    `officer_id` is CH's officer ID (from the officer's links in /structure).
+    """
+    with engine.connect() as conn:
+        officer = conn.execute(text("""
+            SELECT o.officer_id, o.name, o.birth_month, p.company_count, p.active_company_count,
+                   p.title_count, p.fg_asset_count, p.updated_at
+            FROM officers o
+            LEFT JOIN officer_portfolio p ON p.officer_id = o.officer_id
+            WHERE o.officer_id = :id
+        """), {"id": officer_id}).fetchone()
+
+        if not officer:
+            raise HTTPException(status_code=404, detail="Officer not indexed")
+
+        companies = conn.execute(text("""
+            SELECT a.company_number, a.company_name, a.officer_role, a.appointed_on, a.resigned_on,
+                   COUNT(DISTINCT o.title_number) AS title_count
+            FROM officer_appointments a
+            LEFT JOIN company_keys k ON k.ch_number = a.company_number
+            LEFT JOIN ownership_records o ON o.company_number = k.local_company_number
+            WHERE a.officer_id = :id
+            GROUP BY a.company_number, a.officer_role
+            ORDER BY a.resigned_on IS NOT NULL, title_count DESC
+        """), {"id": officer_id}).fetchall()
+
+    return {
+        "officer": dict(officer._mapping),
+        "companies": [dict(row._mapping) for row in companies]
+    }
+
+@app.get("/api/owner/{cluster_id}/portfolio")
+def get_owner_portfolio(cluster_id: str):
+    """
+    Everything held by one resolved owner, across all its name variants and registration numbers.
+    `cluster_id` is 'CN:<company number>' or 'NM:<name key>' (see resolve_owners.py).
+    """
+    with engine.connect() as conn:
+        owner = conn.execute(text("SELECT * FROM owner_portfolio WHERE cluster_id = :id"), {"id": cluster_id}).fetchone()
+
+        if not owner:
+            raise HTTPException(status_code=404, detail="Owner cluster not found")
+
+        variants = conn.execute(text("""
+            SELECT proprietor_name, company_number, match_rule
+            FROM owner_clusters WHERE cluster_id = :id
+            ORDER BY proprietor_name
+        """), {"id": cluster_id}).fetchall()
+
+        titles = conn.execute(text("""
+            SELECT o.title_number, o.proprietor_name, p.address_line_1, p.postcode, e.asset_rating_band
+            FROM owner_clusters oc
+            JOIN ownership_records o
+              ON o.proprietor_name = oc.proprietor_name
+             AND o.company_number IS oc.company_number
+            LEFT JOIN master_properties p ON p.title_number = o.title_number
+            LEFT JOIN epc_assessments e ON e.uprn = p.uprn
+            WHERE oc.cluster_id = :id
+            ORDER BY e.asset_rating_band DESC
+            LIMIT 500
+        """), {"id": cluster_id}).fetchall()
+
+    return {
+        "owner": dict(owner._mapping),
+        "name_variants": [dict(row._mapping) for row in variants],
+        "titles": [dict(row._mapping) for row in titles]
+    }
+
+# --- BACKGROUND ANALYSES (submit -> poll -> fetch; see vantage_jobs.py) ---
+
+MAX_JOB_COMPS = 1000
+MAX_TREE_DEPTH = 10       # As build_ubo_graph.MAX_DEPTH: deeper chains are almost always cycles
+MAX_TREE_TITLES = 5000
+MAX_SCAN_CHARGES = 5000
+
+def _chunked(values, size=500):
+    values = list(values)
+    for start in range(0, len(values), size):
+        chunk = values[start:start + size]
+        yield chunk, {f"v{i}": v for i, v in enumerate(chunk)}, ", ".join(f":v{i}" for i in range(len(chunk)))
+
+def job_comps_area(conn, area: str, limit: int = 200):
+    """
+    Sized comparables for a postcode, sector or district (see analyze_comps.py).
+    """
+    return find_comps(conn, area, limit=max(1, min(int(limit), MAX_JOB_COMPS)))
+
+def job_ownership_tree(conn, root: str, max_depth: int = MAX_TREE_DEPTH):
+    """
+    Every company beneath a controller, level by level through psc_edges, with the
+    titles each one holds. `root` is a UBO key ('P:...', 'C:...') or a company number.
+    """
+    root_key = root if ":" in root else f"C:{normalize_company_number(root)}"
+    companies, seen, frontier = [], {root_key}, [root_key]
+
+    for depth in range(1, max(1, min(int(max_depth), MAX_TREE_DEPTH)) + 1):
+        next_frontier = []
+        for _, params, placeholders in _chunked(frontier):
+            rows = conn.execute(text(f"""
+                SELECT company_number, controller_key, natures_of_control
+                FROM psc_edges WHERE controller_key IN ({placeholders})
+            """), params).fetchall()
+            for company_number, parent, natures in rows:
+                key = f"C:{company_number}"
+                if key in seen:
+                    continue
+                seen.add(key)
+                next_frontier.append(key)
+                companies.append({"company_number": company_number, "parent": parent,
+                                  "depth": depth, "natures_of_control": natures})
+        if not next_frontier:
+            break
+        frontier = next_frontier
+
+    # Titles held anywhere in the tree (the root too, when it's a company)
+    numbers = [key[2:] for key in seen if key.startswith("C:")]
+    titles = []
+    for _, params, placeholders in _chunked(numbers):
+        rows = conn.execute(text(f"""
+            SELECT ce.official_number AS company_number, o.title_number, o.proprietor_name
+            FROM company_enrichment ce
+            JOIN ownership_records o ON o.company_number = ce.company_number
+            WHERE ce.official_number IN ({placeholders})
+        """), params).fetchall()
+        titles.extend(dict(row._mapping) for row in rows)
+
+    title_counts = {}
+    for t in titles:
+        title_counts[t["company_number"]] = title_counts.get(t["company_number"], 0) + 1
+    for company in companies:
+        company["title_count"] = title_counts.get(company["company_number"], 0)
+
+    return {
+        "root": root_key,
+        "company_count": len(companies),
+        "title_count": len(titles),
+        "companies": companies,
+        "titles": titles[:MAX_TREE_TITLES]
+    }
+
+def job_charges_scan(conn, cluster_id: str = None, status: str = "outstanding"):
+    """
+    Charges across a resolved owner's whole portfolio (or the whole book when no
+    cluster is given), rolled up by lender and by vintage year.
+    """
+    filters, params = ["ch.status = :status"], {"status": status}
+    if cluster_id:
+        filters.append("""ch.company_number IN (
+            SELECT ce.official_number FROM company_enrichment ce
+            JOIN owner_clusters oc ON oc.company_number = ce.company_number
+            WHERE oc.cluster_id = :cluster
+        )""")
+        params["cluster"] = cluster_id
+    where = " AND ".join(filters)
+
+    by_lender = conn.execute(text(f"""
+        SELECT ch.lender, COUNT(*) AS charge_count, COUNT(DISTINCT ch.company_number) AS company_count,
+               MIN(ch.created_on) AS oldest, MAX(ch.created_on) AS newest
+        FROM company_charges ch WHERE {where}
+        GROUP BY ch.lender ORDER BY charge_count DESC
+    """), params).fetchall()
+    by_vintage = conn.execute(text(f"""
+        SELECT substr(ch.created_on, 1, 4) AS vintage, COUNT(*) AS charge_count
+        FROM company_charges ch WHERE {where}
+        GROUP BY vintage ORDER BY vintage
+    """), params).fetchall()
+    charges = conn.execute(text(f"""
+        SELECT ch.charge_id, ch.company_number,
+               (SELECT MIN(ce.company_number) FROM company_enrichment ce
+                WHERE ce.official_number = ch.company_number) AS local_company_number,
+               ch.created_on, ch.lender, ch.classification, ch.status
+        FROM company_charges ch WHERE {where}
+        ORDER BY ch.created_on
+        LIMIT :limit
+    """), {**params, "limit": MAX_SCAN_CHARGES}).fetchall()
+
+    return {
+        "cluster_id": cluster_id,
+        "status": status,
+        "charge_count": sum(row.charge_count for row in by_lender),
+        "by_lender": [dict(row._mapping) for row in by_lender],
+        "by_vintage": [dict(row._mapping) for row in by_vintage],
+        "charges": [dict(row._mapping) for row in charges]
+    }
+
+jobs = JobManager(engine, {
+    "comps": job_comps_area,
+    "ownership-tree": job_ownership_tree,
+    "charges-scan": job_charges_scan,
+}, generation_fn=data_generation)
+
+@app.on_event("shutdown")
+def stop_jobs():
+    jobs.shutdown()
+
+@app.post("/api/jobs/{kind}", status_code=202)
+def submit_job(kind: str, params: dict = Body(default={})):
+    """
+    Queues a heavy analysis ('comps', 'ownership-tree', 'charges-scan'); the JSON body
+    holds its parameters. Poll /api/jobs/{job_id}, then fetch /api/jobs/{job_id}/result.
+    """
+    try:
+        return jobs.submit(kind, params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/api/jobs/{job_id}/result")
+def get_job_result(job_id: str):
+    job, result = jobs.result(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] == 'failed':
+        raise HTTPException(status_code=500, detail=f"Job failed: {job['error']}")
+    if job["status"] != 'done':
+        raise HTTPException(status_code=409, detail=f"Job is still {job['status']}")
+    return {"job": job, "result": result}
+
+# --- LIVE CHANGE FEED (Server-Sent Events over change_events) ---
+
+EVENT_BATCH = 500
+EVENT_POLL_SECONDS = 2.0        # New events only appear with a new data generation; this just paces the check
+EVENT_HEARTBEAT_SECONDS = 15.0  # Comment lines keep idle connections open through proxies
+
+def _fetch_events(after, types, local_authority, band, company_number):
+    filters, params = ["event_id > :after"], {"after": after, "limit": EVENT_BATCH}
+    if types:
+        filters.append(f"event_type IN ({', '.join(f':t{i}' for i in range(len(types)))})")
+        params.update({f"t{i}": t for i, t in enumerate(types)})
+    # Attribute filters narrow asset/company events; run markers always pass so clients know a run landed
+    for column, value in (("local_authority", local_authority), ("asset_rating_band", band), ("company_number", company_number)):
+        if value:
+            filters.append(f"({column} = :{column} OR event_type = 'run_finished')")
+            params[column] = value.upper() if column == "asset_rating_band" else value
+
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"""
+            SELECT event_id, event_type, stage, payload, created_at
+            FROM change_events
+            WHERE {" AND ".join(filters)}
+            ORDER BY event_id
+            LIMIT :limit
+        """), params).fetchall()
+    return [dict(row._mapping) for row in rows]
+
+def _sse(event):
+    data = {
+        "event_id": event["event_id"],
+        "event_type": event["event_type"],
+        "stage": event["stage"],
+        "created_at": event["created_at"],
+        "data": json.loads(event["payload"]) if event["payload"] else None
+    }
+    return f"id: {event['event_id']}\nevent: {event['event_type']}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@app.get("/api/events")
+async def stream_events(request: Request, types: str = None, local_authority: str = None,
+                        band: str = None, company_number: str = None, since: int = None):
+    """
+    Server-Sent Events feed of what each ingest run changed: 'distress_new', 'band_changed',
+    'distress_cleared', 'consent_lapsing', 'charge_new' and 'run_finished'.
+    Filters: `types` (comma-separated), `local_authority`, `band`, `company_number`.
+    A reconnect resumes after the Last-Event-ID header (or ?since=<event id>);
+    a fresh connection starts at the live edge.
+    """
+    resume_from = request.headers.get("last-event-id", since)
+    if resume_from is None:
+        with engine.connect() as conn:
+            resume_from = conn.execute(text("SELECT COALESCE(MAX(event_id), 0) FROM change_events")).scalar()
+    try:
+        after = int(resume_from)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Last-Event-ID must be an event ID")
+    type_list = [t.strip() for t in types.split(",") if t.strip()] if types else []
+
+    async def feed():
+        nonlocal after
+        seen_generation = object()  # Sentinel: always drain once (replays the backlog after a reconnect)
+        last_sent = time.monotonic()
+        yield "retry: 5000\n\n"
+        while not await request.is_disconnected():
+            generation = await asyncio.to_thread(data_generation)
+            if generation != seen_generation:
+                while True:
+                    events = await asyncio.to_thread(_fetch_events, after, type_list, local_authority, band, company_number)
+                    for event in events:
+                        after = event["event_id"]
+                        yield _sse(event)
+                    if len(events) < EVENT_BATCH:
+                        break
+                seen_generation = generation
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= EVENT_HEARTBEAT_SECONDS:
+                yield ": keep-alive\n\n"
+                last_sent = time.monotonic()
+            await asyncio.sleep(EVENT_POLL_SECONDS)
+
+    return StreamingResponse(feed(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 if __name__ == "__main__":
     import uvicorn
-    print("🚀 Vantage API starting on http://localhost:8000")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    workers = int(os.getenv("API_WORKERS", os.cpu_count() or 1))
+    print(f"🚀 Vantage API starting on http://localhost:8000 ({workers} workers)")
+    uvicorn.run("vantage_api:app", host="0.0.0.0", port=8000, workers=workers)
\ No newline at end of file
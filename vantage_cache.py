@@ -0,0 +1,106 @@
+import json
+import time
+from sqlalchemy import create_engine, text
+
+# --- CONFIGURATION ---
+# Kept out of vantage.db so API lookups never contend with ingest writes
+CACHE_DB_PATH = "sqlite:///vantage_cache.db"
+
+MISSING = object()  # Sentinel: distinguishes "never fetched" from a cached None
+
+class ResponseCache:
+    """
+    Persistent key -> JSON cache for third-party API responses.
+    One SQLite table per upstream source, shared safely across worker threads.
+    """
+    def __init__(self, table, db_path=CACHE_DB_PATH):
+        self.table = table
+        self.engine = create_engine(db_path, connect_args={"timeout": 30})
+
+        with self.engine.connect() as conn:
+            # Several API worker processes share this file
+            conn.execute(text("PRAGMA journal_mode=WAL"))
+            conn.execute(text(f"""
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    cache_key TEXT PRIMARY KEY,
+                    payload TEXT,
+                    fetched_at REAL,
+                    etag TEXT
+                )
+            """))
+            # Tables created before ETag support
+            columns = [row[1] for row in conn.execute(text(f"PRAGMA table_info({self.table})"))]
+            if 'etag' not in columns:
+                conn.execute(text(f"ALTER TABLE {self.table} ADD COLUMN etag TEXT"))
+            conn.commit()
+
+    def get(self, key, default=None):
+        """
+        Returns the cached payload, or `default` if we've never fetched this key.
+        Negative results ("no match") are cached too and come back as None.
+        """
+        return self.get_many([key]).get(key, default)
+
+    def get_entry(self, key):
+        """
+        Full record for revalidation: (payload, fetched_at, etag), or None on a miss.
+        """
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                text(f"SELECT payload, fetched_at, etag FROM {self.table} WHERE cache_key = :k"), {"k": key}
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1], row[2]
+
+    def get_many(self, keys):
+        """
+        Bulk lookup. Returns {key: payload} for every key we have a record of.
+        """
+        found = {}
+        keys = list(keys)
+        with self.engine.connect() as conn:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                params = {f"k{i}": k for i, k in enumerate(chunk)}
+                placeholders = ", ".join(f":k{i}" for i in range(len(chunk)))
+                rows = conn.execute(
+                    text(f"SELECT cache_key, payload FROM {self.table} WHERE cache_key IN ({placeholders})"),
+                    params
+                ).fetchall()
+                for key, payload in rows:
+                    found[key] = json.loads(payload)
+        return found
+
+    def set(self, key, payload, etag=None):
+        with self.engine.connect() as conn:
+            conn.execute(text(f"""
+                INSERT OR REPLACE INTO {self.table} (cache_key, payload, fetched_at, etag)
+                VALUES (:k, :p, :t, :e)
+            """), {"k": key, "p": json.dumps(payload), "t": time.time(), "e": etag})
+            conn.commit()
+
+    def write_many(self, records=(), touched=()):
+        """
+        Batched writes in one transaction: `records` are (key, payload, etag, fetched_at),
+        `touched` are (key, fetched_at) for entries revalidated by a 304.
+        """
+        with self.engine.connect() as conn:
+            for key, payload, etag, fetched_at in records:
+                conn.execute(text(f"""
+                    INSERT OR REPLACE INTO {self.table} (cache_key, payload, fetched_at, etag)
+                    VALUES (:k, :p, :t, :e)
+                """), {"k": key, "p": json.dumps(payload), "t": fetched_at, "e": etag})
+            for key, fetched_at in touched:
+                conn.execute(text(f"UPDATE {self.table} SET fetched_at = :t WHERE cache_key = :k"),
+                             {"k": key, "t": fetched_at})
+            conn.commit()
+
+    def touch(self, key):
+        """
+        Marks an entry fresh again without rewriting it (after a 304 Not Modified).
+        """
+        with self.engine.connect() as conn:
+            conn.execute(text(f"UPDATE {self.table} SET fetched_at = :t WHERE cache_key = :k"),
+                         {"k": key, "t": time.time()})
+            conn.commit()
@@ -1,26 +1,199 @@
 import os
-import requests
-import base64
 import time
+import asyncio
+import threading
+import httpx
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from vantage_http import TokenBucket, build_session, retry_after_seconds
+from vantage_cache import ResponseCache
 
-class CompaniesHouseRegistry:
-    def __init__(self):
+# --- CONFIGURATION ---
+CH_API_URL = "https://api.company-information.service.gov.uk"
+CH_RATE_LIMIT = 600 / 300  # Companies House allows 600 requests per 5 minutes per key
+CH_BURST = 10
+MAX_RETRIES = 5
+PAGE_SIZE = 100
+MAX_PAGES = 50  # Safety cap: 5,000 items per list is far beyond any real register
+
+# How long each resource type is served from the local cache before revalidating (seconds)
+CH_CACHE_TTL = {
+    'search': 7 * 86400,     # Name -> number mappings barely move
+    'profile': 86400,        # Status / accounts dates change daily at most
+    'officers': 3 * 86400,
+    'psc': 3 * 86400,
+    'charges': 86400,        # Debt signals: keep these fresh
+    'appointments': 7 * 86400
+}
+CH_STALE_GRACE = 30 * 86400  # Past TTL, serve stale (and refresh behind the scenes) for this long
+CACHE_FLUSH_SIZE = 50        # Async client: buffered cache writes committed together once this many are pending...
+CACHE_FLUSH_SECONDS = 1.0    # ...or once the oldest has waited this long
+
+# One bucket per process: every registry instance draws from the same API key quota
+CH_LIMITER = TokenBucket(rate=CH_RATE_LIMIT, capacity=CH_BURST)
+
+def normalize_company_number(number):
+    """
+    CCOD drops leading zeros ('1234567'); CH always uses 8 characters ('01234567').
+    """
+    if number is None: return None
+    number = str(number).strip().upper()
+    if not number or number == 'NAN': return None
+    return number.zfill(8) if number.isdigit() else number
+
+def normalized_number_sql(column):
+    """
+    normalize_company_number() as a SQL expression over `column`. Deterministic, so it
+    can back an expression index (the query must spell the expression the same way).
+    """
+    value = f"upper(trim({column}))"
+    return (f"CASE WHEN {value} NOT GLOB '*[^0-9]*' AND length({value}) BETWEEN 1 AND 7 "
+            f"THEN substr('00000000' || {value}, -8) ELSE {value} END")
+
+class CachePolicy:
+    """
+    Disk-backed response caching shared by the sync and async clients.
+    Entries are keyed '<resource>:<identifier>' and expire per resource type.
+    Past their TTL they are revalidated with If-None-Match, so an unchanged
+    resource costs a 304 instead of a full download.
+    """
+    def _lookup(self, resource, ident):
+        """
+        Returns (key, entry, state) where state is 'fresh', 'stale' (servable
+        while revalidating), 'expired' or 'miss'.
+        """
+        key = f"{resource}:{ident}"
+        return key, *self._classify(resource, self.cache.get_entry(key) if self.cache else None)
+
+    def _classify(self, resource, entry):
+        if entry is None:
+            return None, 'miss'
+        age = time.time() - entry[1]
+        if age < CH_CACHE_TTL[resource]:
+            return entry, 'fresh'
+        if age < CH_CACHE_TTL[resource] + CH_STALE_GRACE:
+            return entry, 'stale'
+        return entry, 'expired'
+
+    def _conditional_headers(self, entry):
+        if entry and entry[2]:
+            return {"If-None-Match": entry[2]}
+        return None
+
+    def _store(self, key, response, entry):
+        """
+        Folds a live response into the cache and returns the payload to use.
+        404s are cached as None; other failures fall back to whatever we had.
+        """
+        if response.status_code == 304 and entry:
+            if self.cache: self._cache_touch(key, entry)
+            return entry[0]
+        if response.status_code == 200:
+            data = response.json()
+            if self.cache: self._cache_set(key, data, response.headers.get('ETag'))
+            return data
+        if response.status_code == 404:
+            if self.cache: self._cache_set(key, None, None)
+            return None
+        print(f"   ⚠️ Companies House returned HTTP {response.status_code} for {key}")
+        return entry[0] if entry else None
+
+    def _cache_set(self, key, payload, etag):
+        self.cache.set(key, payload, etag=etag)
+
+    def _cache_touch(self, key, entry):
+        self.cache.touch(key)
+
+class CompaniesHouseRegistry(CachePolicy):
+    def __init__(self, pool_size=10, cache=None):
         load_dotenv()
         self.api_key = os.getenv('COMPANIES_HOUSE_KEY')
-        self.base_url = "https://api.company-information.service.gov.uk"
+        # Overridable so enrichment can be run against a local mock of the API
+        self.base_url = os.getenv('COMPANIES_HOUSE_API_URL', CH_API_URL)
+        self.limiter = CH_LIMITER
+        self.cache = cache if cache is not None else ResponseCache("ch_cache")
+
+        # Companies House Basic Auth requires the key as the username, empty password.
+        # Set once on the session so every request reuses it (and the keep-alive connection).
+        self.session = build_session(pool_size=pool_size)
+        self.session.auth = (self.api_key or '', '')
+
+        # Stale entries are refreshed off the request path
+        self.refresh_pool = ThreadPoolExecutor(max_workers=2)
+        self.refreshing = set()
+        self.refresh_lock = threading.Lock()
         
         if not self.api_key:
             print("⚠️  WARNING: No COMPANIES_HOUSE_KEY found in .env")
             print("   (Data enrichment will fail or be limited)")
 
-    def _get_headers(self):
-        # Companies House Basic Auth requires the key as the username, empty password
-        auth_string = f"{self.api_key}:"
-        encoded_auth = base64.b64encode(auth_string.encode('utf-8')).decode('utf-8')
-        return {
-            "Authorization": f"Basic {encoded_auth}"
-        }
+    def _get(self, endpoint, params=None, headers=None):
+        """
+        Rate-limited GET through the shared session.
+        On 429 the whole process backs off for Retry-After before trying again.
+        """
+        for attempt in range(MAX_RETRIES):
+            self.limiter.acquire()
+            response = self.session.get(endpoint, params=params, headers=headers, timeout=30)
+            if response.status_code != 429:
+                return response
+            wait = retry_after_seconds(response, default=2 ** attempt)
+            print(f"   ⏳ Rate limited by Companies House. Backing off {wait:.0f}s...")
+            self.limiter.pause(wait)
+        return response
+
+    def _revalidate(self, key, endpoint, params, entry):
+        try:
+            response = self._get(endpoint, params=params, headers=self._conditional_headers(entry))
+            return self._store(key, response, entry)
+        except Exception as e:
+            print(f"   ❌ API Error ({key}): {e}")
+            return entry[0] if entry else None
+
+    def _revalidate_in_background(self, key, endpoint, params, entry):
+        with self.refresh_lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+
+        def refresh():
+            try:
+                self._revalidate(key, endpoint, params, entry)
+            finally:
+                with self.refresh_lock:
+                    self.refreshing.discard(key)
+
+        self.refresh_pool.submit(refresh)
+
+    def _fetch_json(self, resource, ident, endpoint, params=None):
+        """
+        Cached GET: fresh hits never touch the network, stale hits are served
+        immediately and refreshed in the background, misses go live.
+        """
+        key, entry, state = self._lookup(resource, ident)
+        if state == 'fresh':
+            return entry[0]
+        if state == 'stale':
+            self._revalidate_in_background(key, endpoint, params, entry)
+            return entry[0]
+        return self._revalidate(key, endpoint, params, entry)
+
+    def _fetch_all_items(self, resource, ident, endpoint):
+        """
+        Walks a paginated CH list (charges, officers, appointments) and returns every item.
+        Each page is cached on its own; page 0 shares the plain '<resource>:<ident>' key.
+        """
+        items = []
+        for page in range(MAX_PAGES):
+            start = page * PAGE_SIZE
+            page_ident = ident if start == 0 else f"{ident}@{start}"
+            data = self._fetch_json(resource, page_ident, endpoint, {"items_per_page": PAGE_SIZE, "start_index": start}) or {}
+            batch = data.get('items') or []
+            items.extend(batch)
+            total = data.get('total_count', data.get('total_results', 0))
+            if len(batch) < PAGE_SIZE or len(items) >= total:
+                break
+        return items
 
     def search_company(self, company_name):
         """
@@ -31,16 +204,10 @@ class CompaniesHouseRegistry:
         endpoint = f"{self.base_url}/search/companies"
         params = {"q": company_name, "items_per_page": 1}
         
-        try:
-            response = requests.get(endpoint, headers=self._get_headers(), params=params)
-            if response.status_code == 200:
-                data = response.json()
-                if data.get('items'):
-                    return data['items'][0] # Return top match
-            return None
-        except Exception as e:
-            print(f"   ❌ API Error (Search): {e}")
-            return None
+        data = self._fetch_json('search', company_name.strip().upper(), endpoint, params)
+        if data and data.get('items'):
+            return data['items'][0] # Return top match
+        return None
 
     def get_company_profile(self, company_number):
         """
@@ -50,16 +217,10 @@ class CompaniesHouseRegistry:
 
         endpoint = f"{self.base_url}/company/{company_number}"
         
-        try:
-            response = requests.get(endpoint, headers=self._get_headers())
-            if response.status_code == 200:
-                return response.json()
-            elif response.status_code == 404:
-                print(f"   ⚠️ Company {company_number} not found.")
-            return None
-        except Exception as e:
-            print(f"   ❌ API Error (Profile): {e}")
-            return None
+        profile = self._fetch_json('profile', company_number, endpoint)
+        if profile is None:
+            print(f"   ⚠️ Company {company_number} not found.")
+        return profile
 
     def get_company_officers(self, company_number):
         """
@@ -69,15 +230,17 @@ class CompaniesHouseRegistry:
 
         endpoint = f"{self.base_url}/company/{company_number}/officers"
         
-        try:
-            response = requests.get(endpoint, headers=self._get_headers())
-            if response.status_code == 200:
-                data = response.json()
-                return data.get('items', [])
-            return []
-        except Exception as e:
-            print(f"   ❌ API Error (Officers): {e}")
-            return []
+        return self._fetch_all_items('officers', company_number, endpoint)
+
+    def get_officer_appointments(self, officer_id):
+        """
+        Every company an officer is (or was) appointed to.
+        """
+        if not self.api_key: return []
+
+        endpoint = f"{self.base_url}/officers/{officer_id}/appointments"
+
+        return self._fetch_all_items('appointments', officer_id, endpoint)
 
     def get_psc(self, company_number):
         """
@@ -86,16 +249,10 @@ class CompaniesHouseRegistry:
         if not self.api_key: return []
 
         endpoint = f"{self.base_url}/company/{company_number}/persons-with-significant-control"
+        params = {"items_per_page": 100}
         
-        try:
-            response = requests.get(endpoint, headers=self._get_headers())
-            if response.status_code == 200:
-                data = response.json()
-                return data.get('items', [])
-            return []
-        except Exception as e:
-            print(f"   ❌ API Error (PSC): {e}")
-            return []
+        data = self._fetch_json('psc', company_number, endpoint, params)
+        return (data or {}).get('items', [])
 
     def get_charges(self, company_number):
         """
@@ -106,16 +263,169 @@ class CompaniesHouseRegistry:
 
         endpoint = f"{self.base_url}/company/{company_number}/charges"
         
-        try:
-            response = requests.get(endpoint, headers=self._get_headers())
-            if response.status_code == 200:
-                data = response.json()
-                # We care about 'outstanding' charges
-                charges = data.get('items', [])
-                outstanding = [c for c in charges if c.get('status') == 'outstanding']
-                return outstanding
-            return []
-        except Exception as e:
-            print(f"   ❌ API Error (Charges): {e}")
-            return []
+        # Every page, not just the first 100 charges
+        charges = self._fetch_all_items('charges', company_number, endpoint)
+        # We care about 'outstanding' charges
+        outstanding = [c for c in charges if c.get('status') == 'outstanding']
+        return outstanding
+
+
+class AsyncCompaniesHouseRegistry(CachePolicy):
+    """
+    asyncio twin of CompaniesHouseRegistry for bulk work.
+    Shares the same process-wide token bucket and disk cache, so sync and async
+    callers never exceed the API key's quota between them. Methods return raw CH payloads.
+    Cache reads run in a worker thread, never on the event loop. Cache writes are buffered
+    (and visible to reads straight away) and committed in batches, also off the loop.
+    """
+    def __init__(self, pool_size=20, cache=None):
+        load_dotenv()
+        self.api_key = os.getenv('COMPANIES_HOUSE_KEY')
+        self.base_url = os.getenv('COMPANIES_HOUSE_API_URL', CH_API_URL)
+        self.limiter = CH_LIMITER
+        self.cache = cache if cache is not None else ResponseCache("ch_cache")
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            auth=(self.api_key or '', ''),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=30
+        )
+        self.pending = {}          # key -> (payload, fetched_at, etag) not yet committed
+        self.pending_touch = {}    # key -> fetched_at
+        self.pending_since = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.flush()
+        await self.client.aclose()
+
+    async def _lookup_async(self, resource, ident):
+        key = f"{resource}:{ident}"
+        if key in self.pending:
+            entry = self.pending[key]
+        elif self.cache:
+            entry = await asyncio.to_thread(self.cache.get_entry, key)
+            if entry is not None and key in self.pending_touch:
+                entry = (entry[0], self.pending_touch[key], entry[2])
+        else:
+            entry = None
+        return key, *self._classify(resource, entry)
+
+    def _cache_set(self, key, payload, etag):
+        self.pending[key] = (payload, time.time(), etag)
+        self.pending_touch.pop(key, None)
+        self.pending_since = self.pending_since or time.monotonic()
+
+    def _cache_touch(self, key, entry):
+        if key in self.pending:
+            self.pending[key] = (entry[0], time.time(), entry[2])
+        else:
+            self.pending_touch[key] = time.time()
+        self.pending_since = self.pending_since or time.monotonic()
+
+    async def flush(self):
+        """
+        Commits buffered cache writes in one transaction, in a worker thread.
+        """
+        if not (self.pending or self.pending_touch) or not self.cache:
+            return
+        records = [(key, payload, etag, fetched_at) for key, (payload, fetched_at, etag) in self.pending.items()]
+        touched = list(self.pending_touch.items())
+        self.pending, self.pending_touch, self.pending_since = {}, {}, None
+        await asyncio.to_thread(self.cache.write_many, records, touched)
 
+    async def _maybe_flush(self):
+        waiting = len(self.pending) + len(self.pending_touch)
+        if waiting >= CACHE_FLUSH_SIZE or (waiting and time.monotonic() - self.pending_since >= CACHE_FLUSH_SECONDS):
+            await self.flush()
+
+    async def _get(self, resource, ident, path, params=None):
+        """
+        Returns the decoded JSON body (from cache when fresh), None on 404, and
+        raises on failures we have nothing cached for, so the caller can leave
+        the company un-checkpointed for a retry.
+        """
+        key, entry, state = await self._lookup_async(resource, ident)
+        if state == 'fresh':
+            return entry[0]
+
+        for attempt in range(MAX_RETRIES):
+            await self.limiter.acquire_async()
+            response = await self.client.get(path, params=params, headers=self._conditional_headers(entry))
+            if response.status_code == 429:
+                wait = retry_after_seconds(response, default=2 ** attempt)
+                self.limiter.pause(wait)
+                continue
+            if response.status_code not in (200, 304, 404) and entry is None:
+                response.raise_for_status()
+            data = self._store(key, response, entry)
+            await self._maybe_flush()
+            return data
+        raise RuntimeError(f"Rate limited on {path} after {MAX_RETRIES} attempts")
+
+    async def _get_all_items(self, resource, ident, path):
+        """
+        Async counterpart of CompaniesHouseRegistry._fetch_all_items (same cache keys).
+        Page 1 gives the total; the remaining pages are then fetched concurrently.
+        """
+        def get_page(page):
+            start = page * PAGE_SIZE
+            page_ident = ident if start == 0 else f"{ident}@{start}"
+            return self._get(resource, page_ident, path, {"items_per_page": PAGE_SIZE, "start_index": start})
+
+        first = await get_page(0) or {}
+        items = list(first.get('items') or [])
+        total = first.get('total_count', first.get('total_results', 0))
+        if len(items) < PAGE_SIZE or len(items) >= total:
+            return items
+        pages = min(MAX_PAGES, -(-total // PAGE_SIZE))
+        for data in await asyncio.gather(*(get_page(page) for page in range(1, pages))):
+            items.extend((data or {}).get('items') or [])
+        return items
+
+    async def search_company(self, company_name):
+        data = await self._get('search', company_name.strip().upper(), "/search/companies",
+                               {"q": company_name, "items_per_page": 1})
+        items = (data or {}).get('items') or []
+        return items[0] if items else None
+
+    async def get_company_profile(self, company_number):
+        return await self._get('profile', company_number, f"/company/{company_number}")
+
+    async def get_company_officers(self, company_number):
+        return await self._get_all_items('officers', company_number, f"/company/{company_number}/officers")
+
+    async def get_psc(self, company_number):
+        data = await self._get('psc', company_number, f"/company/{company_number}/persons-with-significant-control", {"items_per_page": 100})
+        return (data or {}).get('items', [])
+
+    async def get_charges(self, company_number):
+        """
+        All charges (outstanding and satisfied, every page) so the debt history is complete.
+        """
+        return await self._get_all_items('charges', company_number, f"/company/{company_number}/charges")
+
+    async def get_officer_appointments(self, officer_id):
+        """
+        Every company an officer is (or was) appointed to, keyed by CH's own officer ID.
+        """
+        return await self._get_all_items('appointments', officer_id, f"/officers/{officer_id}/appointments")
+
+    async def get_company_bundle(self, company_number, include_profile=True):
+        """
+        Profile, officers, PSCs and charges fetched concurrently.
+        Pass include_profile=False when the bulk snapshot already gave us the profile.
+        """
+        profile_call = self.get_company_profile(company_number) if include_profile else asyncio.sleep(0, result=None)
+        profile, officers, pscs, charges = await asyncio.gather(
+            profile_call,
+            self.get_company_officers(company_number),
+            self.get_psc(company_number),
+            self.get_charges(company_number)
+        )
+        return {"profile": profile, "officers": officers, "pscs": pscs, "charges": charges}
@@ -0,0 +1,169 @@
+import os
+import sys
+import glob
+import sqlite3
+import threading
+import time
+from sqlalchemy import create_engine, event
+
+# --- CONFIGURATION ---
+LIVE_DB_FILE = "vantage.db"                 # Written by the ingest scripts
+SNAPSHOT_DIR = "./snapshots"                # Immutable copies published for the API
+SERVING_LINK = "./vantage_serving.db"       # Symlink -> current snapshot (swapped atomically)
+SNAPSHOT_KEEP = 3                           # Older snapshots are pruned after a publish
+SWAP_CHECK_SECONDS = 1.0
+READ_POOL_SIZE = 8
+
+def enable_wal(db_file=LIVE_DB_FILE):
+    """
+    WAL is persistent in the file: once set, ingest writers no longer block readers.
+    """
+    with sqlite3.connect(db_file) as conn:
+        return conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+
+def read_only_engine(db_file, immutable=False):
+    """
+    Pooled read-only engine. `immutable` (snapshots only) also skips all locking.
+    """
+    path = os.path.abspath(db_file)
+    flags = "mode=ro&immutable=1" if immutable else "mode=ro"
+    engine = create_engine(
+        f"sqlite:///file:{path}?{flags}&uri=true",
+        pool_size=READ_POOL_SIZE,
+        max_overflow=READ_POOL_SIZE
+    )
+
+    @event.listens_for(engine, "connect")
+    def _tune(dbapi_conn, _):
+        dbapi_conn.execute("PRAGMA query_only = 1")
+        dbapi_conn.execute("PRAGMA mmap_size = 268435456")
+        dbapi_conn.execute("PRAGMA cache_size = -65536")
+
+    return engine
+
+def data_generation(conn):
+    """
+    The latest ingest run (vantage_pipeline.current_generation), or 0 before the first.
+    """
+    try:
+        return conn.execute("SELECT MAX(run_id) FROM ingest_runs").fetchone()[0] or 0
+    except sqlite3.Error:
+        return 0
+
+def snapshot_path(generation):
+    # Zero-padded so snapshots sort in publish order
+    return os.path.join(SNAPSHOT_DIR, f"vantage-g{generation:010d}.db")
+
+def publish_snapshot(db_file=LIVE_DB_FILE):
+    """
+    Blue/green publish: copy the live DB with the online backup API (a consistent
+    read that doesn't block writers under WAL), then atomically repoint SERVING_LINK.
+    Workers pick up the new file on their next request; in-flight queries finish on the old one.
+    Snapshots are named after the data generation they contain and never overwritten
+    (an open immutable file must not change under its readers): republishing an
+    unchanged generation just re-points the link.
+    """
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    with sqlite3.connect(db_file) as conn:
+        target = snapshot_path(data_generation(conn))
+
+    if not os.path.exists(target):
+        tmp_target = f"{target}.{os.getpid()}.tmp"
+        print(f"📸 Publishing snapshot {target}...")
+        source = sqlite3.connect(db_file)
+        dest = sqlite3.connect(tmp_target)
+        try:
+            source.backup(dest)
+            # Snapshots are opened read-only/immutable: no WAL side files
+            dest.execute("PRAGMA journal_mode=DELETE")
+            dest.execute("ANALYZE")
+            dest.commit()
+            # An ingest may have finished between the check and the copy: name what was copied
+            target = snapshot_path(data_generation(dest))
+        finally:
+            dest.close()
+            source.close()
+        try:
+            os.link(tmp_target, target)  # Unlike os.replace, fails rather than overwrite
+        except FileExistsError:
+            print(f"   {target} already published by another run.")
+        finally:
+            os.remove(tmp_target)
+
+    # Atomic swap: build the new link beside the old one, then rename over it
+    tmp_link = SERVING_LINK + ".tmp"
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(os.path.abspath(target), tmp_link)
+    os.replace(tmp_link, SERVING_LINK)
+
+    # Open file handles keep pruned snapshots alive until old readers let go
+    snapshots = sorted(glob.glob(os.path.join(SNAPSHOT_DIR, "vantage-*.db")))
+    for old in snapshots[:-SNAPSHOT_KEEP]:
+        if old != target:
+            os.remove(old)
+
+    print(f"✅ Serving snapshot: {target}")
+    return target
+
+def publish_if_serving(db_file=LIVE_DB_FILE):
+    """
+    Called by the pipeline after every stage: once the API serves snapshots (the first
+    publish is manual), each ingest publishes a fresh one so the API never lags the data.
+    """
+    if os.path.lexists(SERVING_LINK):
+        return publish_snapshot(db_file)
+    return None
+
+class SnapshotEngine:
+    """
+    Engine proxy for API workers. Follows SERVING_LINK, swapping to a fresh read-only
+    engine when a new snapshot is published. Falls back to the live DB (read-only,
+    WAL) when no snapshot has been published yet.
+    """
+    def __init__(self, link=SERVING_LINK, fallback=LIVE_DB_FILE):
+        self.link = link
+        self.fallback = fallback
+        self.target = None
+        self.engine = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _resolve(self):
+        if os.path.exists(self.link):
+            return os.path.realpath(self.link), True
+        return os.path.abspath(self.fallback), False
+
+    def current(self):
+        now = time.monotonic()
+        if self.engine is not None and now - self._checked_at < SWAP_CHECK_SECONDS:
+            return self.engine
+        with self._lock:
+            self._checked_at = now
+            target, immutable = self._resolve()
+            if target != self.target:
+                old = self.engine
+                self.engine = read_only_engine(target, immutable=immutable)
+                self.target = target
+                if old is not None:
+                    # Idle connections close now; checked-out ones close when their request returns
+                    old.dispose()
+                print(f"🔁 API now reading {target}")
+            return self.engine
+
+    def connect(self):
+        return self.current().connect()
+
+    def dispose(self):
+        if self.engine is not None:
+            self.engine.dispose()
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "publish"
+    if command == "wal":
+        print(f"📝 Journal mode: {enable_wal()}")
+    elif command == "publish":
+        enable_wal()
+        publish_snapshot()
+    else:
+        print("Usage: python vantage_db.py [wal|publish]")
@@ -0,0 +1,79 @@
+import asyncio
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by every worker hitting the same upstream API.
+    Allows short bursts up to `capacity`, then settles at `rate` requests per second.
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        """
+        Takes one token and returns how long the caller must wait before using it.
+        """
+        with self.lock:
+            self._refill()
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        """
+        Blocks until a request slot is available.
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """
+        Awaitable version of acquire() for asyncio workers sharing the same bucket.
+        """
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Drains the bucket so nobody sends for `seconds` (used when the server says 429).
+        """
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+def build_session(pool_size=10, headers=None):
+    """
+    A keep-alive session with a connection pool sized for `pool_size` concurrent workers.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+def retry_after_seconds(response, default=1.0):
+    """
+    Parses a Retry-After header (seconds form) falling back to `default`.
+    """
+    value = response.headers.get('Retry-After')
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return default
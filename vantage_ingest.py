@@ -2,6 +2,8 @@ import os
 import pandas as pd
 from sqlalchemy import create_engine, text
 from vantage_s3 import VantageDataLake
+from vantage_pipeline import post_ingest
+from build_comps import refresh_comps
 from dotenv import load_dotenv
 
 # --- CONFIGURATION ---
@@ -39,6 +41,7 @@ def ingest_pipeline():
     
     # 3. LOOP THROUGH FILES
     total_ingested = 0
+    touched_uprns = set()
     
     for s3_key in target_files:
         safe_name = s3_key.replace("/", "_")
@@ -98,11 +101,15 @@ def ingest_pipeline():
 
             count = len(assessments)
             total_ingested += count
+            touched_uprns.update(assessments['uprn'].dropna())
             print(f"   ✅ Linked {count} EPCs to Master Property Index.")
             
         except Exception as e:
             print(f"   ❌ Error Ingesting: {e}")
 
+    refresh_comps(engine)
+    post_ingest(engine, 'epc', touched_uprns)
+
     print("=========================================")
     print(f"🎉 BATCH COMPLETE.")
     print(f"📊 Total EPCs Ingested: {total_ingested}")
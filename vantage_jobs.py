@@ -0,0 +1,156 @@
+import json
+import time
+import uuid
+import hashlib
+import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, text
+from vantage_cache import CACHE_DB_PATH
+
+# --- CONFIGURATION ---
+JOB_WORKERS = 2          # Analyses running at once per API process (the rest wait in the queue)
+MAX_PENDING = 20         # Queued + running per process; further submissions are refused
+RESULT_TTL = 3600        # Seconds a finished result is reused for the same job on the same data generation
+JOB_TIMEOUT = 1800       # A job still unfinished after this long is treated as lost (e.g. its worker restarted)
+JOB_RETENTION = 86400    # Job records are pruned this long after submission
+
+class QueueFull(Exception):
+    pass
+
+class JobManager:
+    """
+    Background analyses for the API: submit, poll, fetch.
+    Jobs run on a small thread pool in the process that accepted them, away from the
+    request threads. Status and results are kept in vantage_cache.db so any API worker
+    can answer a poll. Resubmitting an identical job (same kind, params and data
+    generation) returns the queued, running or finished one instead of running it again.
+    """
+    def __init__(self, engine, handlers, generation_fn=lambda: None, db_path=CACHE_DB_PATH,
+                 workers=JOB_WORKERS, max_pending=MAX_PENDING):
+        self.engine = engine                # Read engine the analyses run against
+        self.handlers = handlers            # kind -> fn(conn, **params) returning JSON-serialisable data
+        self.generation_fn = generation_fn
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="vantage-job")
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.store = create_engine(db_path, connect_args={"timeout": 30})
+
+        with self.store.connect() as conn:
+            conn.execute(text("PRAGMA journal_mode=WAL"))
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS analysis_jobs (
+                    job_id VARCHAR(32) PRIMARY KEY,
+                    job_key VARCHAR(40),     -- Hash of kind + params + data generation
+                    kind VARCHAR(50),
+                    params_json TEXT,
+                    generation INTEGER,
+                    status VARCHAR(10),      -- 'queued', 'running', 'done', 'failed'
+                    submitted_at REAL,
+                    started_at REAL,
+                    finished_at REAL,
+                    result_json TEXT,
+                    error TEXT
+                )
+            """))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_jobs_key ON analysis_jobs(job_key, submitted_at)"))
+            conn.commit()
+
+    def validate(self, kind, params):
+        """
+        Raises ValueError for an unknown kind or parameters the handler doesn't accept.
+        """
+        handler = self.handlers.get(kind)
+        if handler is None:
+            raise ValueError(f"Unknown job kind '{kind}'. Available: {', '.join(sorted(self.handlers))}")
+        try:
+            inspect.signature(handler).bind(None, **params)
+        except TypeError as e:
+            raise ValueError(f"Invalid parameters for '{kind}': {e}")
+
+    def submit(self, kind, params):
+        self.validate(kind, params)
+        generation = self.generation_fn()
+        job_key = hashlib.sha1(
+            json.dumps([kind, params, generation], sort_keys=True, default=str).encode()
+        ).hexdigest()
+        now = time.time()
+
+        with self.store.connect() as conn:
+            conn.execute(text("DELETE FROM analysis_jobs WHERE submitted_at < :cutoff"), {"cutoff": now - JOB_RETENTION})
+            conn.commit()
+            existing = conn.execute(text("""
+                SELECT job_id FROM analysis_jobs
+                WHERE job_key = :key
+                  AND ((status IN ('queued', 'running') AND submitted_at >= :live_after)
+                       OR (status = 'done' AND finished_at >= :fresh_after))
+                ORDER BY submitted_at DESC LIMIT 1
+            """), {"key": job_key, "live_after": now - JOB_TIMEOUT, "fresh_after": now - RESULT_TTL}).scalar()
+        if existing:
+            return self.get(existing)
+
+        if not self.slots.acquire(blocking=False):
+            raise QueueFull("Too many analyses pending; try again shortly.")
+
+        job_id = uuid.uuid4().hex
+        try:
+            with self.store.connect() as conn:
+                conn.execute(text("""
+                    INSERT INTO analysis_jobs (job_id, job_key, kind, params_json, generation, status, submitted_at)
+                    VALUES (:id, :key, :kind, :params, :generation, 'queued', :now)
+                """), {"id": job_id, "key": job_key, "kind": kind, "params": json.dumps(params),
+                       "generation": generation, "now": now})
+                conn.commit()
+            self.pool.submit(self._run, job_id, kind, params)
+        except Exception:
+            self.slots.release()
+            raise
+        return self.get(job_id)
+
+    def _update(self, job_id, **fields):
+        assignments = ", ".join(f"{name} = :{name}" for name in fields)
+        with self.store.connect() as conn:
+            conn.execute(text(f"UPDATE analysis_jobs SET {assignments} WHERE job_id = :job_id"), {"job_id": job_id, **fields})
+            conn.commit()
+
+    def _run(self, job_id, kind, params):
+        try:
+            self._update(job_id, status='running', started_at=time.time())
+            with self.engine.connect() as conn:
+                result = self.handlers[kind](conn, **params)
+            self._update(job_id, status='done', finished_at=time.time(), result_json=json.dumps(result, default=str))
+        except Exception as e:
+            print(f"   ❌ Job {job_id} ({kind}) failed: {e}")
+            self._update(job_id, status='failed', finished_at=time.time(), error=str(e))
+        finally:
+            self.slots.release()
+
+    def get(self, job_id):
+        """
+        Job status without the result. None if unknown (or pruned).
+        """
+        with self.store.connect() as conn:
+            row = conn.execute(text("""
+                SELECT job_id, kind, params_json, generation, status, submitted_at, started_at, finished_at, error
+                FROM analysis_jobs WHERE job_id = :id
+            """), {"id": job_id}).fetchone()
+        if row is None:
+            return None
+        job = dict(row._mapping)
+        job["params"] = json.loads(job.pop("params_json"))
+        if job["status"] in ('queued', 'running') and time.time() - job["submitted_at"] > JOB_TIMEOUT:
+            job["status"], job["error"] = 'failed', 'Job was lost (worker restarted or timed out)'
+        return job
+
+    def result(self, job_id):
+        """
+        (job, result): the result is None until the job is done.
+        """
+        job = self.get(job_id)
+        if job is None or job["status"] != 'done':
+            return job, None
+        with self.store.connect() as conn:
+            payload = conn.execute(text("SELECT result_json FROM analysis_jobs WHERE job_id = :id"), {"id": job_id}).scalar()
+        return job, json.loads(payload)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
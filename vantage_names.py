@@ -0,0 +1,232 @@
+import bisect
+import heapq
+import threading
+import time
+from collections import defaultdict
+from sqlalchemy import text
+from resolve_owners import normalize_name, SUFFIXES, PUNCTUATION
+from vantage_pipeline import current_generation
+
+# --- CONFIGURATION ---
+TOP_K = 10
+MAX_RESULTS = 50              # Largest `limit` served from the precomputed rankings (the API's cap)
+MAX_WORDS_INDEXED = 4         # 'XYZ' finds 'ABC XYZ PROPERTIES LTD' (word starts, not arbitrary substrings)
+PRECOMPUTED_PREFIX_LEN = 3    # Every prefix this short has its ranking built at load time...
+MAX_SCAN = 5000               # ...as does any longer prefix matching more keys than this; the rest are ranked in full
+REFRESH_CHECK_SECONDS = 30
+
+def query_prefixes(q):
+    """
+    Index prefixes for a typeahead query. The word still being typed can be the start
+    of a legal form the keys hold in canonical form, so those are searched too:
+    'XYZ PROPERTIES LIMI' -> {'XYZ PROPERTIES LIMI', 'XYZ PROPERTIES LTD', 'XYZ PROPERTIES LLP'}.
+    """
+    prefixes = {normalize_name(q)}
+    words = PUNCTUATION.sub(" ", str(q).upper().replace('&', ' AND ')).split()
+    if words and not q[-1].isspace():
+        for n in range(1, min(len(words), 3) + 1):
+            tail = " ".join(words[-n:])
+            for phrase, canonical in SUFFIXES.items():
+                if phrase.startswith(tail):
+                    prefixes.add(normalize_name(" ".join(words[:-n] + [canonical])))
+    return sorted(p for p in prefixes if p)
+
+def key_quality(key, name, length):
+    """
+    How well a prefix of `length` characters of index key `key` (a word suffix of the
+    normalised `name`) matches: (exact name, ends on a word boundary, starts at the first word).
+    Tuples compare in that order, so exact beats whole words beats a partial word.
+    """
+    whole_words = length == len(key) or key[length] == " "
+    leading = key == name
+    return (leading and length == len(key), whole_words, leading)
+
+def match_quality(name, prefix):
+    """
+    The best key_quality of `prefix` over the indexed word starts of `name`; None if none match.
+    """
+    words = name.split(" ")
+    qualities = [key_quality(key, name, len(prefix))
+                 for key in (" ".join(words[i:]) for i in range(min(len(words), MAX_WORDS_INDEXED)))
+                 if key.startswith(prefix)]
+    return max(qualities) if qualities else None
+
+class NameIndex:
+    """
+    In-process company / proprietor name typeahead.
+    A sorted list of (normalised name suffix, entry id) searched with bisect, ranked by
+    match quality (see key_quality) and then local portfolio size. Reloaded in the
+    background when ingest_runs shows new data; searches keep using the previous
+    snapshot until the swap.
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.keys = []
+        self.entry_ids = []
+        self.entries = []
+        self.names = []
+        self.top_by_prefix = {}
+        self.generation = None
+        self.loaded = False
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self._loading = False
+
+    def _load(self):
+        with self.engine.connect() as conn:
+            generation = current_generation(conn)
+            rows = conn.execute(text("""
+                SELECT c.company_name, c.company_number, COUNT(DISTINCT o.title_number)
+                FROM corporate_registry c
+                LEFT JOIN ownership_records o ON o.company_number = c.company_number
+                WHERE c.company_name IS NOT NULL
+                GROUP BY c.company_number
+                UNION ALL
+                SELECT o.proprietor_name, o.company_number, COUNT(DISTINCT o.title_number)
+                FROM ownership_records o
+                WHERE o.proprietor_name IS NOT NULL
+                GROUP BY o.proprietor_name, o.company_number
+            """)).fetchall()
+
+        # One entry per (normalised name, company number); CCOD and registry spellings collapse
+        entries, seen = [], {}
+        for name, number, title_count in rows:
+            normalized = normalize_name(name)
+            if not normalized:
+                continue
+            ident = (normalized, number)
+            if ident in seen:
+                entry = entries[seen[ident]]
+                entry["title_count"] = max(entry["title_count"], title_count)
+                continue
+            seen[ident] = len(entries)
+            entries.append({"name": name, "company_number": number, "title_count": title_count})
+
+        names = [normalized for normalized, _ in seen]
+        pairs = []
+        top = defaultdict(list)
+        for entry_id, normalized in enumerate(names):
+            words = normalized.split(" ")
+            rank = (entries[entry_id]["title_count"], -entry_id)
+            scores = {}
+            for i in range(min(len(words), MAX_WORDS_INDEXED)):
+                suffix = " ".join(words[i:])
+                pairs.append((suffix, entry_id))
+                for n in range(1, min(len(suffix), PRECOMPUTED_PREFIX_LEN) + 1):
+                    score = (key_quality(suffix, normalized, n), *rank)
+                    scores[suffix[:n]] = max(score, scores.get(suffix[:n], score))
+            for prefix, score in scores.items():
+                heap = top[prefix]
+                if len(heap) < MAX_RESULTS:
+                    heapq.heappush(heap, (score, entry_id))
+                elif score > heap[0][0]:
+                    heapq.heapreplace(heap, (score, entry_id))
+        pairs.sort()
+        keys, entry_ids = [p[0] for p in pairs], [p[1] for p in pairs]
+        top = {prefix: [e for _, e in sorted(heap, reverse=True)] for prefix, heap in top.items()}
+        top.update(self._rank_large_ranges(keys, entry_ids, entries, names, top))
+
+        snapshot = (keys, entry_ids, entries, names, top, generation)
+        with self._lock:
+            self.keys, self.entry_ids, self.entries, self.names, self.top_by_prefix, self.generation = snapshot
+            self.loaded = True
+            self._loading = False
+        print(f"🔤 Name index loaded: {len(entries)} names, {len(pairs)} keys (generation {generation}).")
+
+    @staticmethod
+    def _rank_large_ranges(keys, entry_ids, entries, names, top):
+        """
+        Rankings for every prefix longer than PRECOMPUTED_PREFIX_LEN that matches more than
+        MAX_SCAN keys. A prefix's range sits inside its parent's, so only the large ranges
+        of one length are split to find the next.
+        """
+        def best_scores(lo, hi, length):
+            scores = {}
+            for k in range(lo, hi):
+                e = entry_ids[k]
+                score = (key_quality(keys[k], names[e], length), entries[e]["title_count"], -e)
+                scores[e] = max(score, scores.get(e, score))
+            return scores
+
+        ranked = {}
+        frontier = []
+        for prefix in top:
+            if len(prefix) == PRECOMPUTED_PREFIX_LEN:
+                lo = bisect.bisect_left(keys, prefix)
+                hi = bisect.bisect_left(keys, prefix + "\uffff", lo)
+                if hi - lo > MAX_SCAN:
+                    frontier.append((len(prefix) + 1, lo, hi))
+        while frontier:
+            length, lo, hi = frontier.pop()
+            i = lo
+            while i < hi:
+                if len(keys[i]) < length:  # The parent prefix itself
+                    i += 1
+                    continue
+                prefix = keys[i][:length]
+                j = bisect.bisect_left(keys, prefix + "\uffff", i, hi)
+                if j - i > MAX_SCAN:
+                    scores = best_scores(i, j, length)
+                    ranked[prefix] = heapq.nlargest(MAX_RESULTS, scores, key=scores.get)
+                    frontier.append((length + 1, i, j))
+                i = j
+        return ranked
+
+    def _load_in_background(self):
+        with self._lock:
+            if self._loading:
+                return
+            self._loading = True
+        thread = threading.Thread(target=self._load_safely, daemon=True)
+        thread.start()
+
+    def _load_safely(self):
+        try:
+            self._load()
+        except Exception as e:
+            print(f"   ❌ Name index load failed: {e}")
+            with self._lock:
+                self._loading = False
+
+    def start(self):
+        self._last_check = time.monotonic()
+        self._load_in_background()
+
+    def refresh_if_stale(self):
+        """
+        Cheap enough to call per request: checks ingest_runs at most every REFRESH_CHECK_SECONDS.
+        """
+        now = time.monotonic()
+        if now - self._last_check < REFRESH_CHECK_SECONDS:
+            return
+        self._last_check = now
+        with self.engine.connect() as conn:
+            generation = current_generation(conn)
+        if generation != self.generation or not self.loaded:
+            self._load_in_background()
+
+    def search(self, q, limit=TOP_K):
+        prefixes = query_prefixes(q)
+        if not prefixes:
+            return []
+        limit = min(limit, MAX_RESULTS)
+        with self._lock:
+            keys, entry_ids, entries, names, top = self.keys, self.entry_ids, self.entries, self.names, self.top_by_prefix
+
+        candidates = set()
+        for prefix in prefixes:
+            if prefix in top:
+                candidates.update(top[prefix][:limit])
+            elif len(prefix) > PRECOMPUTED_PREFIX_LEN:
+                # Not precomputed, so at most MAX_SCAN keys match: rank them all
+                start = bisect.bisect_left(keys, prefix)
+                end = bisect.bisect_left(keys, prefix + "\uffff", start, min(start + MAX_SCAN, len(keys)))
+                candidates.update(entry_ids[start:end])
+        # Best match quality over the query's prefixes, then portfolio size
+        def score(e):
+            quality = max(q for q in (match_quality(names[e], p) for p in prefixes) if q is not None)
+            return (quality, entries[e]["title_count"], -e)
+
+        ids = heapq.nlargest(limit, candidates, key=score)
+
+        return [dict(entries[e]) for e in ids]
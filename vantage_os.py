@@ -1,28 +1,66 @@
-import requests
-import urllib.parse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from vantage_http import TokenBucket, build_session, retry_after_seconds
+from vantage_cache import ResponseCache, MISSING
+
+# --- CONFIGURATION ---
+OS_PLACES_URL = "https://api.os.uk/search/places/v1/find"
+OS_RATE_LIMIT = 10    # OS Data Hub allows 600 transactions/minute per project
+MAX_WORKERS = 8       # Concurrent in-flight requests (also the connection pool size)
+MAX_RETRIES = 3
+
+def normalize_query(address_query):
+    """
+    Cache key for an address: case and whitespace don't change the OS answer.
+    """
+    return " ".join(str(address_query).upper().split())
 
 class OrdnanceSurvey:
-    def __init__(self):
-        # In prod, load from .env. For this session, we use the provided key.
-        self.api_key = "qL5Ai49ojGQUah0GR45eIaXTGUjPTixa"
-        self.places_endpoint = "https://api.os.uk/search/places/v1/find"
-        
-    def get_uprn_from_address(self, address_query):
+    def __init__(self, max_workers=MAX_WORKERS, rate_limit=OS_RATE_LIMIT, cache=None):
+        load_dotenv()
+        self.api_key = os.getenv('OS_API_KEY')
+        # Overridable so the batch resolver can be pointed at a local HTTP stub
+        self.places_endpoint = os.getenv('OS_PLACES_URL', OS_PLACES_URL)
+        self.max_workers = max_workers
+        self.session = build_session(pool_size=max_workers)
+        self.limiter = TokenBucket(rate=rate_limit)
+        self.cache = cache if cache is not None else ResponseCache("os_places_cache")
+
+        if not self.api_key:
+            print("⚠️  WARNING: No OS_API_KEY found in .env")
+            print("   (UPRN resolution will fail)")
+
+    def _fetch(self, address_query):
         """
-        Queries OS Places API to find the official UPRN for a messy address string.
+        One live OS Places lookup. Returns the parsed match, None for 'no match',
+        or MISSING if the request failed (so it isn't cached and gets retried next run).
         """
-        if not address_query: return None
-        
         params = {
             'query': address_query,
             'key': self.api_key,
             'maxresults': 1
         }
-        
-        try:
-            response = requests.get(self.places_endpoint, params=params)
+
+        for attempt in range(MAX_RETRIES):
+            self.limiter.acquire()
+            try:
+                response = self.session.get(self.places_endpoint, params=params, timeout=30)
+            except Exception as e:
+                print(f"❌ OS API Error: {e}")
+                time.sleep(2 ** attempt)
+                continue
+
+            if response.status_code == 429:
+                # Over quota: stop every worker, not just this one
+                self.limiter.pause(retry_after_seconds(response, default=2 ** attempt))
+                continue
+            if response.status_code != 200:
+                print(f"❌ OS API Error: HTTP {response.status_code}")
+                return MISSING
+
             data = response.json()
-            
             if 'results' in data and len(data['results']) > 0:
                 result = data['results'][0]['DPA']
                 return {
@@ -32,13 +70,44 @@ class OrdnanceSurvey:
                     'lat': result.get('LAT'),
                     'lng': result.get('LNG'),
                     'x_coordinate': result.get('X_COORDINATE'),
-                    'y_coordinate': result.get('Y_COORDINATE')
+                    'y_coordinate': result.get('Y_COORDINATE'),
+                    'classification_code': result.get('CLASSIFICATION_CODE')
                 }
             return None
-            
-        except Exception as e:
-            print(f"❌ OS API Error: {e}")
-            return None
+
+        return MISSING
+
+    def get_uprn_from_address(self, address_query):
+        """
+        Queries OS Places API to find the official UPRN for a messy address string.
+        """
+        if not address_query: return None
+        return self.resolve_batch([address_query]).get(address_query)
+
+    def resolve_batch(self, address_queries):
+        """
+        Resolves many addresses at once.
+        Duplicates collapse to one lookup, repeats come from the local cache,
+        and only the remainder hits the API through the pooled, rate-limited session.
+        Returns {address_query: match or None}.
+        """
+        keys = {}
+        for query in address_queries:
+            if query:
+                keys.setdefault(normalize_query(query), query)
+
+        resolved = self.cache.get_many(keys.keys())
+        pending = [k for k in keys if k not in resolved]
+
+        if pending and self.api_key:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                for key, result in zip(pending, pool.map(lambda k: self._fetch(keys[k]), pending)):
+                    if result is MISSING:
+                        continue
+                    self.cache.set(key, result)
+                    resolved[key] = result
+
+        return {q: resolved.get(normalize_query(q)) for q in address_queries if q}
 
     def get_feature_polygon(self, x, y):
         """
@@ -0,0 +1,579 @@
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from score_distress import refresh_scores, refresh_aging_scores
+from vantage_db import publish_if_serving
+
+# --- CONFIGURATION ---
+DISTRESS_BANDS = ('F', 'G')
+
+# Map tile pyramid (Web Mercator / slippy-map tiles): one aggregate row per non-empty tile per zoom
+TILE_MAX_ZOOM = 16
+
+# Change feed (served as Server-Sent Events by /api/events)
+EVENT_RETENTION_DAYS = 30
+
+# What a distress event carries: the same fields as a /api/distress-scan row
+DISTRESS_EVENT_PAYLOAD = """json_object(
+    'uprn', d.uprn, 'address', d.address, 'postcode', d.postcode, 'asset_rating_band', d.asset_rating_band,
+    'floor_area', d.floor_area, 'property_type', d.property_type, 'local_authority', d.local_authority,
+    'latitude', d.latitude, 'longitude', d.longitude, 'company_name', d.company_name,
+    'company_number', d.company_number, 'company_status', d.company_status
+)"""
+
+# Index name -> leading equality column(s) in front of the ranking key
+DISTRESS_INDEXES = {
+    'idx_distress_rank': '',
+    'idx_distress_la_rank': 'local_authority, ',
+    'idx_distress_type_rank': 'property_type, ',
+}
+
+def ensure_tables(conn):
+    # Persistent per file: API readers are never blocked by a long ingest transaction
+    conn.execute(text("PRAGMA journal_mode=WAL"))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS ingest_runs (
+            run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            stage VARCHAR(50),
+            touched_count INTEGER,   -- NULL = full refresh
+            distress_rows INTEGER,
+            finished_at DATETIME
+        )
+    """))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS distress_assets (
+            uprn VARCHAR(20) PRIMARY KEY,
+            address TEXT,
+            postcode VARCHAR(10),
+            local_authority VARCHAR(10),
+            latitude DECIMAL(10, 6),
+            longitude DECIMAL(10, 6),
+            asset_rating_band CHAR(2),
+            asset_rating INTEGER,
+            floor_area NUMERIC,      -- 0 when unknown, so the keyset never meets a NULL
+            property_type TEXT,
+            inspection_date DATE,
+            title_number VARCHAR(20),
+            proprietor_name TEXT,
+            owner_count INTEGER,
+            company_name TEXT,
+            company_number VARCHAR(20),
+            company_status TEXT,
+            refreshed_at DATETIME,
+            tile_x INTEGER,          -- Tile at TILE_MAX_ZOOM
+            tile_y INTEGER
+        )
+    """))
+    # Databases built before the tile pyramid
+    columns = [row[1] for row in conn.execute(text("PRAGMA table_info(distress_assets)"))]
+    for column in ('tile_x', 'tile_y'):
+        if column not in columns:
+            conn.execute(text(f"ALTER TABLE distress_assets ADD COLUMN {column} INTEGER"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_distress_tile ON distress_assets(tile_x, tile_y)"))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS distress_tiles (
+            z INTEGER,
+            x INTEGER,
+            y INTEGER,
+            asset_count INTEGER,
+            f_count INTEGER,
+            g_count INTEGER,
+            floor_area_total NUMERIC,
+            lat_sum REAL,            -- Sums (not means) so incremental deltas stay additive
+            lng_sum REAL,
+            PRIMARY KEY (z, x, y)
+        )
+    """))
+    # The ranking key, alone and behind each equality filter: every page is one index range seek
+    for name, prefix in DISTRESS_INDEXES.items():
+        columns = f"{prefix}asset_rating_band, floor_area, uprn"
+        # Older databases hold an index of the same name over (band, floor_area DESC): rebuild it
+        existing = [(row[2], row[3]) for row in conn.execute(text(f"PRAGMA index_xinfo({name})")) if row[5]]
+        if existing and existing != [(column, 0) for column in columns.split(", ")]:
+            conn.execute(text(f"DROP INDEX {name}"))
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON distress_assets({columns})"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_distress_location ON distress_assets(latitude, longitude)"))
+    # Per-property dossier: the latest value of every signal, one primary-key read per asset
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS property_dossier (
+            uprn VARCHAR(20) PRIMARY KEY,
+            address TEXT,
+            postcode VARCHAR(10),
+            local_authority VARCHAR(10),
+            latitude DECIMAL(10, 6),
+            longitude DECIMAL(10, 6),
+            classification_code VARCHAR(10),
+            title_number VARCHAR(20),
+            epc_certificate_id VARCHAR(24),
+            asset_rating_band CHAR(2),
+            asset_rating INTEGER,
+            floor_area NUMERIC,
+            property_type TEXT,
+            inspection_date DATE,
+            epc_count INTEGER,
+            proprietor_name TEXT,
+            owner_count INTEGER,
+            company_number VARCHAR(20),
+            company_name TEXT,
+            company_status TEXT,
+            company_category TEXT,
+            incorporation_country TEXT,
+            voa_ref VARCHAR(50),
+            voa_description TEXT,
+            rateable_value_2023 INTEGER,
+            rateable_value_2026 INTEGER,
+            planning_count INTEGER,
+            planning_application_id VARCHAR(50),
+            planning_status VARCHAR(50),
+            planning_decision_date DATE,
+            planning_expiry_date DATE,
+            planning_lapsing_soon BOOLEAN,
+            lease_count INTEGER,
+            lessee_name TEXT,
+            lease_expiry_date DATE,
+            has_covenant BOOLEAN,
+            max_download_speed INTEGER,
+            fiber_availability BOOLEAN,
+            five_g_availability BOOLEAN,
+            refreshed_at DATETIME
+        )
+    """))
+    # Append-only change log; event_id doubles as the SSE event ID clients resume from
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS change_events (
+            event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_type VARCHAR(30),  -- 'distress_new', 'band_changed', 'distress_cleared', 'consent_lapsing', 'charge_new', 'run_finished'
+            stage VARCHAR(50),
+            uprn VARCHAR(20),
+            company_number VARCHAR(20),
+            local_authority VARCHAR(10),
+            asset_rating_band CHAR(2),
+            payload TEXT,            -- JSON
+            created_at DATETIME
+        )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_events_created ON change_events(created_at)"))
+    # Scoped (incremental) dossier refreshes look signals up by UPRN / title
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_ownership_title ON ownership_records(title_number)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_voa_uprn ON voa_ratings(uprn)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_planning_uprn ON planning_history(uprn)"))
+    # Address search: one FTS document per master_properties row (rowid shared with it)
+    conn.execute(text("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS address_fts USING fts5(
+            address, postcode, uprn UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    """))
+    conn.commit()
+
+def stage_touched_uprns(conn, touched_uprns):
+    pd.DataFrame({'uprn': sorted(set(touched_uprns))}).to_sql('temp_touched_uprns', conn, if_exists='replace', index=False)
+    conn.execute(text("CREATE INDEX idx_temp_touched_uprns ON temp_touched_uprns(uprn)"))
+
+def uprns_for(engine, column, values):
+    """
+    For stages keyed by title, company or postcode rather than UPRN: the UPRNs whose title sits
+    in `values` ('title_number'), whose title is owned by a company in `values` ('company_number')
+    or whose postcode is in `values` ('postcode').
+    """
+    joins = {
+        'title_number': "JOIN temp_uprn_keys k ON k.value = p.title_number",
+        'postcode': "JOIN temp_uprn_keys k ON k.value = p.postcode",
+        'company_number': """JOIN ownership_records o ON o.title_number = p.title_number
+                             JOIN temp_uprn_keys k ON k.value = o.company_number""",
+    }
+    if not values:
+        return []
+    with engine.connect() as conn:
+        pd.DataFrame({'value': sorted(set(values))}).to_sql('temp_uprn_keys', conn, if_exists='replace', index=False)
+        uprns = [row[0] for row in conn.execute(text(f"""
+            SELECT DISTINCT p.uprn FROM master_properties p {joins[column]} WHERE p.uprn IS NOT NULL
+        """))]
+        conn.execute(text("DROP TABLE temp_uprn_keys"))
+        conn.commit()
+    return uprns
+
+def refresh_distress_assets(conn, incremental=False):
+    """
+    Rebuilds distress_assets: one row per UPRN from its latest EPC, first-listed owner
+    and that owner's company. When `incremental`, only the UPRNs staged in
+    temp_touched_uprns are recomputed (a UPRN that is no longer F/G simply drops out).
+    """
+    scope = ""
+    if incremental:
+        conn.execute(text("DELETE FROM distress_assets WHERE uprn IN (SELECT uprn FROM temp_touched_uprns)"))
+        scope = "AND e.uprn IN (SELECT uprn FROM temp_touched_uprns)"
+    else:
+        conn.execute(text("DELETE FROM distress_assets"))
+
+    bands = ", ".join(f"'{b}'" for b in DISTRESS_BANDS)
+    conn.execute(text(f"""
+        INSERT INTO distress_assets
+        (uprn, address, postcode, local_authority, latitude, longitude, asset_rating_band, asset_rating,
+         floor_area, property_type, inspection_date, title_number, proprietor_name, owner_count,
+         company_name, company_number, company_status, refreshed_at)
+        WITH latest_epc AS (
+            SELECT e.*, ROW_NUMBER() OVER (
+                PARTITION BY e.uprn ORDER BY e.inspection_date DESC, e.certificate_id DESC
+            ) AS rn
+            FROM epc_assessments e
+            WHERE e.uprn IS NOT NULL {scope}
+        ),
+        owners AS (
+            SELECT o.title_number, o.proprietor_name, o.company_number,
+                   ROW_NUMBER() OVER (PARTITION BY o.title_number ORDER BY o.date_registered DESC, o.id) AS rn,
+                   COUNT(*) OVER (PARTITION BY o.title_number) AS owner_count
+            FROM ownership_records o
+        )
+        SELECT e.uprn, p.address_line_1, p.postcode, p.local_authority_code,
+               COALESCE(p.latitude, pc.latitude), COALESCE(p.longitude, pc.longitude),
+               e.asset_rating_band, e.asset_rating, COALESCE(e.floor_area, 0), e.property_type, e.inspection_date,
+               p.title_number, o.proprietor_name, COALESCE(o.owner_count, 0),
+               c.company_name, c.company_number, c.company_status, :now
+        FROM latest_epc e
+        JOIN master_properties p ON p.uprn = e.uprn
+        LEFT JOIN owners o ON o.title_number = p.title_number AND o.rn = 1
+        LEFT JOIN corporate_registry c ON c.company_number = o.company_number
+        -- Properties OS Places hasn't located yet fall back to their postcode centroid
+        LEFT JOIN postcode_index pc ON pc.postcode = p.postcode
+        WHERE e.rn = 1
+          AND e.asset_rating_band IN ({bands})
+    """), {"now": datetime.now().isoformat(timespec='seconds')})
+
+def refresh_property_dossier(conn, incremental=False):
+    """
+    Rebuilds property_dossier: one row per UPRN with its latest EPC, first-listed owner
+    and company, latest VOA entry, latest planning decision, latest lease, covenant flag
+    and broadband figures. When `incremental`, only the UPRNs staged in
+    temp_touched_uprns (and the titles they sit on) are recomputed.
+    """
+    if incremental:
+        conn.execute(text("DELETE FROM property_dossier WHERE uprn IN (SELECT uprn FROM temp_touched_uprns)"))
+        by_uprn = "AND {col} IN (SELECT uprn FROM temp_touched_uprns)"
+        by_title = """AND {col} IN (
+            SELECT p.title_number FROM master_properties p
+            WHERE p.uprn IN (SELECT uprn FROM temp_touched_uprns)
+        )"""
+    else:
+        conn.execute(text("DELETE FROM property_dossier"))
+        by_uprn = by_title = ""
+
+    conn.execute(text(f"""
+        INSERT INTO property_dossier
+        (uprn, address, postcode, local_authority, latitude, longitude, classification_code, title_number,
+         epc_certificate_id, asset_rating_band, asset_rating, floor_area, property_type, inspection_date, epc_count,
+         proprietor_name, owner_count, company_number, company_name, company_status, company_category,
+         incorporation_country, voa_ref, voa_description, rateable_value_2023, rateable_value_2026,
+         planning_count, planning_application_id, planning_status, planning_decision_date, planning_expiry_date,
+         planning_lapsing_soon, lease_count, lessee_name, lease_expiry_date, has_covenant,
+         max_download_speed, fiber_availability, five_g_availability, refreshed_at)
+        WITH latest_epc AS (
+            SELECT e.*,
+                   ROW_NUMBER() OVER (PARTITION BY e.uprn ORDER BY e.inspection_date DESC, e.certificate_id DESC) AS rn,
+                   COUNT(*) OVER (PARTITION BY e.uprn) AS epc_count
+            FROM epc_assessments e
+            WHERE e.uprn IS NOT NULL {by_uprn.format(col='e.uprn')}
+        ),
+        owners AS (
+            SELECT o.title_number, o.proprietor_name, o.company_number,
+                   ROW_NUMBER() OVER (PARTITION BY o.title_number ORDER BY o.date_registered DESC, o.id) AS rn,
+                   COUNT(*) OVER (PARTITION BY o.title_number) AS owner_count
+            FROM ownership_records o
+            WHERE o.title_number IS NOT NULL {by_title.format(col='o.title_number')}
+        ),
+        latest_voa AS (
+            SELECT v.*,
+                   ROW_NUMBER() OVER (PARTITION BY v.uprn ORDER BY v.list_year DESC, v.effective_date DESC) AS rn
+            FROM voa_ratings v
+            WHERE v.uprn IS NOT NULL {by_uprn.format(col='v.uprn')}
+        ),
+        latest_planning AS (
+            SELECT pl.*,
+                   ROW_NUMBER() OVER (PARTITION BY pl.uprn ORDER BY pl.decision_date DESC, pl.application_id DESC) AS rn,
+                   COUNT(*) OVER (PARTITION BY pl.uprn) AS planning_count,
+                   MAX(pl.is_lapsing_soon) OVER (PARTITION BY pl.uprn) AS any_lapsing
+            FROM planning_history pl
+            WHERE pl.uprn IS NOT NULL {by_uprn.format(col='pl.uprn')}
+        ),
+        latest_lease AS (
+            SELECT l.*,
+                   ROW_NUMBER() OVER (PARTITION BY l.title_number ORDER BY l.lease_date DESC, l.unique_lease_id DESC) AS rn,
+                   COUNT(*) OVER (PARTITION BY l.title_number) AS lease_count
+            FROM lease_registry l
+            WHERE l.title_number IS NOT NULL {by_title.format(col='l.title_number')}
+        )
+        SELECT p.uprn, p.address_line_1, p.postcode, p.local_authority_code,
+               COALESCE(p.latitude, pc.latitude), COALESCE(p.longitude, pc.longitude),
+               p.classification_code, p.title_number,
+               e.certificate_id, e.asset_rating_band, e.asset_rating, e.floor_area, e.property_type,
+               e.inspection_date, COALESCE(e.epc_count, 0),
+               o.proprietor_name, COALESCE(o.owner_count, 0), o.company_number,
+               c.company_name, c.company_status, c.company_category, c.incorporation_country,
+               v.billing_authority_ref, v.description, v.rateable_value_2023, v.rateable_value_2026,
+               COALESCE(pl.planning_count, 0), pl.application_id, pl.status, pl.decision_date, pl.expiry_date,
+               pl.any_lapsing,
+               COALESCE(l.lease_count, 0), l.lessee_name, l.lease_expiry_date,
+               COALESCE(cv.has_covenant, 0),
+               cm.max_download_speed, cm.fiber_availability, cm.five_g_availability,
+               :now
+        FROM master_properties p
+        LEFT JOIN latest_epc e ON e.uprn = p.uprn AND e.rn = 1
+        LEFT JOIN owners o ON o.title_number = p.title_number AND o.rn = 1
+        LEFT JOIN corporate_registry c ON c.company_number = o.company_number
+        LEFT JOIN latest_voa v ON v.uprn = p.uprn AND v.rn = 1
+        LEFT JOIN latest_planning pl ON pl.uprn = p.uprn AND pl.rn = 1
+        LEFT JOIN latest_lease l ON l.title_number = p.title_number AND l.rn = 1
+        LEFT JOIN covenant_registry cv ON cv.title_number = p.title_number
+        LEFT JOIN connectivity_metrics cm ON cm.uprn = p.uprn
+        LEFT JOIN postcode_index pc ON pc.postcode = p.postcode
+        WHERE p.uprn IS NOT NULL {by_uprn.format(col='p.uprn')}
+    """), {"now": datetime.now().isoformat(timespec='seconds')})
+
+def assign_tiles(conn):
+    """
+    Web Mercator tile coordinates at TILE_MAX_ZOOM for rows that don't have them yet.
+    """
+    rows = pd.read_sql(text("""
+        SELECT uprn, latitude, longitude FROM distress_assets
+        WHERE tile_x IS NULL AND latitude IS NOT NULL AND longitude IS NOT NULL
+          AND latitude != 0 AND longitude != 0
+    """), conn)
+    if rows.empty:
+        return
+
+    n = 2 ** TILE_MAX_ZOOM
+    lat = np.radians(rows['latitude'].astype(float).clip(-85.0511, 85.0511))
+    rows['tile_x'] = ((rows['longitude'].astype(float) + 180.0) / 360.0 * n).clip(0, n - 1).astype(int)
+    rows['tile_y'] = ((1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0 * n).clip(0, n - 1).astype(int)
+
+    rows[['uprn', 'tile_x', 'tile_y']].to_sql('temp_distress_tiles', conn, if_exists='replace', index=False)
+    conn.execute(text("""
+        UPDATE distress_assets
+        SET tile_x = t.tile_x, tile_y = t.tile_y
+        FROM temp_distress_tiles t
+        WHERE distress_assets.uprn = t.uprn
+    """))
+    conn.execute(text("DROP TABLE temp_distress_tiles"))
+
+def apply_tile_delta(conn, sign, incremental=False):
+    """
+    Adds (sign=1) or subtracts (sign=-1) assets' contributions to every zoom level of
+    distress_tiles. Incremental runs subtract the touched UPRNs before their refresh
+    and add them back after, so the pyramid never needs a full re-aggregation.
+    """
+    scope = "AND uprn IN (SELECT uprn FROM temp_touched_uprns)" if incremental else ""
+    for z in range(TILE_MAX_ZOOM + 1):
+        conn.execute(text(f"""
+            INSERT INTO distress_tiles (z, x, y, asset_count, f_count, g_count, floor_area_total, lat_sum, lng_sum)
+            SELECT :z, tile_x >> :shift, tile_y >> :shift,
+                   :sign * COUNT(*),
+                   :sign * SUM(asset_rating_band = 'F'),
+                   :sign * SUM(asset_rating_band = 'G'),
+                   :sign * SUM(floor_area),
+                   :sign * SUM(latitude),
+                   :sign * SUM(longitude)
+            FROM distress_assets
+            WHERE tile_x IS NOT NULL {scope}
+            GROUP BY tile_x >> :shift, tile_y >> :shift
+            ON CONFLICT (z, x, y) DO UPDATE SET
+                asset_count = asset_count + excluded.asset_count,
+                f_count = f_count + excluded.f_count,
+                g_count = g_count + excluded.g_count,
+                floor_area_total = floor_area_total + excluded.floor_area_total,
+                lat_sum = lat_sum + excluded.lat_sum,
+                lng_sum = lng_sum + excluded.lng_sum
+        """), {"z": z, "shift": TILE_MAX_ZOOM - z, "sign": sign})
+    conn.execute(text("DELETE FROM distress_tiles WHERE asset_count <= 0"))
+
+def refresh_address_index(conn, incremental=False):
+    """
+    Keeps address_fts in step with master_properties (incrementally by touched UPRN,
+    or rebuilt in full). CCOD stubs without a UPRN are indexed too, via their rowid:
+    incremental runs also pick up every row appended since the index was last written.
+    """
+    scope = ""
+    indexed = conn.execute(text("SELECT rowid FROM address_fts ORDER BY rowid DESC LIMIT 1")).scalar() or 0
+    if incremental:
+        conn.execute(text("""
+            DELETE FROM address_fts WHERE rowid IN (
+                SELECT p.rowid FROM master_properties p
+                WHERE p.uprn IN (SELECT uprn FROM temp_touched_uprns)
+            )
+        """))
+        scope = "AND (p.uprn IN (SELECT uprn FROM temp_touched_uprns) OR p.rowid > :indexed)"
+    else:
+        conn.execute(text("DELETE FROM address_fts"))
+
+    conn.execute(text(f"""
+        INSERT INTO address_fts (rowid, address, postcode, uprn)
+        SELECT p.rowid, p.address_line_1, p.postcode, p.uprn
+        FROM master_properties p
+        WHERE p.address_line_1 IS NOT NULL {scope}
+    """), {"indexed": indexed})
+
+def snapshot_signals(conn, incremental=False):
+    """
+    Before a refresh: saves the distress rows and lapsing-consent flags that
+    emit_change_events() will diff against. Returns which tables already held data:
+    the initial build of a table is a baseline, not a burst of news.
+    """
+    scope = "AND uprn IN (SELECT uprn FROM temp_touched_uprns)" if incremental else ""
+    conn.execute(text("DROP TABLE IF EXISTS temp_distress_before"))
+    conn.execute(text("""
+        CREATE TABLE temp_distress_before (
+            uprn VARCHAR(20) PRIMARY KEY, asset_rating_band CHAR(2),
+            local_authority VARCHAR(10), company_number VARCHAR(20)
+        )
+    """))
+    conn.execute(text(f"""
+        INSERT INTO temp_distress_before
+        SELECT uprn, asset_rating_band, local_authority, company_number FROM distress_assets WHERE uprn IS NOT NULL {scope}
+    """))
+    conn.execute(text("DROP TABLE IF EXISTS temp_lapsing_before"))
+    conn.execute(text("CREATE TABLE temp_lapsing_before (uprn VARCHAR(20) PRIMARY KEY)"))
+    conn.execute(text(f"INSERT INTO temp_lapsing_before SELECT uprn FROM property_dossier WHERE planning_lapsing_soon = 1 {scope}"))
+    return {
+        "distress": conn.execute(text("SELECT EXISTS (SELECT 1 FROM distress_assets)")).scalar(),
+        "dossier": conn.execute(text("SELECT EXISTS (SELECT 1 FROM property_dossier)")).scalar()
+    }
+
+def emit_change_events(conn, stage, baseline, incremental=False):
+    """
+    After a refresh: appends what changed since snapshot_signals() to change_events
+    (new F/G hits, band moves, assets leaving the list, consents that started lapsing).
+    """
+    scope = "AND {alias}.uprn IN (SELECT uprn FROM temp_touched_uprns)" if incremental else ""
+    params = {"stage": stage, "now": datetime.now().isoformat(timespec='seconds')}
+    if baseline["distress"]:
+        conn.execute(text(f"""
+            INSERT INTO change_events (event_type, stage, uprn, company_number, local_authority, asset_rating_band, payload, created_at)
+            SELECT CASE WHEN b.uprn IS NULL THEN 'distress_new' ELSE 'band_changed' END,
+                   :stage, d.uprn, d.company_number, d.local_authority, d.asset_rating_band,
+                   json_set({DISTRESS_EVENT_PAYLOAD}, '$.previous_band', b.asset_rating_band), :now
+            FROM distress_assets d
+            LEFT JOIN temp_distress_before b ON b.uprn = d.uprn
+            WHERE (b.uprn IS NULL OR b.asset_rating_band != d.asset_rating_band) {scope.format(alias='d')}
+        """), params)
+        conn.execute(text("""
+            INSERT INTO change_events (event_type, stage, uprn, company_number, local_authority, asset_rating_band, payload, created_at)
+            SELECT 'distress_cleared', :stage, b.uprn, b.company_number, b.local_authority, b.asset_rating_band,
+                   json_object('uprn', b.uprn, 'previous_band', b.asset_rating_band), :now
+            FROM temp_distress_before b
+            WHERE NOT EXISTS (SELECT 1 FROM distress_assets d WHERE d.uprn = b.uprn)
+        """), params)
+    if baseline["dossier"]:
+        conn.execute(text(f"""
+            INSERT INTO change_events (event_type, stage, uprn, company_number, local_authority, asset_rating_band, payload, created_at)
+            SELECT 'consent_lapsing', :stage, p.uprn, p.company_number, p.local_authority, p.asset_rating_band,
+                   json_object('uprn', p.uprn, 'address', p.address, 'postcode', p.postcode,
+                               'application_id', p.planning_application_id, 'status', p.planning_status,
+                               'decision_date', p.planning_decision_date, 'expiry_date', p.planning_expiry_date), :now
+            FROM property_dossier p
+            WHERE p.planning_lapsing_soon = 1
+              AND NOT EXISTS (SELECT 1 FROM temp_lapsing_before b WHERE b.uprn = p.uprn) {scope.format(alias='p')}
+        """), params)
+    conn.execute(text("DROP TABLE temp_distress_before"))
+    conn.execute(text("DROP TABLE temp_lapsing_before"))
+
+def post_ingest(engine, stage, touched_uprns=None, reindex_addresses=True):
+    """
+    Called at the end of every ingest: refreshes the derived tables (distress view,
+    map tile pyramid, property dossier, distress scores, director portfolios, address
+    search index), records what changed in change_events and logs the run.
+    Pass the UPRNs the stage changed for an incremental refresh (uprns_for() maps title
+    and company keys to them), or None to rebuild everything. Stages that can't change
+    an address (e.g. a company-status reload) pass reindex_addresses=False.
+    """
+    # Imported here: build_director_network depends on this module (via enrich_owners)
+    from build_director_network import refresh_affected_portfolios
+
+    touched = None if touched_uprns is None else list(touched_uprns)
+    with engine.connect() as conn:
+        ensure_tables(conn)
+        if touched is None:
+            baseline = snapshot_signals(conn)
+            refresh_distress_assets(conn)
+            assign_tiles(conn)
+            conn.execute(text("DELETE FROM distress_tiles"))
+            apply_tile_delta(conn, 1)
+            refresh_property_dossier(conn)
+            refresh_scores(conn)
+            refresh_affected_portfolios(conn)
+            refresh_address_index(conn)
+            emit_change_events(conn, stage, baseline)
+        elif touched:
+            stage_touched_uprns(conn, touched)
+            baseline = snapshot_signals(conn, incremental=True)
+            apply_tile_delta(conn, -1, incremental=True)
+            refresh_distress_assets(conn, incremental=True)
+            assign_tiles(conn)
+            apply_tile_delta(conn, 1, incremental=True)
+            # First run on an existing database: the dossier and search index have to be built in full once
+            dossier_empty = conn.execute(text("SELECT NOT EXISTS (SELECT 1 FROM property_dossier)")).scalar()
+            refresh_property_dossier(conn, incremental=not dossier_empty)
+            refresh_scores(conn, None if dossier_empty else touched)
+            refresh_aging_scores(conn)
+            refresh_affected_portfolios(conn, incremental=True)
+            if reindex_addresses:
+                index_empty = conn.execute(text("SELECT NOT EXISTS (SELECT 1 FROM address_fts)")).scalar()
+                refresh_address_index(conn, incremental=not index_empty)
+            emit_change_events(conn, stage, baseline, incremental=True)
+            conn.execute(text("DROP TABLE temp_touched_uprns"))
+        elif reindex_addresses:
+            # Nothing to rescore, but new rows without a UPRN (CCOD stubs) still need indexing
+            stage_touched_uprns(conn, [])
+            refresh_address_index(conn, incremental=True)
+            conn.execute(text("DROP TABLE temp_touched_uprns"))
+        rows = conn.execute(text("SELECT COUNT(*) FROM distress_assets")).scalar()
+        record_run(conn, stage, None if touched is None else len(touched), rows)
+        conn.commit()
+
+    scope = "full rebuild" if touched is None else f"{len(touched)} UPRNs"
+    print(f"🧮 Distress view, tiles, dossier, scores{' + address index' if reindex_addresses else ''} refreshed ({scope}): {rows} distressed assets.")
+    publish_if_serving(engine.url.database)
+
+def record_run(conn, stage, touched_count=None, distress_rows=None):
+    """
+    Logs the run, announces it on the change feed and prunes expired events.
+    """
+    now = datetime.now()
+    params = {
+        "stage": stage,
+        "touched": touched_count,
+        "rows": distress_rows,
+        "now": now.isoformat(timespec='seconds')
+    }
+    run_id = conn.execute(text("""
+        INSERT INTO ingest_runs (stage, touched_count, distress_rows, finished_at)
+        VALUES (:stage, :touched, :rows, :now)
+    """), params).lastrowid
+    conn.execute(text("""
+        INSERT INTO change_events (event_type, stage, payload, created_at)
+        VALUES ('run_finished', :stage,
+                json_object('run_id', :run_id, 'touched_count', :touched, 'distress_rows', :rows), :now)
+    """), {**params, "run_id": run_id})
+    conn.execute(text("DELETE FROM change_events WHERE created_at < :cutoff"), {
+        "cutoff": (now - timedelta(days=EVENT_RETENTION_DAYS)).isoformat(timespec='seconds')
+    })
+
+def bump_generation(engine, stage):
+    """
+    For stages that don't feed the distress view: logs the run so the data
+    generation moves on and API caches keyed on it are invalidated.
+    """
+    with engine.connect() as conn:
+        ensure_tables(conn)
+        record_run(conn, stage, touched_count=0)
+        conn.commit()
+    publish_if_serving(engine.url.database)
+
+def current_generation(conn):
+    """
+    The data generation = the latest ingest run. None on a pre-pipeline database.
+    """
+    try:
+        return conn.execute(text("SELECT MAX(run_id) FROM ingest_runs")).scalar()
+    except Exception:
+        return None